@@ -0,0 +1,110 @@
+import os
+import shutil
+import argparse
+import itertools
+import statistics
+from filters import prepare_output_folders, resolve_filters
+from benchmark import run_backend
+from cpu_affinity import CoreUtilization, describe_cpus, effective_cpu_count, can_pin, thread_cap_mechanism
+from run_options import image_source_from_args
+
+# AFFINITY BENCHMARK
+# Runs the same images through a process pool unpinned (the OS moves workers
+# between cores freely) and pinned (every worker bound to its own core set,
+# library threads capped), at several worker counts, and reports time,
+# throughput and how evenly the cores were used. Oversubscription shows up
+# at worker counts above the CPU count: unpinned workers share all cores,
+# pinned ones share theirs round robin.
+
+
+def time_mode(backend, workers, image_paths, output_folder, task_options, repeats, pin, threads):
+    """Median seconds over repeats (after one warmup), and the per-core utilization of the timed runs."""
+    shutil.rmtree(output_folder, ignore_errors=True)
+    prepare_output_folders(output_folder, task_options["filters"])
+    run_args = (backend, workers, image_paths, output_folder, task_options, "pillow", None,
+                None, None, None, None, False, None, pin, threads)
+    run_backend(*run_args)
+    cores = CoreUtilization()
+    times = []
+    for _ in range(repeats):
+        seconds, success, failed = run_backend(*run_args)
+        if failed:
+            print(f"❌ {failed} image(s) failed in the {'pinned' if pin else 'unpinned'} run")
+        times.append(seconds)
+    cores.finish()
+    return statistics.median(times), cores
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pinned vs unpinned worker pools")
+    parser.add_argument("--backend", choices=["multiprocessing", "concurrent"], default="multiprocessing")
+    parser.add_argument("--workers", default=None,
+                        help="Comma separated worker counts (default: half, 1x and 2x the usable CPUs)")
+    parser.add_argument("--worker-threads", type=int, default=1,
+                        help="Library threads per worker in the pinned runs")
+    parser.add_argument("--images", type=int, default=0, help="Images to use (0 = all)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per configuration (median kept)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = os.path.join(project_root, "input_images")
+    OUTPUT_FOLDER = os.path.join(project_root, "output_benchmark")
+
+    if not os.path.exists(INPUT_FOLDER):
+        print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
+        return
+    image_source = image_source_from_args(argparse.Namespace(scan_threads=0, file_index=None),
+                                          INPUT_FOLDER, project_root)
+    image_paths = list(itertools.islice(image_source, args.images or None))
+    if not image_paths:
+        print(f"No images found. Please add images to 'input_images' folder.")
+        return
+
+    cpus = effective_cpu_count()
+    if args.workers:
+        counts = [int(count) for count in args.workers.split(",")]
+    else:
+        counts = sorted({max(1, cpus // 2), cpus, cpus * 2})
+
+    print(f"\n{'='*60}")
+    print(f"Affinity Benchmark: {args.backend} | {len(image_paths)} images | workers {counts}")
+    print(f"CPUs: {describe_cpus()}")
+    if not can_pin():
+        print("Pinning unavailable (no os.sched_setaffinity): pinned runs only cap library threads")
+    if args.worker_threads:
+        print(f"Library threads (pinned runs): {args.worker_threads} per worker via "
+              f"{thread_cap_mechanism() or 'nothing (numpy already loaded, threadpoolctl not installed)'}")
+    print(f"{'='*60}")
+
+    task_options = {"filters": resolve_filters(None)}
+    rows = []
+    for workers in counts:
+        for label, pin, threads in (("unpinned", False, None), ("pinned", True, args.worker_threads)):
+            output_folder = os.path.join(OUTPUT_FOLDER, f"affinity_{label}_{workers}")
+            seconds, cores = time_mode(args.backend, workers, image_paths, output_folder, task_options,
+                                       args.repeats, pin, threads)
+            rows.append((workers, label, seconds, cores))
+            shutil.rmtree(output_folder, ignore_errors=True)
+
+    print(f"{'Workers':<7} | {'Mode':<8} | {'Median (s)':<10} | {'Images/s':<8} | {'Cores busy':<10} | {'Spread':<6}")
+    print(f"{'-'*60}")
+    for workers, label, seconds, cores in rows:
+        mean = f"{cores.mean() * 100:.0f}%" if cores.usage else "-"
+        spread = f"{(max(cores.usage.values()) - min(cores.usage.values())) * 100:.0f}" if cores.usage else "-"
+        print(f"{workers:<7} | {label:<8} | {seconds:<10.4f} | {len(image_paths) / seconds:<8.1f} | "
+              f"{mean:<10} | {spread:<6}")
+    print(f"{'='*60}")
+    print("Cores busy = mean utilization of the usable cores over the timed runs (from /proc/stat); "
+          "spread = busiest minus idlest core, in points")
+    for workers, label, seconds, cores in rows:
+        if label == "pinned":
+            print(f"\nPer-core utilization, {workers} pinned worker(s):")
+            cores.print_report(indent="   ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import uuid
+import threading
+import concurrent.futures
+import numpy as np
+from filters import resolve_filters, decoded_size
+from numpy_engine import output_filename
+from scheduling import read_dimensions, HEADER_THREADS
+
+# MEMORY-MAPPED ARRAY OUTPUT STORE (--array-store)
+# A training pipeline that reads the JPEG outputs decodes them again right
+# away, so every output pays a lossy JPEG encode and decode for nothing.
+# Instead, the filtered pixels go straight into raw uint8 arrays:
+#   - before the run the parent reads every header (no decoding), works out
+#     the shape of each output and preallocates one .npy per filter in
+#     output/array_store/: one (N, H, W[, C]) array when every image has the
+#     same size ("fixed" layout), otherwise a flat array holding every image
+#     back to back ("chunked" layout, with an offset and shape per image)
+#   - index.json lists the output names in slot order (plus offsets and
+#     shapes for chunked stores); it is written first, so workers look up
+#     their slot in it and copy the pixels straight into the memory map
+#   - written.npy holds one flag per image and filter, set once a slot is
+#     filled, so readers can tell finished slots from failed ones
+# Readers map the files read-only: ArrayStore(folder).get("blur", name) is a
+# view into the page cache, not a copy.
+
+STORE_FOLDER = "array_store"
+INDEX_NAME = "index.json"
+WRITTEN_NAME = "written.npy"
+STORE_VERSION = 1
+
+
+def channels(name):
+    """grayscale and edge are single-channel (mode "L"); the rest are RGB."""
+    return 1 if name in ("grayscale", "edge") else 3
+
+
+def output_shape(size, name):
+    width, height = size
+    return (height, width) if channels(name) == 1 else (height, width, 3)
+
+
+# Header sizes already read by this process (trials of one run reuse them)
+_sizes = {}
+
+
+def read_sizes(image_paths, threads=HEADER_THREADS):
+    missing = [path for path in image_paths if path not in _sizes]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        _sizes.update(zip(missing, executor.map(read_dimensions, missing)))
+    return [_sizes[path] for path in image_paths]
+
+
+def preallocate(path, shape):
+    """Creates a zero-filled uint8 .npy (sparse until written: nothing is copied to disk yet)."""
+    np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape).flush()
+
+
+def begin_array_store(output_folder, task_options, image_paths):
+    """
+    Parent side, before every run with --array-store: preallocates the store for
+    these images and returns (task options pointing workers at it, image paths as a list).
+    Images whose header cannot be read get no slot (their task reports an error).
+    """
+    if not task_options or not task_options.get("array_store"):
+        return task_options, image_paths
+    image_paths = list(image_paths)
+    filters = resolve_filters(task_options.get("filters"))
+    max_side = task_options.get("max_side")
+    folder = os.path.join(output_folder, STORE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    for name in os.listdir(folder): # the previous run's store
+        os.remove(os.path.join(folder, name))
+
+    names = []
+    sizes = []
+    for path, size in zip(image_paths, read_sizes(image_paths)):
+        if size:
+            names.append(output_filename(path))
+            sizes.append(decoded_size(size, max_side))
+    layout = "fixed" if len(set(sizes)) == 1 else "chunked"
+    index = {"version": STORE_VERSION, "run": uuid.uuid4().hex[:8], "layout": layout,
+             "filters": list(filters), "names": names, "arrays": {}}
+    for name in filters:
+        shapes = [output_shape(size, name) for size in sizes]
+        entry = {"file": f"{name}.npy"}
+        if layout == "fixed":
+            shape = (len(names),) + shapes[0]
+            entry["shape"] = shape
+        else:
+            counts = [int(np.prod(shape)) for shape in shapes]
+            entry["offsets"] = [int(offset) for offset in np.cumsum([0] + counts[:-1])] if counts else []
+            entry["shapes"] = shapes
+            shape = (max(sum(counts), 1),)
+        preallocate(os.path.join(folder, entry["file"]), shape)
+        index["arrays"][name] = entry
+    preallocate(os.path.join(folder, WRITTEN_NAME), (max(len(names), 1), len(filters)))
+    with open(os.path.join(folder, INDEX_NAME), 'w') as f:
+        json.dump(index, f)
+    return dict(task_options, array_store=(folder, index["run"])), image_paths
+
+
+class ArrayStore:
+    """
+    A store opened by a worker (mode "r+") or a reader (mode "r").
+    get() returns views into the memory maps, never copies.
+    """
+
+    def __init__(self, folder, mode="r"):
+        self.folder = folder
+        with open(os.path.join(folder, INDEX_NAME), 'r') as f:
+            index = json.load(f)
+        self.run = index["run"]
+        self.layout = index["layout"]
+        self.filters = index["filters"]
+        self.names = index["names"]
+        self.slots = {name: slot for slot, name in enumerate(self.names)}
+        # Duplicate inputs (--dedup) share the slot of the image that was processed
+        self.slots.update({alias: self.slots[name] for alias, name in index.get("aliases", {}).items()
+                           if name in self.slots})
+        self.entries = index["arrays"]
+        self.arrays = {name: np.load(os.path.join(folder, entry["file"]), mmap_mode=mode)
+                       for name, entry in self.entries.items()}
+        self.written = np.load(os.path.join(folder, WRITTEN_NAME), mmap_mode=mode)
+
+    def _view(self, filter_name, slot):
+        entry = self.entries[filter_name]
+        if self.layout == "fixed":
+            return self.arrays[filter_name][slot]
+        offset = entry["offsets"][slot]
+        shape = tuple(entry["shapes"][slot])
+        return self.arrays[filter_name][offset:offset + int(np.prod(shape))].reshape(shape)
+
+    def put(self, filter_name, name, pixels):
+        slot = self.slots.get(name)
+        if slot is None:
+            raise KeyError(f"{name} has no slot in the array store (unreadable header?)")
+        view = self._view(filter_name, slot)
+        if view.shape != pixels.shape:
+            raise ValueError(f"{name}: {filter_name} output is {pixels.shape}, the store slot is {view.shape}")
+        view[...] = pixels
+        self.written[slot, self.filters.index(filter_name)] = 1
+
+    def get(self, filter_name, name):
+        """(H, W) or (H, W, 3) uint8 view of one output."""
+        slot = self.slots[name]
+        if not self.written[slot, self.filters.index(filter_name)]:
+            raise KeyError(f"{name} was not written to {filter_name} (its task failed)")
+        return self._view(filter_name, slot)
+
+    def complete(self):
+        """Number of images with every filter written."""
+        return int(self.written[:len(self.names)].all(axis=1).sum())
+
+
+# Stores opened by this process: (pid, folder, run id) -> ArrayStore
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _worker_store(folder, run):
+    key = (os.getpid(), folder, run)
+    with _stores_lock:
+        if key not in _stores:
+            # A new run (persistent pool): the old maps point at replaced files
+            for old_key in [old for old in _stores if old[:2] == key[:2]]:
+                del _stores[old_key]
+            _stores[key] = ArrayStore(folder, mode="r+")
+        return _stores[key]
+
+
+def store_save_func(array_store):
+    """
+    save_func(img, path) for array_store = (store folder, run id) from begin_array_store:
+    copies the pixels into the image's slot instead of encoding them.
+    """
+    def save(img_obj, save_path):
+        filter_folder, name = os.path.split(save_path)
+        _worker_store(*array_store).put(os.path.basename(filter_folder), name, np.asarray(img_obj))
+    return save
+
+
+def describe_store(folder):
+    store = ArrayStore(folder)
+    size_mb = sum(array.nbytes for array in store.arrays.values()) / 1024 / 1024
+    return (f"{store.complete()}/{len(store.names)} images, {store.layout} layout, "
+            f"{size_mb:.1f} MB in {len(store.arrays)} arrays")
+
+
+if __name__ == "__main__":
+    # Summary of a store, e.g. python3 src/array_store.py output_serial/array_store
+    store = ArrayStore(sys.argv[1])
+    print(f"{sys.argv[1]}: {describe_store(sys.argv[1])}")
+    for name, array in store.arrays.items():
+        print(f"   {name:<11} {store.entries[name]['file']:<16} {array.shape} {array.dtype}")
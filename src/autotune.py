@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import argparse
+import itertools
+import statistics
+from filters import prepare_output_folders
+from scheduling import apply_schedule
+from benchmark import run_backend, environment_info
+from cpu_affinity import effective_cpu_count
+from run_options import (add_processing_arguments, add_dispatch_arguments, add_startup_arguments,
+                         task_options_from_args, print_run_options, input_folder_from_args, image_source_from_args,
+                         tuned_config_path, persistent_from_args)
+
+# WORKER-COUNT / CHUNK-SIZE AUTOTUNER
+# The run scripts test a fixed [2, 4, 8]. This sweeps a sample of the dataset:
+#   - worker counts from 1 up to 2 x the usable CPUs (every count up to 4,
+#     then doubling, plus 0.5x / 1x / 1.5x / 2x the CPU count)
+#   - every chunk size in --chunksizes at each count, keeping the best
+#   - the sweep stops early once throughput stops improving by more than
+#     --plateau for --patience counts in a row
+# Speedups (against the 1 worker run) are fitted with:
+#   Amdahl:    S(n) = 1 / (s + (1 - s) / n)  -> serial fraction s for a fixed workload
+#   Gustafson: S(n) = n - s (n - 1)          -> serial fraction if the work grew with n
+# The best configuration is saved per backend to results/autotune_best.json;
+# the run scripts use it with --workers tuned. The full curve is plotted by
+# create_graphs.py from results/autotune_<timestamp>.json.
+
+DEFAULT_SAMPLE = 64
+DEFAULT_PLATEAU = 0.05 # minimum relative throughput gain that counts as improving
+DEFAULT_PATIENCE = 2
+
+
+def worker_counts(max_workers, cpus):
+    """1, 2, 3, 4, 8, 16, ... plus fractions of the CPU count, up to max_workers."""
+    counts = {1, 2, 3, 4}
+    counts |= {2 ** i for i in range(max_workers.bit_length() + 1)}
+    counts |= {max(1, cpus // 2), cpus, cpus * 3 // 2, cpus * 2}
+    return sorted(count for count in counts if count <= max_workers)
+
+
+def fit_amdahl(points):
+    """Least-squares serial fraction from (workers, speedup): 1/S - 1/n = s (1 - 1/n)."""
+    xs = [1 - 1 / n for n, _ in points]
+    ys = [1 / speedup - 1 / n for n, speedup in points]
+    denominator = sum(x * x for x in xs)
+    return min(max(sum(x * y for x, y in zip(xs, ys)) / denominator, 0.0), 1.0) if denominator else None
+
+
+def fit_gustafson(points):
+    """Least-squares serial fraction from (workers, speedup): n - S = s (n - 1)."""
+    xs = [n - 1 for n, _ in points]
+    ys = [n - speedup for n, speedup in points]
+    denominator = sum(x * x for x in xs)
+    return min(max(sum(x * y for x, y in zip(xs, ys)) / denominator, 0.0), 1.0) if denominator else None
+
+
+def amdahl_speedup(n, serial_fraction):
+    return 1 / (serial_fraction + (1 - serial_fraction) / n)
+
+
+def gustafson_speedup(n, serial_fraction):
+    return n - serial_fraction * (n - 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sweep worker counts and chunk sizes, fit Amdahl/Gustafson")
+    add_processing_arguments(parser)
+    add_dispatch_arguments(parser, in_memory=False)
+    add_startup_arguments(parser)
+    parser.add_argument("--backend", choices=["multiprocessing", "concurrent"], default="multiprocessing",
+                        help="Pool whose configuration is tuned")
+    parser.add_argument("--sample", type=int, default=DEFAULT_SAMPLE,
+                        help="Number of images to tune on (0 = the whole dataset)")
+    parser.add_argument("--max-workers", type=int, default=None,
+                        help="Largest worker count to try (default: 2 x CPU count)")
+    parser.add_argument("--chunksizes", default="auto,1,4,16",
+                        help="Comma separated chunk sizes to try at every worker count (auto = auto-tuned)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per configuration (median kept)")
+    parser.add_argument("--plateau", type=float, default=DEFAULT_PLATEAU,
+                        help="Stop when throughput improves by less than this fraction...")
+    parser.add_argument("--patience", type=int, default=DEFAULT_PATIENCE,
+                        help="...for this many worker counts in a row")
+    parser.add_argument("--no-apply", action="store_true",
+                        help="Only recommend: do not save the best configuration for --workers tuned")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cpus = effective_cpu_count() # within the cgroup CPU quota
+    max_workers = args.max_workers or 2 * cpus
+    chunksizes = [None if value.strip() == "auto" else int(value) for value in args.chunksizes.split(",")]
+
+    print(f"\n{'='*60}")
+    print(f"Autotune: {args.backend} | 1..{max_workers} workers | chunk sizes {args.chunksizes}")
+    print(f"{'='*60}")
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = input_folder_from_args(args, project_root) # input_images, or --input-shards
+    OUTPUT_FOLDER = os.path.join(project_root, "output_benchmark")
+    RESULTS_FOLDER = os.path.join(project_root, "results")
+
+    args.trace = None
+    task_options = task_options_from_args(args, project_root)
+    print_run_options(args, task_options)
+    persistent = persistent_from_args(args, task_options)
+
+    if not os.path.exists(INPUT_FOLDER):
+        print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
+        return
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    prepare_output_folders(OUTPUT_FOLDER, task_options["filters"])
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+
+    # A sample spread over the first folders is enough to see the scaling curve
+    image_source = image_source_from_args(args, INPUT_FOLDER, project_root)
+    image_paths = list(itertools.islice(image_source, args.sample or None))
+    if not image_paths:
+        print(f"No images found. Please add images to 'input_images' folder.")
+        return
+    image_paths, costs = apply_schedule(args.schedule, image_paths, args.max_side)
+    print(f"Tuning on {len(image_paths)} images\n")
+
+    def measure(workers, chunksize):
+        run_args = (args.backend, workers, image_paths, OUTPUT_FOLDER, task_options, args.engine, args.batch_size,
+                    chunksize, args.max_in_flight, costs, args.start_method, persistent, max_workers,
+                    args.pin, args.worker_threads)
+        # One untimed warmup, then the median of the repeats
+        run_backend(*run_args)
+        times = [run_backend(*run_args)[0] for _ in range(args.repeats)]
+        return statistics.median(times)
+
+    rows = []
+    best_by_count = {}
+    stalled = 0
+    best_throughput = 0.0
+    for workers in worker_counts(max_workers, cpus):
+        for chunksize in chunksizes:
+            seconds = measure(workers, chunksize)
+            row = {"workers": workers, "chunksize": chunksize, "median_s": seconds,
+                   "images_per_s": len(image_paths) / seconds}
+            rows.append(row)
+            if workers not in best_by_count or seconds < best_by_count[workers]["median_s"]:
+                best_by_count[workers] = row
+        best = best_by_count[workers]
+        print(f"   {workers:>3} workers: {best['images_per_s']:8.1f} images/s "
+              f"(chunksize {best['chunksize'] or 'auto'}, {best['median_s']:.4f}s)")
+
+        # Plateau detection on the best throughput seen so far
+        if best["images_per_s"] > best_throughput * (1 + args.plateau):
+            stalled = 0
+        else:
+            stalled += 1
+        best_throughput = max(best_throughput, best["images_per_s"])
+        if stalled >= args.patience:
+            print(f"   Throughput plateaued (< {args.plateau:.0%} gain for {args.patience} counts), stopping")
+            break
+
+    # Speedup of the best configuration at every count, against 1 worker
+    base = best_by_count[1]["median_s"]
+    points = [(workers, base / row["median_s"]) for workers, row in sorted(best_by_count.items())]
+    amdahl = fit_amdahl(points)
+    gustafson = fit_gustafson(points)
+    # Fewest workers within the plateau tolerance of the top throughput (extra workers only cost memory)
+    top = max(row["images_per_s"] for row in best_by_count.values())
+    best = min((row for row in best_by_count.values() if row["images_per_s"] * (1 + args.plateau) >= top),
+               key=lambda row: row["workers"])
+
+    print(f"{'-'*60}")
+    print(f"{'Workers':<8} | {'Chunk':<6} | {'Images/s':<9} | {'Speedup':<7} | {'Amdahl':<7} | {'Gustafson':<9}")
+    print(f"{'-'*60}")
+    for workers, speedup in points:
+        row = best_by_count[workers]
+        amdahl_fit = f"{amdahl_speedup(workers, amdahl):.2f}" if amdahl is not None else "-"
+        gustafson_fit = f"{gustafson_speedup(workers, gustafson):.2f}" if gustafson is not None else "-"
+        print(f"{workers:<8} | {str(row['chunksize'] or 'auto'):<6} | {row['images_per_s']:<9.1f} | "
+              f"{speedup:<7.2f} | {amdahl_fit:<7} | {gustafson_fit:<9}")
+    print(f"{'-'*60}")
+    if amdahl is not None:
+        print(f"Amdahl serial fraction: {amdahl:.3f} (max speedup {1 / amdahl if amdahl else float('inf'):.1f}x)")
+        print(f"Gustafson serial fraction: {gustafson:.3f}")
+    else:
+        print("Only one worker count measured: no scaling fit")
+    print(f"Recommended: {best['workers']} workers, chunksize {best['chunksize'] or 'auto'} "
+          f"({best['images_per_s']:.1f} images/s)")
+
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    report = {
+        "environment": environment_info(project_root),
+        "config": {"backend": args.backend, "engine": args.engine, "num_images": len(image_paths),
+                   "chunksizes": args.chunksizes, "repeats": args.repeats, "schedule": args.schedule},
+        "results": rows,
+        "best_by_workers": [best_by_count[workers] for workers, _ in points],
+        "fit": {"amdahl_serial_fraction": amdahl, "gustafson_serial_fraction": gustafson},
+        "recommended": {"workers": best["workers"], "chunksize": best["chunksize"]},
+    }
+    report_path = os.path.join(RESULTS_FOLDER, f"autotune_{timestamp}.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{'='*60}")
+    print(f"✅ Saved to: {report_path}")
+
+    if not args.no_apply:
+        # One entry per backend, read by the run scripts with --workers tuned
+        tuned_path = tuned_config_path(project_root)
+        tuned = {}
+        if os.path.exists(tuned_path):
+            with open(tuned_path, 'r') as f:
+                tuned = json.load(f)
+        tuned[args.backend] = dict(report["recommended"], engine=args.engine, tuned_at=report["environment"]["timestamp"])
+        with open(tuned_path, 'w') as f:
+            json.dump(tuned, f, indent=2)
+        print(f"✅ Applied: python3 src/{'multiprocessing_image' if args.backend == 'multiprocessing' else 'concurrent_futures'}.py "
+              f"--workers tuned now uses {best['workers']} workers")
+
+    from create_graphs import create_scaling_chart
+    create_scaling_chart(report_path)
+
+
+if __name__ == "__main__":
+    main()
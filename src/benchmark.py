@@ -0,0 +1,316 @@
+import os
+import sys
+import csv
+import json
+import math
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+import multiprocessing
+import concurrent.futures
+from filters import prepare_output_folders
+from writer import close_writer, shared_error_count
+from scheduling import apply_schedule, item_costs
+from dispatch import make_work, known_total, ChunkSizer, stream_pool_results, stream_executor_results
+from worker_pool import worker_pool, in_flight_limit
+from shards import begin_shard_run, write_shard_index
+from cpu_affinity import cgroup_cpu_quota
+from run_options import (add_processing_arguments, add_dispatch_arguments, add_startup_arguments,
+                         task_options_from_args, print_run_options, input_folder_from_args, image_source_from_args,
+                         persistent_from_args)
+
+# UNIFIED BENCHMARK HARNESS
+# Runs every backend over the same images and worker counts with warmup runs
+# followed by N timed repetitions (time.perf_counter), and records per
+# configuration: mean, median, standard deviation and a 95% confidence
+# interval, together with the environment and git commit the numbers came
+# from. Results are saved as JSON and/or CSV in results/, and create_graphs.py
+# plots straight from those files. Success / failed counts add up every timed
+# repetition. With --cache the warmup fills the result cache, so the timed runs
+# measure cache hits: the report records "cache": "warm" and the cache is
+# always warmed (even with --warmup 0), so every repetition sees the same state.
+
+BACKENDS = ("serial", "multiprocessing", "concurrent", "threads")
+
+# Two-sided 95% Student t critical values by degrees of freedom (normal above 30)
+T_CRITICAL_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+                 8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145,
+                 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086, 25: 2.060,
+                 30: 2.042}
+
+
+def t_critical(df):
+    if df > 30:
+        return 1.960
+    # Largest tabulated df not above df (slightly conservative in between)
+    return T_CRITICAL_95[max(d for d in T_CRITICAL_95 if d <= df)]
+
+
+def summarize(times):
+    """Mean, median, sample standard deviation and 95% confidence interval of the mean."""
+    mean = statistics.mean(times)
+    stdev = statistics.stdev(times) if len(times) > 1 else 0.0
+    half_width = t_critical(len(times) - 1) * stdev / math.sqrt(len(times)) if len(times) > 1 else 0.0
+    return {
+        "mean_s": mean,
+        "median_s": statistics.median(times),
+        "stdev_s": stdev,
+        "min_s": min(times),
+        "max_s": max(times),
+        "ci95_low_s": mean - half_width,
+        "ci95_high_s": mean + half_width,
+    }
+
+
+def git_sha(project_root):
+    """Commit of the code being measured ('-dirty' if there are uncommitted changes)."""
+    try:
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=project_root,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=project_root,
+                               capture_output=True, text=True).stdout.strip()
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment_info(project_root):
+    import numpy
+    import PIL
+    info = {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__,
+        "cpu_count": os.cpu_count(),
+        "start_method": multiprocessing.get_start_method(),
+        "git_sha": git_sha(project_root),
+        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    if hasattr(os, "sched_getaffinity"):
+        info["usable_cpus"] = len(os.sched_getaffinity(0))
+    info["cgroup_cpu_quota"] = cgroup_cpu_quota()
+    return info
+
+
+def run_backend(backend, num_workers, image_paths, output_folder, task_options, engine,
+                batch_size, chunksize=None, max_in_flight=None, costs=None,
+                start_method=None, persistent=False, reserve=None, pin=False, worker_threads=None):
+    """
+    One timed run. Returns (seconds, success count, fail count).
+    With persistent=True the process pool is reused by later runs (see worker_pool).
+    pin / worker_threads set up every pool worker (see cpu_affinity).
+    """
+    start = time.perf_counter()
+    task_options = begin_shard_run(output_folder, task_options) # fresh output shards per run (--shard-output)
+    if task_options.get("array_store"):
+        from array_store import begin_array_store # numpy is only loaded for the array store
+        task_options, image_paths = begin_array_store(output_folder, task_options, image_paths) # preallocated
+    worker_func, items = make_work(engine, image_paths, output_folder, task_options, batch_size)
+    sizer = ChunkSizer(num_workers, total=known_total(items), chunksize=chunksize,
+                       costs=item_costs(items, costs) if costs else None)
+
+    worker_write_errors = 0 # failed background writes reported by pool workers at exit
+    if backend == "serial":
+        results = []
+        for item in items:
+            result = worker_func(item)
+            results.extend(result if isinstance(result, list) else [result])
+    elif backend == "threads":
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(stream_executor_results(executor, worker_func, items, sizer, max_in_flight))
+    else:
+        # A fresh pool is closed and joined inside the timing, so background writers flush
+        kind = "pool" if backend == "multiprocessing" else "executor"
+        stream = stream_pool_results if kind == "pool" else stream_executor_results
+        error_count = shared_error_count() if task_options.get("async_write") and not persistent else None
+        with worker_pool(kind, num_workers, start_method, persistent, reserve,
+                         pin, worker_threads, error_count) as (pool, limit):
+            results = list(stream(pool, worker_func, items, sizer, in_flight_limit(max_in_flight, limit)))
+        if error_count is not None:
+            worker_write_errors = error_count.value
+
+    # Serial and thread runs share this process's writer
+    _, write_errors = close_writer()
+    if task_options.get("shard_output"):
+        write_shard_index(output_folder)
+    duration = time.perf_counter() - start
+
+    success = sum(1 for result in results if result.get("status") == "Success")
+    return duration, success, len(results) - success + len(write_errors) + worker_write_errors
+
+
+def save_results(report, output_base, formats):
+    """Writes <output_base>.json and/or .csv. Returns the written paths."""
+    paths = []
+    if "json" in formats:
+        path = output_base + ".json"
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        paths.append(path)
+    if "csv" in formats:
+        path = output_base + ".csv"
+        env = report["environment"]
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            columns = ["backend", "workers", "repeats", "mean_s", "median_s", "stdev_s", "min_s", "max_s",
+                       "ci95_low_s", "ci95_high_s", "speedup", "efficiency", "success", "failed"]
+            writer.writerow(columns + ["engine", "num_images", "git_sha", "hostname", "cpu_count", "timestamp"])
+            for row in report["results"]:
+                writer.writerow([row[c] for c in columns] +
+                                [report["config"]["engine"], report["config"]["num_images"], env["git_sha"],
+                                 env["hostname"], env["cpu_count"], env["timestamp"]])
+        paths.append(path)
+    return paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Unified benchmark: repeated trials of every backend")
+    add_processing_arguments(parser, backends_flag="--filter-backends")
+    add_dispatch_arguments(parser, in_memory=False)
+    add_startup_arguments(parser)
+    parser.add_argument("--backends", default=",".join(BACKENDS[:3]),
+                        help=f"Comma separated backends to run ({', '.join(BACKENDS)})")
+    parser.add_argument("--workers", default="2,4,8",
+                        help="Comma separated worker counts for the parallel backends")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="Untimed runs before the repetitions of every configuration")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="Timed repetitions of every configuration")
+    parser.add_argument("--format", choices=["json", "csv", "both"], default="both")
+    parser.add_argument("--output", default=None,
+                        help="Output path without extension (default: results/benchmark_<timestamp>)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    for backend in backends:
+        if backend not in BACKENDS:
+            print(f"❌ Error: unknown backend '{backend}' (choose from {', '.join(BACKENDS)})")
+            sys.exit(1)
+    worker_counts = [int(n) for n in args.workers.split(",")]
+
+    print(f"\n{'='*60}")
+    print(f"Benchmark Harness: {', '.join(backends)} | {args.warmup} warmup + {args.repeats} runs")
+    print(f"{'='*60}")
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = input_folder_from_args(args, project_root) # input_images, or --input-shards
+    OUTPUT_FOLDER = os.path.join(project_root, "output_benchmark")
+    RESULTS_FOLDER = os.path.join(project_root, "results")
+
+    args.trace = None # timed repetitions are never traced (use the run scripts with --trace)
+    task_options = task_options_from_args(args, project_root)
+    print_run_options(args, task_options)
+    persistent = persistent_from_args(args, task_options)
+
+    if not os.path.exists(INPUT_FOLDER):
+        print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
+        return
+
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    prepare_output_folders(OUTPUT_FOLDER, task_options["filters"])
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+
+    image_paths = image_source_from_args(args, INPUT_FOLDER, project_root)
+    if image_paths.is_empty():
+        print(f"No images found. Please add images to 'input_images' folder.")
+        return
+
+    # Size-aware scheduling reads every header once, before all the runs
+    image_paths, costs = apply_schedule(args.schedule, image_paths, args.max_side)
+
+    environment = environment_info(project_root)
+    print(f"Commit: {environment['git_sha']} | CPUs: {environment['cpu_count']} | Python {environment['python']}")
+    print(f"{'-'*60}")
+
+    # With the result cache the timed runs measure cache hits: warm it first, always
+    warmup = args.warmup
+    if task_options["cache_dir"]:
+        warmup = max(warmup, 1)
+        print("Result cache: warm (the warmup fills it; timed runs measure cache hits, not filtering)")
+
+    # (backend, workers) configurations: serial runs once with 1 worker
+    configs = []
+    for backend in backends:
+        if backend == "serial":
+            configs.append((backend, 1))
+        else:
+            configs += [(backend, count) for count in worker_counts]
+
+    results = []
+    for backend, workers in configs:
+        print(f"   {backend} x {workers}...", end=" ", flush=True)
+        run_args = (backend, workers, image_paths, OUTPUT_FOLDER, task_options, args.engine, args.batch_size,
+                    args.chunksize, args.max_in_flight, costs, args.start_method, persistent, max(worker_counts),
+                    args.pin, args.worker_threads)
+        for _ in range(warmup):
+            run_backend(*run_args)
+        times = []
+        success = failed = 0 # over every timed repetition
+        for _ in range(args.repeats):
+            duration, run_success, run_failed = run_backend(*run_args)
+            times.append(duration)
+            success += run_success
+            failed += run_failed
+        row = {"backend": backend, "workers": workers, "repeats": len(times), "times_s": times}
+        row.update(summarize(times))
+        row.update({"success": success, "failed": failed})
+        results.append(row)
+        print(f"mean {row['mean_s']:.4f}s ± {row['stdev_s']:.4f} (95% CI {row['ci95_low_s']:.4f}-{row['ci95_high_s']:.4f})")
+        if failed:
+            print(f"      ❌ {failed} failed task(s) over {args.repeats} runs")
+
+    # Speedup and efficiency against the serial mean of this same run
+    serial_mean = next((row["mean_s"] for row in results if row["backend"] == "serial"), None)
+    for row in results:
+        row["speedup"] = serial_mean / row["mean_s"] if serial_mean else None
+        row["efficiency"] = row["speedup"] / row["workers"] if serial_mean else None
+
+    print(f"{'-'*60}")
+    print(f"{'Backend':<16} | {'Workers':<7} | {'Mean (s)':<9} | {'Median (s)':<10} | {'Speedup':<7}")
+    print(f"{'-'*60}")
+    for row in results:
+        speedup = f"{row['speedup']:.2f}" if row["speedup"] else "-"
+        print(f"{row['backend']:<16} | {row['workers']:<7} | {row['mean_s']:<9.4f} | {row['median_s']:<10.4f} | {speedup:<7}")
+
+    report = {
+        "environment": environment,
+        "config": {
+            "engine": args.engine,
+            "filters": list(task_options["filters"]),
+            "async_write": args.async_write,
+            "cache": "warm" if task_options["cache_dir"] else "off",
+            "max_side": args.max_side,
+            "backends": task_options["backends"],
+            "quality": task_options["quality"],
+            "chunksize": args.chunksize,
+            "warmup": warmup,
+            "repeats": args.repeats,
+            "schedule": args.schedule,
+            "start_method": args.start_method,
+            "persistent_pool": persistent,
+            "pin": args.pin,
+            "worker_threads": args.worker_threads,
+            "num_images": len(image_paths) if costs else image_paths.found,
+        },
+        "results": results,
+    }
+    output_base = args.output or os.path.join(RESULTS_FOLDER, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}")
+    formats = ["json", "csv"] if args.format == "both" else [args.format]
+    print(f"{'='*60}")
+    for path in save_results(report, output_base, formats):
+        print(f"✅ Saved to: {path}")
+    print(f"Plot with: python3 src/create_graphs.py {output_base}.{formats[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,190 @@
 import os
 import time # To measure exactly how long the code takes to run
-import concurrent.futures # A library that provides the ProcessPoolExecutor, which manages the worker processes
-from filters import process_image # Imports function that does the actual work (blurring, edges, etc.) from filters.py
+from worker_pool import worker_pool, in_flight_limit # Creates the ProcessPoolExecutor, which manages the worker processes
+from writer import shared_error_count # Failed background writes of the workers (--async-write)
+from filters import prepare_output_folders, output_save_func # filters.py does the actual work (blurring, edges, etc.)
 import csv
+import argparse
+from result_cache import print_cache_report, format_hit_rate # Content-addressed result cache
+from dispatch import make_work, known_total, ChunkSizer, stream_executor_results # Chunked, streaming task dispatch
+from stage_trace import StageRecorder, trace_base_path # Per-stage timings (--trace)
+from scheduling import apply_schedule, item_costs, ScheduleReport # Size-aware scheduling (--schedule lpt)
+from memory_stats import MemoryReport # Peak RSS of the parent and every worker
+from cpu_affinity import CoreUtilization # Per-core utilization (and --pin / --worker-threads)
+from shards import begin_shard_run, write_shard_index # Sharded archive output (--shard-output)
+from dedup import link_duplicates # Duplicate input detection (--dedup)
+import functools
+from run_options import (add_processing_arguments, add_dispatch_arguments,
+                         task_options_from_args, print_run_options,
+                         input_folder_from_args, image_source_from_args, trace_dir_from_args,
+                         add_tiling_arguments, tile_options_from_args,
+                         add_worker_arguments, worker_counts_from_args,
+                         add_startup_arguments, startup_options_from_args,
+                         add_dedup_arguments, dedup_from_args,
+                         baseline_options, baseline_mismatches, DEFAULT_BATCH_SIZE) # Shared command line options
 # Serial Benchmark Values Loader
-def load_serial_baseline():
-    """Load the serial baseline from CSV file."""
+def load_serial_baseline(options):
+    """Load the serial baseline from CSV file (it must be measured with the same result-changing options)."""
     try:
         script_dir = os.path.dirname(os.path.abspath(__file__))
         project_root = os.path.dirname(script_dir)
         baseline_path = os.path.join(project_root, "serial_baseline_value.csv")
 
         with open(baseline_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['metric'] == 'serial_baseline':
-                    return float(row['value'])
+            rows = {row['metric']: row['value'] for row in csv.DictReader(f)}
 
     except FileNotFoundError:
         print("❌ Error: serial_baseline_value.csv not found!")
         print("Please run serial_baseline.py first!")
         exit(1)
 
-    print("❌ Error: serial baseline not found in CSV!")
-    exit(1)
+    if 'serial_baseline' not in rows:
+        print("❌ Error: serial baseline not found in CSV!")
+        exit(1)
+
+    # A baseline of other work (another engine, --max-side, --cache, ...) would give a meaningless speedup
+    mismatches = baseline_mismatches(rows, options)
+    if mismatches:
+        print("❌ Error: the serial baseline was measured with other options!")
+        for name, saved, value in mismatches:
+            print(f"   {name}: {saved} (baseline) vs {value} (this run)")
+        print("Please run serial_baseline.py with the same options first!")
+        exit(1)
+    return float(rows['serial_baseline'])
 
 
 # Runs the image processing pipeline with a specific number of workers.
 # Returns the time taken.
-def run_test_with_workers(num_workers, image_paths, output_folder):
+def run_test_with_workers(num_workers, image_paths, output_folder, task_options=None,
+                          engine="pillow", batch_size=DEFAULT_BATCH_SIZE,
+                          chunksize=None, max_in_flight=None, frames=None, transport="shared",
+                          trace_dir=None, costs=None, tile_options=None, startup=None, dedup=None):
     
     print(f"   Testing with {num_workers} worker(s)...", end=" ", flush=True)
     
     start_time = time.time() # start timer
     
     success_count = 0
+    cache_hits = 0
+    cache_misses = 0
     fail_count = 0
     worker_stats = {} # Track how many tasks each worker (PID) processed for load balancing analysis
+    recorder = StageRecorder() if trace_dir else None # per-stage timings (--trace)
+    
+    # Worker function is process_image(file_path, output_folder, **task_options)
+    # (process_batch over batches of paths for the numpy engine)
+    task_options = task_options or {}
+    task_options = begin_shard_run(output_folder, task_options) # fresh output shards per trial (--shard-output)
+    if task_options.get("array_store"):
+        from array_store import begin_array_store # numpy is only loaded for the array store
+        task_options, image_paths = begin_array_store(output_folder, task_options, image_paths) # preallocated
+    job = None
+    splitter = None
+    if frames is not None:
+        # In-memory mode: frames were decoded by the parent, outputs stay in memory
+        from shared_transport import InMemoryJob
+        job = InMemoryJob(frames, transport, task_options.get("filters"), engine)
+        worker_func, items = job.worker_func, job.items
+    else:
+        if tile_options:
+            from tiling import LargeImageSplitter, process_tiled # numpy is only loaded for --tile
+            # Images above the threshold are held back and tiled across the pool at the end
+            splitter = LargeImageSplitter(image_paths, tile_options["threshold_mp"])
+            image_paths = splitter.normal_images()
+        worker_func, items = make_work(engine, image_paths, output_folder, task_options, batch_size)
+    # Size-aware scheduling: chunks are limited by estimated cost (--schedule lpt)
+    sizer = ChunkSizer(num_workers, total=known_total(items), chunksize=chunksize,
+                       costs=item_costs(items, costs) if costs and job is None else None)
+    schedule_report = ScheduleReport(num_workers) # makespan vs ideal, idle per worker
+    memory_report = MemoryReport() # peak RSS of the parent, each worker and the whole run
+    core_report = CoreUtilization() # how busy every core was during the run
     
     # concurrent.futures.ProcessPoolExecutor, hides the complexity of managing processes 
     # ProcessPoolExecutor creates a pool of worker processes
-    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
-        futures = []
-        for img_path in image_paths:
+    # (started with --start-method, and reused across trials with --persistent-pool)
+    # Failed background writes are only known when the workers exit (--async-write)
+    write_errors = shared_error_count() if task_options.get("async_write") else None
+    with worker_pool("executor", num_workers, write_errors=write_errors, **(startup or {})) as (executor, limit):
+        # Chunks are submitted a few at a time and each result is handled as soon
+        # as its future completes, instead of waiting for all futures at the end
+        for result in stream_executor_results(executor, worker_func, items, sizer,
+                                              in_flight_limit(max_in_flight, limit)):
+            if job is not None:
+                job.collect(result) # keep returned arrays (pickle transport)
+            if recorder:
+                recorder.add(result) # stage timings that came back with this result
+            schedule_report.add(result) # busy time per worker
+            memory_report.add(result) # peak RSS the worker reported with this chunk
             
-            futures.append(executor.submit(process_image, img_path, output_folder))
+            # 1. Count Success/Fail
+            if result.get("status") == "Success":
+                success_count += 1
+            else:
+                fail_count += 1
             
-    
-        done, not_done = concurrent.futures.wait(futures) # Wait for all tasks to finish
-        
-        # Analyze results
-        for f in done:
-            try:
-                result = f.result()
-                
-                # 1. Count Success/Fail
-                if result.get("status") == "Success":
-                    success_count += 1
+            # Result cache outputs reused vs computed
+            cache_hits += result.get("cache_hits", 0)
+            cache_misses += result.get("cache_misses", 0)
+            
+            # 2. Track Worker PIDs (Collect the data)
+            pid = result.get("pid")
+            if pid:
+                if pid in worker_stats:
+                    worker_stats[pid] += 1
                 else:
-                    fail_count += 1
-                
-                # 2. Track Worker PIDs (Collect the data)
-                pid = result.get("pid")
-                if pid:
-                    if pid in worker_stats:
-                        worker_stats[pid] += 1
-                    else:
-                        worker_stats[pid] = 1
-                        
-            except Exception:
+                    worker_stats[pid] = 1
+
+        # Tiled mode: every large image is spread over all workers, one image at a time
+        tiled_count = 0
+        for large_path in (splitter.large if splitter else []):
+            result = process_tiled(large_path, output_folder, functools.partial(stream_executor_results, executor, max_in_flight=limit),
+                                   num_workers, task_options.get("filters"), engine, tile_options["tile_size"],
+                                   output_save_func(task_options.get("shard_output"), task_options.get("array_store")))
+            if result["status"] == "Success":
+                success_count += 1
+                tiled_count += result["tiles"]
+            else:
                 fail_count += 1
+                print(f"\n❌ Error: {result['filename']}: {result['error']}")
 
+    if write_errors is not None and write_errors.value:
+        fail_count += write_errors.value
+        print(f"\n❌ {write_errors.value} output file(s) could not be written")
+    if task_options.get("shard_output"):
+        shard_outputs, shard_files = write_shard_index(output_folder) # per-filter index.json
+    if dedup and job is None:
+        linked = link_duplicates(output_folder, dedup, task_options) # copies get the outputs of the first
     end_time = time.time() # stop timer
+    memory_report.finish()
+    core_report.finish()
+    if recorder:
+        recorder.finish()
     duration = end_time - start_time # calculate total duration taken to process all images
     
     print(f"Done! ({duration:.4f}s)")
     print(f"      [Stats] Success: {success_count} | Failed: {fail_count}")
+    print(f"      [Dispatch] {sizer.describe()}")
+    if splitter is not None and splitter.large:
+        print(f"      [Tiling] {len(splitter.large)} large image(s) in {tiled_count} tiles")
+    if task_options.get("shard_output"):
+        print(f"      [Shards] {shard_outputs} outputs in {shard_files} shard file(s)")
+    if task_options.get("array_store"):
+        from array_store import describe_store
+        print(f"      [Array store] {describe_store(task_options['array_store'][0])}")
+    if dedup and job is None:
+        print(f"      [Dedup] {dedup.saved} task(s) saved, {linked} outputs linked")
+    schedule_report.print_report(duration)
+    memory_report.print_report()
+    core_report.print_report()
+    if job is not None:
+        print(f"      [Transport] {transport}: {job.bytes_through_pipe / 1024 / 1024:.1f} MB of pixels through the pipe")
+        job.close()
+    if task_options.get("cache_dir"):
+        print(f"      [Cache] {format_hit_rate(cache_hits, cache_misses)}")
+    if recorder:
+        recorder.print_report()
+        trace_path, csv_path = recorder.export(trace_base_path(trace_dir, f"concurrent_{num_workers}"))
+        print(f"      [Trace] {trace_path} | {csv_path}")
     
     print(f"      [Load Balancing] Worker Breakdown:")
     for pid, count in worker_stats.items():
@@ -84,7 +193,20 @@ def run_test_with_workers(num_workers, image_paths, output_folder):
     
     return duration
 
+# Command line options (defaults reproduce the original benchmark)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Concurrent futures image processing benchmark")
+    add_processing_arguments(parser)
+    add_dispatch_arguments(parser)
+    add_tiling_arguments(parser)
+    add_worker_arguments(parser)
+    add_startup_arguments(parser)
+    add_dedup_arguments(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+
     print(f"\n{'='*60}")
     print(f"Automated Performance Test: Concurrent Futures")
     print(f"{'='*60}")
@@ -92,10 +214,13 @@ def main():
     # Path setup
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_script_dir)
-    INPUT_FOLDER = os.path.join(project_root, "input_images")
+    INPUT_FOLDER = input_folder_from_args(args, project_root) # input_images, or --input-shards
     OUTPUT_FOLDER = os.path.join(project_root, "output_concurrent")
     SERIAL_OUTPUT = os.path.join(project_root, "output_serial_bench")
 
+    task_options = task_options_from_args(args, project_root)
+    print_run_options(args, task_options)
+
     # Check if input folder exists
     if not os.path.exists(INPUT_FOLDER):
         print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
@@ -103,35 +228,58 @@ def main():
 
      # Create output folder if it doesn't exist
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    prepare_output_folders(OUTPUT_FOLDER, task_options["filters"]) # create output/<filter> once, before the workers start
     os.makedirs(SERIAL_OUTPUT, exist_ok=True) 
 
-    # Load input images using os.walk
-    image_paths = []
-    for root, dirs, files in os.walk(INPUT_FOLDER):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                full_path = os.path.join(root, file)
-                image_paths.append(full_path)
+    # Images are discovered lazily: the pools start on the first paths while
+    # the rest of the tree is still being walked
+    image_paths = image_source_from_args(args, INPUT_FOLDER, project_root)
 
-    if not image_paths:
+    if image_paths.is_empty():
         print(f"No images found. Please add images to 'input_images' folder.")
         return
 
-    print(f"Found {len(image_paths)} images.\n")
+    print(f"Streaming images from {INPUT_FOLDER}\n")
+
+    tile_options = tile_options_from_args(args)
+    if tile_options:
+        from shared_transport import share_tracker_with_workers
+        share_tracker_with_workers() # tiles live in shared memory the workers attach to
+
+    # Duplicate inputs are dropped before dispatch (--dedup); their outputs are linked after every run
+    image_paths, dedup = dedup_from_args(args, image_paths)
+
+    # Size-aware scheduling reads every header up front (fifo keeps the lazy stream)
+    image_paths, costs = apply_schedule(args.schedule, image_paths, args.max_side)
+
+    # In-memory mode: decode once up front (the "upstream stage"), outside the timed runs
+    frames = None
+    if args.in_memory:
+        decode_start = time.time()
+        from shared_transport import decode_frames # numpy is only loaded for --in-memory
+        frames = decode_frames(image_paths, args.max_side)
+        print(f"Decoded {len(frames)} frames for in-memory mode in {time.time() - decode_start:.4f}s "
+              f"({args.in_memory} transport)\n")
 
     # Get the serial baseline time
-    serial_time = load_serial_baseline()
+    serial_time = load_serial_baseline(baseline_options(args, task_options))
     print(f" Using serial baseline: {serial_time:.4f}s")
 
     # Run the parallel execution 
     print("Starting Parallel Tests...")
     # Use loop to test different worker amounts
-    # We test 2, 4, and 8 workers
-    worker_counts = [2, 4, 8] 
+    # We test 2, 4, and 8 workers (--workers, or the autotune.py result with --workers tuned)
+    worker_counts = worker_counts_from_args(args, project_root, "concurrent")
+    startup = startup_options_from_args(args, task_options, worker_counts)
     results = {}  # To store the times
 
     for count in worker_counts:
-        time_taken = run_test_with_workers(count, image_paths, OUTPUT_FOLDER) # Run test function
+        time_taken = run_test_with_workers(count, image_paths, OUTPUT_FOLDER, task_options,
+                                           args.engine, args.batch_size,
+                                           args.chunksize, args.max_in_flight,
+                                           frames, args.in_memory,
+                                           trace_dir_from_args(args, project_root), costs,
+                                           tile_options, startup, dedup) # Run test function
         results[count] = time_taken
 
     # Final report table 
@@ -147,7 +295,11 @@ def main():
         
         print(f"{count:<10} | {time_taken:<15.4f} | {speedup:<15.2f}") 
     
+    if costs is None and dedup is None: # (both read the whole list up front)
+        print(f"Discovery: {image_paths.describe()}")
     print(f"{'='*60}")
+    if task_options["cache_dir"]:
+        print_cache_report(task_options["cache_dir"], max_mb=args.cache_max_mb, max_age_days=args.cache_max_age_days)
     print("Test Complete.")
 
 if __name__ == '__main__':
@@ -0,0 +1,257 @@
+import os
+import sys
+import math
+import multiprocessing
+
+# CPU AFFINITY AND OVERSUBSCRIPTION CONTROL (--pin, --worker-threads, --workers auto)
+# Pool workers float freely across cores, and NumPy's BLAS / OpenMP or OpenCV
+# may start a thread per core inside every worker. On shared hosts this
+# oversubscribes the CPUs and workers keep losing their caches. Each pool
+# worker runs init_worker() when it starts:
+#   - pinning: the usable CPUs are split into one contiguous core set per
+#     worker (one core each when there are as many workers as cores, round
+#     robin when there are more) and the worker binds itself to its set with
+#     os.sched_setaffinity (Linux only; elsewhere pinning is skipped)
+#   - thread caps: OMP/BLAS/MKL/numexpr/OpenCV thread counts are set in the
+#     environment, and applied to libraries already loaded through
+#     threadpoolctl / cv2. The environment is only read when a library loads:
+#     a forked worker inherits the parent's numpy with its thread pools built,
+#     so the runners set the caps before anything imports numpy
+#     (run_options.task_options_from_args) and report which mechanism took effect
+# The default worker count (--workers auto) is the number of usable CPUs,
+# lowered to the container's CPU quota (cgroup v2 cpu.max, or v1
+# cpu.cfs_quota_us / cpu.cfs_period_us) when there is one.
+# CoreUtilization reads /proc/stat around a run and reports how busy every core was.
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "OPENCV_FOR_THREADS_NUM")
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def can_pin():
+    return hasattr(os, "sched_setaffinity")
+
+
+def usable_cpus():
+    """CPUs this process may run on (its affinity mask), in order."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _read_first_line(path):
+    try:
+        with open(path, 'r') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_paths():
+    """controller -> cgroup path of this process ("" = the v2 unified hierarchy)."""
+    paths = {}
+    try:
+        with open("/proc/self/cgroup", 'r') as f:
+            for line in f:
+                _, controllers, path = line.rstrip("\n").split(":", 2)
+                for controller in controllers.split(","):
+                    paths[controller] = path
+    except (OSError, ValueError):
+        pass
+    return paths
+
+
+def _ancestors(folder, root):
+    """folder and every parent up to root (a quota anywhere above also applies)."""
+    while True:
+        yield folder
+        if os.path.normpath(folder) == os.path.normpath(root):
+            return
+        folder = os.path.dirname(folder)
+
+
+def cgroup_cpu_quota():
+    """CPUs allowed by the cgroup CPU quota (e.g. 2.5), or None when unlimited / unknown."""
+    paths = _cgroup_paths()
+    limits = []
+    # cgroup v2: "<quota> <period>" or "max <period>" in cpu.max
+    if "" in paths:
+        base = os.path.join(CGROUP_ROOT, paths[""].lstrip("/"))
+        for folder in _ancestors(base, CGROUP_ROOT):
+            line = _read_first_line(os.path.join(folder, "cpu.max"))
+            if line and not line.startswith("max"):
+                quota, period = line.split()[:2]
+                limits.append(int(quota) / int(period))
+    # cgroup v1: cpu.cfs_quota_us (-1 = unlimited) / cpu.cfs_period_us
+    if "cpu" in paths:
+        for mount in ("cpu", "cpu,cpuacct", "cpuacct,cpu"):
+            base = os.path.join(CGROUP_ROOT, mount, paths["cpu"].lstrip("/"))
+            for folder in _ancestors(base, os.path.join(CGROUP_ROOT, mount)):
+                quota = _read_first_line(os.path.join(folder, "cpu.cfs_quota_us"))
+                period = _read_first_line(os.path.join(folder, "cpu.cfs_period_us"))
+                if quota and period and int(quota) > 0:
+                    limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+
+def effective_cpu_count():
+    """Usable CPUs, capped by the cgroup CPU quota (rounded up: 2.5 CPUs -> 3 workers)."""
+    cpus = len(usable_cpus())
+    quota = cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def describe_cpus():
+    cpus = usable_cpus()
+    quota = cgroup_cpu_quota()
+    text = f"{len(cpus)} usable CPU(s)"
+    if quota:
+        text += f", cgroup quota {quota:g} CPU(s)"
+    return text + f" -> {effective_cpu_count()} worker(s) by default"
+
+
+def core_sets(num_workers, cpus=None):
+    """
+    One CPU set per worker: contiguous, non-overlapping groups while there are
+    enough cores, single cores handed out round robin when there are not.
+    """
+    cpus = usable_cpus() if cpus is None else list(cpus)
+    if num_workers >= len(cpus):
+        return [{cpus[i % len(cpus)]} for i in range(num_workers)]
+    base, extra = divmod(len(cpus), num_workers)
+    sets = []
+    start = 0
+    for i in range(num_workers):
+        size = base + (1 if i < extra else 0)
+        sets.append(set(cpus[start:start + size]))
+        start += size
+    return sets
+
+
+_env_set_before_numpy = False
+
+
+def set_thread_env(threads):
+    """Thread caps in the environment: read by libraries loaded later in this process and its workers."""
+    global _env_set_before_numpy
+    if "numpy" not in sys.modules:
+        _env_set_before_numpy = True
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+
+
+def threadpoolctl_available():
+    try:
+        import threadpoolctl
+        return True
+    except ImportError:
+        return False
+
+
+def thread_cap_mechanism(start_method=None):
+    """How a worker thread cap reaches numpy / BLAS in the pool workers, or None when it cannot."""
+    if _env_set_before_numpy:
+        return "environment variables (set before numpy was loaded)"
+    if (start_method or multiprocessing.get_start_method()) != "fork" or "numpy" not in sys.modules:
+        return "environment variables (every worker loads numpy after its cap)"
+    if threadpoolctl_available():
+        return "threadpoolctl (numpy was loaded before the fork)"
+    return None
+
+
+def cap_library_threads(threads):
+    """Limits the thread pools of numerical libraries in this process to threads each."""
+    set_thread_env(threads) # read by libraries imported after this
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads) # BLAS / OpenMP pools already loaded
+    except ImportError:
+        pass
+    if "cv2" in sys.modules:
+        sys.modules["cv2"].setNumThreads(threads)
+
+
+class WorkerSetup:
+    """
+    Pool initializer (picklable, so it also works with spawn and forkserver).
+    Every worker takes the next index from a shared counter and pins itself to that core set.
+    """
+
+    def __init__(self, context, num_workers, pin=False, threads=None):
+        self.plan = core_sets(num_workers) if pin and can_pin() else None
+        self.counter = context.Value("i", 0)
+        self.threads = threads
+
+    def __call__(self):
+        if self.threads:
+            cap_library_threads(self.threads)
+        if self.plan:
+            with self.counter.get_lock():
+                index = self.counter.value
+                self.counter.value += 1
+            # A replacement worker wraps around onto the plan again
+            os.sched_setaffinity(0, self.plan[index % len(self.plan)])
+
+    def describe(self):
+        parts = []
+        if self.plan:
+            sizes = sorted({len(cores) for cores in self.plan})
+            shared = len(self.plan) > len(usable_cpus())
+            parts.append(f"pinned to {'/'.join(map(str, sizes))} core(s) each"
+                         + (" (more workers than cores: cores are shared)" if shared else ""))
+        if self.threads:
+            parts.append(f"{self.threads} library thread(s) per worker")
+        return ", ".join(parts)
+
+
+# PER-CORE UTILIZATION
+
+def read_cpu_times():
+    """cpu index -> (busy, total) jiffies from /proc/stat, or {} where it does not exist."""
+    times = {}
+    try:
+        with open("/proc/stat", 'r') as f:
+            for line in f:
+                if not line.startswith("cpu") or line.startswith("cpu "):
+                    continue
+                name, *fields = line.split()
+                values = [int(value) for value in fields[:8]]
+                idle = values[3] + values[4] # idle + iowait
+                times[int(name[3:])] = (sum(values) - idle, sum(values))
+    except (OSError, ValueError):
+        pass
+    return times
+
+
+class CoreUtilization:
+    """Busy share of every usable core between start (construction) and finish()."""
+
+    def __init__(self):
+        self.cpus = usable_cpus()
+        self.start = read_cpu_times()
+        self.usage = {}
+
+    def finish(self):
+        end = read_cpu_times()
+        for cpu in self.cpus:
+            if cpu in self.start and cpu in end:
+                busy = end[cpu][0] - self.start[cpu][0]
+                total = end[cpu][1] - self.start[cpu][1]
+                self.usage[cpu] = busy / total if total else 0.0
+        return self.usage
+
+    def mean(self):
+        return sum(self.usage.values()) / len(self.usage) if self.usage else None
+
+    def print_report(self, indent="      "):
+        if not self.usage:
+            print(f"{indent}[Cores] Per-core utilization unavailable (no /proc/stat on this system)")
+            return
+        spread = max(self.usage.values()) - min(self.usage.values())
+        print(f"{indent}[Cores] Mean {self.mean() * 100:.0f}% busy over {len(self.usage)} core(s) | "
+              f"spread {spread * 100:.0f} points")
+        cells = [f"cpu{cpu} {usage * 100:3.0f}%" for cpu, usage in sorted(self.usage.items())]
+        for i in range(0, len(cells), 8):
+            print(f"{indent}         {' | '.join(cells[i:i + 8])}")
@@ -1,53 +1,98 @@
 import os
+import sys
+import csv
+import glob
+import json
 import matplotlib.pyplot as plt
 import numpy as np
 
-# Creates graphs for performance analysis using hardcoded data
-def create_charts():
+# Creates graphs for performance analysis from a benchmark.py result file
+# (results/benchmark_<timestamp>.json or .csv; the newest one by default)
+
+COLORS = {
+    "multiprocessing": '#4e79a7', # Blue
+    "concurrent": '#f28e2b',      # Orange
+    "threads": '#59a14f',         # Green
+}
+LABELS = {
+    "multiprocessing": 'Multiprocessing',
+    "concurrent": 'Concurrent Futures',
+    "threads": 'Threads',
+}
+MARKERS = ['o', 's', '^', 'D']
+
+
+def latest_result_file(results_folder):
+    files = glob.glob(os.path.join(results_folder, "benchmark_*.json")) + \
+            glob.glob(os.path.join(results_folder, "benchmark_*.csv"))
+    return max(files, key=os.path.getmtime) if files else None
+
+
+def load_results(path):
+    """Result rows (one per backend / worker count) from a JSON or CSV result file."""
+    if path.endswith(".json"):
+        with open(path, 'r') as f:
+            return json.load(f)["results"]
+    rows = []
+    with open(path, 'r') as f:
+        for row in csv.DictReader(f):
+            for key in ("mean_s", "median_s", "stdev_s", "ci95_low_s", "ci95_high_s"):
+                row[key] = float(row[key])
+            row["workers"] = int(row["workers"])
+            rows.append(row)
+    return rows
+
+
+def create_charts(result_path=None):
     # Path setup
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_script_dir)
     RESULTS_FOLDER = os.path.join(project_root, "results")
-    
-    os.makedirs(RESULTS_FOLDER, exist_ok=True)
-    print(f"Graphs will be saved to: {RESULTS_FOLDER}")
 
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
-    # Test Data (Hardcoded from previous multiprocesing and concurrent futures runs)
-    workers = [2, 4, 8]
-    
-    # Serial Benchmarks to count speedup
-    serial_mp = 34.87
-    serial_cf = 34.87
+    result_path = result_path or latest_result_file(RESULTS_FOLDER)
+    if not result_path:
+        print("❌ Error: no benchmark result file found in results/!")
+        print("Please run benchmark.py first!")
+        exit(1)
+    print(f"Plotting results from: {result_path}")
+    print(f"Graphs will be saved to: {RESULTS_FOLDER}")
 
-    # Parallel Execution Times
-    mp_times = [17.91, 10.50, 7.82] 
-    cf_times = [17.75, 9.35, 7.59]
+    rows = load_results(result_path)
+    serial = next((row for row in rows if row["backend"] == "serial"), None)
+    if serial is None:
+        print("❌ Error: the result file has no serial run to compute speedup from!")
+        exit(1)
+    serial_time = serial["mean_s"]
 
-    # Calculate Speedup and Efficiency
-    # 1. Speedup = T_serial / T_parallel
-    mp_speedup = [serial_mp / t for t in mp_times]
-    cf_speedup = [serial_cf / t for t in cf_times]
+    # Parallel backends in the file: name -> rows sorted by worker count
+    backends = {}
+    for row in rows:
+        if row["backend"] != "serial":
+            backends.setdefault(row["backend"], []).append(row)
+    for backend_rows in backends.values():
+        backend_rows.sort(key=lambda row: row["workers"])
+    workers = sorted({row["workers"] for backend_rows in backends.values() for row in backend_rows})
 
-    # 2. Efficiency = Speedup / Num_Workers
-    mp_efficiency = [s / w for s, w in zip(mp_speedup, workers)]
-    cf_efficiency = [s / w for s, w in zip(cf_speedup, workers)]
-    
-    c_mp = '#4e79a7' # Blue
-    c_cf = '#f28e2b' # Orange
     c_ideal = 'gray'
 
-    # CHART 1: Execution Time (Bar Chart)
+    # CHART 1: Execution Time (Bar Chart, error bars = 95% confidence interval)
     plt.figure(figsize=(10, 6))
     x = np.arange(len(workers))
-    width = 0.35
-    
-    rects1 = plt.bar(x - width/2, mp_times, width, label='Multiprocessing', color=c_mp)
-    rects2 = plt.bar(x + width/2, cf_times, width, label='Concurrent Futures', color=c_cf)
-    
-    # Reference Lines
-    plt.axhline(y=serial_mp, color=c_mp, linestyle=':', alpha=0.7, label=f'Serial MP ({serial_mp:.2f}s)')
-    plt.axhline(y=serial_cf, color=c_cf, linestyle=':', alpha=0.7, label=f'Serial CF ({serial_cf:.2f}s)')
+    width = 0.8 / max(len(backends), 1)
+
+    for i, (backend, backend_rows) in enumerate(backends.items()):
+        by_workers = {row["workers"]: row for row in backend_rows}
+        means = [by_workers[w]["mean_s"] if w in by_workers else 0 for w in workers]
+        errors = [by_workers[w]["mean_s"] - by_workers[w]["ci95_low_s"] if w in by_workers else 0 for w in workers]
+        offset = (i - (len(backends) - 1) / 2) * width
+        rects = plt.bar(x + offset, means, width, yerr=errors, capsize=4,
+                        label=LABELS.get(backend, backend), color=COLORS.get(backend))
+        plt.bar_label(rects, padding=3, fmt='%.2fs')
+
+    # Reference Line
+    plt.axhline(y=serial_time, color=c_ideal, linestyle=':', alpha=0.7, label=f'Serial ({serial_time:.2f}s)')
 
     plt.ylabel('Time (Seconds)', fontweight='bold')
     plt.xlabel('Number of Workers', fontweight='bold')
@@ -55,61 +100,120 @@ def create_charts():
     plt.xticks(x, workers)
     plt.legend()
     plt.grid(axis='y', linestyle='--', alpha=0.3)
-    
-    plt.bar_label(rects1, padding=3, fmt='%.2fs')
-    plt.bar_label(rects2, padding=3, fmt='%.2fs')
-    
+
     plt.tight_layout()
     plt.savefig(os.path.join(RESULTS_FOLDER, 'execution_time.png'), dpi=300)
     plt.close() # Close memory to start fresh for next graph
 
     # CHART 2: Speedup (Line Chart)
+    # 1. Speedup = T_serial / T_parallel
     plt.figure(figsize=(10, 6))
-    plt.plot(workers, mp_speedup, marker='o', linewidth=2.5, label='Multiprocessing', color=c_mp)
-    plt.plot(workers, cf_speedup, marker='s', linewidth=2.5, label='Concurrent Futures', color=c_cf)
+    for i, (backend, backend_rows) in enumerate(backends.items()):
+        plt.plot([row["workers"] for row in backend_rows], [serial_time / row["mean_s"] for row in backend_rows],
+                 marker=MARKERS[i % len(MARKERS)], linewidth=2.5,
+                 label=LABELS.get(backend, backend), color=COLORS.get(backend))
     plt.plot(workers, workers, '--', color=c_ideal, label='Ideal Scaling', alpha=0.5)
-    
+
     plt.ylabel('Speedup Factor (x times faster)', fontweight='bold')
     plt.xlabel('Number of Workers', fontweight='bold')
     plt.title('Speedup Analysis (Higher is Better)', fontweight='bold')
     plt.xticks(workers)
     plt.legend()
     plt.grid(True, linestyle='--', alpha=0.3)
-    
+
     plt.tight_layout()
     plt.savefig(os.path.join(RESULTS_FOLDER, 'speedup.png'), dpi=300)
     plt.close()
 
     # CHART 3: Efficiency (Line Chart)
+    # 2. Efficiency = Speedup / Num_Workers
     plt.figure(figsize=(10, 6))
-    plt.plot(workers, mp_efficiency, marker='o', linewidth=2.5, label='Multiprocessing', color=c_mp)
-    plt.plot(workers, cf_efficiency, marker='s', linewidth=2.5, label='Concurrent Futures', color=c_cf)
-    
+    for i, (backend, backend_rows) in enumerate(backends.items()):
+        backend_workers = [row["workers"] for row in backend_rows]
+        efficiency = [serial_time / row["mean_s"] / row["workers"] for row in backend_rows]
+        plt.plot(backend_workers, efficiency, marker=MARKERS[i % len(MARKERS)], linewidth=2.5,
+                 label=LABELS.get(backend, backend), color=COLORS.get(backend))
+        # Annotate points
+        for w, value in zip(backend_workers, efficiency):
+            plt.annotate(f"{value:.2f}", (w, value), xytext=(0, 8 if i % 2 == 0 else -15),
+                         textcoords='offset points', ha='center', color=COLORS.get(backend), fontweight='bold')
+
     # Ideal Efficiency Line (1.0)
     plt.axhline(y=1.0, color=c_ideal, linestyle='--', label='Ideal Efficiency (1.0)', alpha=0.5)
-    
+
     plt.ylabel('Efficiency (Speedup / Workers)', fontweight='bold')
     plt.xlabel('Number of Workers', fontweight='bold')
     plt.title('Parallel Efficiency (Higher is Better, Max 1.0)', fontweight='bold')
     plt.xticks(workers)
-    plt.ylim(0, 1.15) 
+    plt.ylim(0, 1.15)
     plt.legend()
     plt.grid(True, linestyle='--', alpha=0.3)
-    
-    # Annotate points
-    for i, txt in enumerate(mp_efficiency):
-        plt.annotate(f"{txt:.2f}", (workers[i], mp_efficiency[i]), 
-                     xytext=(0, 8), textcoords='offset points', ha='center', color=c_mp, fontweight='bold')
-
-    for i, txt in enumerate(cf_efficiency):
-        plt.annotate(f"{txt:.2f}", (workers[i], cf_efficiency[i]), 
-                     xytext=(0, -15), textcoords='offset points', ha='center', color=c_cf, fontweight='bold')
 
     plt.tight_layout()
     plt.savefig(os.path.join(RESULTS_FOLDER, 'efficiency.png'), dpi=300)
     plt.close()
-    
+
     print("Success! Created 3 separate graph files.")
 
+
+def create_scaling_chart(autotune_path):
+    """Scaling curve of an autotune.py run: throughput and speedup with the Amdahl/Gustafson fits."""
+    with open(autotune_path, 'r') as f:
+        report = json.load(f)
+    best = report["best_by_workers"]
+    workers = [row["workers"] for row in best]
+    base = best[0]["median_s"]
+    amdahl = report["fit"]["amdahl_serial_fraction"]
+    gustafson = report["fit"]["gustafson_serial_fraction"]
+    backend = report["config"]["backend"]
+    color = COLORS.get(backend)
+
+    fig, (left, right) = plt.subplots(1, 2, figsize=(14, 6))
+
+    # LEFT: throughput of every chunk size tried
+    chunksizes = sorted({row["chunksize"] for row in report["results"]}, key=lambda c: -1 if c is None else c)
+    for i, chunksize in enumerate(chunksizes):
+        rows = [row for row in report["results"] if row["chunksize"] == chunksize]
+        left.plot([row["workers"] for row in rows], [row["images_per_s"] for row in rows],
+                  marker=MARKERS[i % len(MARKERS)], linewidth=2, label=f"chunksize {chunksize or 'auto'}")
+    recommended = report["recommended"]
+    left.axvline(x=recommended["workers"], color='gray', linestyle=':', alpha=0.7,
+                 label=f"Recommended ({recommended['workers']} workers)")
+    left.set_xlabel('Number of Workers', fontweight='bold')
+    left.set_ylabel('Throughput (images / s)', fontweight='bold')
+    left.set_title('Throughput (Higher is Better)', fontweight='bold')
+    left.set_xticks(workers)
+    left.legend()
+    left.grid(True, linestyle='--', alpha=0.3)
+
+    # RIGHT: measured speedup vs the fitted models
+    curve = np.linspace(1, max(workers), 100)
+    right.plot(workers, [base / row["median_s"] for row in best], marker='o', linewidth=2.5,
+               color=color, label=f"Measured ({LABELS.get(backend, backend)})")
+    if amdahl is not None:
+        right.plot(curve, 1 / (amdahl + (1 - amdahl) / curve), '--', color='#e15759',
+                   label=f"Amdahl fit (s = {amdahl:.3f})")
+        right.plot(curve, curve - gustafson * (curve - 1), '-.', color='#76b7b2',
+                   label=f"Gustafson fit (s = {gustafson:.3f})")
+    right.plot(curve, curve, ':', color='gray', alpha=0.5, label='Ideal Scaling')
+    right.set_xlabel('Number of Workers', fontweight='bold')
+    right.set_ylabel('Speedup vs 1 worker', fontweight='bold')
+    right.set_title('Scaling Curve (Higher is Better)', fontweight='bold')
+    right.set_xticks(workers)
+    right.legend()
+    right.grid(True, linestyle='--', alpha=0.3)
+
+    plt.tight_layout()
+    output_path = os.path.splitext(autotune_path)[0] + ".png"
+    plt.savefig(output_path, dpi=300)
+    plt.close()
+    print(f"✅ Scaling curve saved to: {output_path}")
+
+
 if __name__ == "__main__":
-    create_charts()
\ No newline at end of file
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    # autotune.py results get the scaling curve, benchmark.py results the three charts
+    if path and os.path.basename(path).startswith("autotune_"):
+        create_scaling_chart(path)
+    else:
+        create_charts(path)
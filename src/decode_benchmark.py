@@ -0,0 +1,82 @@
+import os
+import time
+import argparse
+from PIL import Image
+from filters import open_image
+
+# DECODE BENCHMARK
+# Compares a full-resolution decode (what process_image normally does) with
+# the reduced-resolution decode used by --max-side, image by image.
+
+
+def time_decode(file_path, max_side, repeats):
+    """Best-of-N decode time in seconds, plus the decoded size."""
+    best = None
+    size = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if max_side:
+            img = open_image(file_path, max_side)
+        else:
+            img = Image.open(file_path).convert("RGB")
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+        size = img.size
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full vs reduced-resolution decode benchmark")
+    parser.add_argument("--max-side", type=int, default=256,
+                        help="Target maximum side for the reduced decode")
+    parser.add_argument("--sample", type=int, default=100,
+                        help="Number of images to time")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Decodes per image (the fastest one counts)")
+    args = parser.parse_args()
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = os.path.join(project_root, "input_images")
+
+    image_paths = []
+    for root, dirs, files in os.walk(INPUT_FOLDER):
+        for file in files:
+            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                image_paths.append(os.path.join(root, file))
+    image_paths = sorted(image_paths)[:args.sample]
+
+    if not image_paths:
+        print(f"No images found in {INPUT_FOLDER}.")
+        return
+
+    print(f"\n{'='*60}")
+    print(f"Decode Benchmark: full vs max side {args.max_side}px ({len(image_paths)} images)")
+    print(f"{'='*60}")
+
+    full_total = 0.0
+    reduced_total = 0.0
+    full_pixels = 0
+    reduced_pixels = 0
+    for img_path in image_paths:
+        full_time, full_size = time_decode(img_path, None, args.repeats)
+        reduced_time, reduced_size = time_decode(img_path, args.max_side, args.repeats)
+        full_total += full_time
+        reduced_total += reduced_time
+        full_pixels += full_size[0] * full_size[1]
+        reduced_pixels += reduced_size[0] * reduced_size[1]
+
+    count = len(image_paths)
+    print(f"{'Mode':<12} | {'Decode / image (ms)':<20} | {'Pixels / image':<15}")
+    print(f"{'-'*60}")
+    print(f"{'Full':<12} | {full_total / count * 1000:<20.3f} | {full_pixels // count:<15}")
+    print(f"{'Reduced':<12} | {reduced_total / count * 1000:<20.3f} | {reduced_pixels // count:<15}")
+    print(f"{'-'*60}")
+    print(f"Decode time saved per image: {(full_total - reduced_total) / count * 1000:.3f} ms "
+          f"({full_total / reduced_total:.2f}x faster)")
+    print(f"Pixels per filter reduced {full_pixels / reduced_pixels:.1f}x")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import collections
+import concurrent.futures
+from PIL import Image
+from filters import open_image, prepare_output_folders
+from shards import ShardMember, read_input, INDEX_NAME as SHARD_INDEX_NAME
+
+# DUPLICATE INPUT DETECTION (--dedup)
+# Input trees contain byte-identical copies ("onion_rings_135519 copy.jpg")
+# and near-identical ones (re-saved, resized). Every copy used to be decoded,
+# filtered and encoded five times. Between discovery and dispatch:
+#   1. cheap prefilter: images are grouped by file size + a hash of their
+#      first PARTIAL_BYTES; only groups with more than one member go on
+#   2. confirm: a full SHA-256 of the candidates decides byte-identical copies
+#   3. optional (--dedup-perceptual N): a 64-bit difference hash (dHash) of a
+#      small grayscale thumbnail; images within N differing bits are treated
+#      as near-duplicates. Candidate pairs come from hash bands (with N + 1
+#      bands, two hashes within N bits must agree on at least one band), so
+#      not every pair of images is compared. Every image joins the group of
+#      the closest representative within N bits, or starts its own: closeness
+#      is never chained (A~B and B~C does not put C with A)
+# Only the first image of every group is processed. After the run its outputs
+# are hard-linked to the names of byte-identical copies, copied to the names
+# of near-identical ones (a later run without --dedup writes their own,
+# different outputs, and must not write through a shared inode), or referenced
+# (aliases in the shard / array store index). The run summary reports the tasks saved.
+
+PARTIAL_BYTES = 64 * 1024
+HASH_THREADS = 8
+HASH_SIZE = 8 # dHash grid: 8 x 8 = 64 bits
+DEFAULT_PERCEPTUAL_THRESHOLD = 4
+DUPLICATES_NAME = "duplicates.json"
+
+
+def input_size(path):
+    if isinstance(path, ShardMember):
+        return path.size
+    return os.path.getsize(path)
+
+
+def partial_hash(path):
+    if isinstance(path, ShardMember):
+        data = read_input(path)[:PARTIAL_BYTES]
+    else:
+        with open(path, 'rb') as f:
+            data = f.read(PARTIAL_BYTES)
+    return hashlib.sha256(data).hexdigest()
+
+
+def full_hash(path):
+    return hashlib.sha256(read_input(path)).hexdigest()
+
+
+def dhash(path):
+    """64-bit difference hash: is each pixel of a 9x8 thumbnail brighter than its right neighbour?"""
+    # Decoded at reduced size (JPEG draft), the hash only needs a thumbnail
+    img = open_image(path, max_side=HASH_SIZE * 8).convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX)
+    pixels = list(img.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return bits
+
+
+def _hash_all(func, paths, threads=HASH_THREADS):
+    """path -> func(path) on threads (None where the file cannot be read)."""
+    def safe(path):
+        try:
+            return func(path)
+        except Exception:
+            return None # the task itself will report the error
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        return dict(zip(paths, executor.map(safe, paths)))
+
+
+def exact_groups(image_paths):
+    """Groups of byte-identical images (2 or more, in discovery order)."""
+    by_size = collections.defaultdict(list)
+    for path in image_paths:
+        try:
+            by_size[input_size(path)].append(path)
+        except OSError:
+            continue
+    candidates = [path for group in by_size.values() if len(group) > 1 for path in group]
+    partial = _hash_all(partial_hash, candidates)
+    by_partial = collections.defaultdict(list)
+    for path in candidates:
+        if partial[path] is not None:
+            by_partial[(input_size(path), partial[path])].append(path)
+    candidates = [path for group in by_partial.values() if len(group) > 1 for path in group]
+    full = _hash_all(full_hash, candidates)
+    by_full = collections.defaultdict(list)
+    for path in candidates:
+        if full[path] is not None:
+            by_full[full[path]].append(path)
+    return [group for group in by_full.values() if len(group) > 1], len(candidates)
+
+
+def group_hashes(hashes, threshold):
+    """
+    Representative linkage over name -> 64-bit hash, in the order given: every
+    member of a group is within threshold bits of its first name (the
+    representative whose outputs it receives). Returns the groups of 2 or more.
+    """
+    bands = threshold + 1
+    band_bits = -(-HASH_SIZE * HASH_SIZE // bands)
+    mask = (1 << band_bits) - 1
+    representatives = collections.defaultdict(list) # band value -> representatives in it
+    groups = {} # representative -> members
+    position = {} # representative -> order it appeared in (ties go to the earliest)
+    for name, value in hashes.items():
+        keys = [(band, (value >> (band * band_bits)) & mask) for band in range(bands)]
+        best = None
+        for key in keys:
+            for representative in representatives[key]:
+                distance = bin(hashes[representative] ^ value).count("1")
+                if distance <= threshold and (best is None or (distance, position[representative]) < best[0]):
+                    best = ((distance, position[representative]), representative)
+        if best:
+            groups[best[1]].append(name)
+        else:
+            # Nothing close enough: this image is processed and represents later ones
+            groups[name] = [name]
+            position[name] = len(position)
+            for key in keys:
+                representatives[key].append(name)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def perceptual_groups(image_paths, threshold):
+    """Groups of images whose dHashes differ in at most threshold bits (first image = representative)."""
+    hashes = {path: value for path, value in _hash_all(dhash, image_paths).items() if value is not None}
+    # The image discovered first becomes the representative
+    order = {path: i for i, path in enumerate(image_paths)}
+    return group_hashes(dict(sorted(hashes.items(), key=lambda item: order[item[0]])), threshold)
+
+
+class DedupResult:
+    """Unique images to process, and representative -> copies for the outputs to link."""
+
+    def __init__(self, unique, copies, exact_count, perceptual_count, hashed, seconds, near=None):
+        self.unique = unique
+        self.copies = copies # representative path -> [duplicate paths]
+        self.near = near or set() # copies that are only near-identical to their representative
+        self.exact_count = exact_count
+        self.perceptual_count = perceptual_count
+        self.hashed = hashed
+        self.seconds = seconds
+
+    @property
+    def saved(self):
+        return self.exact_count + self.perceptual_count
+
+    def describe(self):
+        total = len(self.unique) + self.saved
+        text = (f"{total} inputs -> {len(self.unique)} unique ({self.exact_count} byte-identical")
+        text += f", {self.perceptual_count} near-identical)" if self.perceptual_count else ")"
+        return text + f" | {self.hashed} fully hashed | {self.seconds:.3f}s"
+
+
+def find_duplicates(image_paths, perceptual_threshold=None):
+    """Splits the images into unique ones and copies. Returns a DedupResult."""
+    start = time.perf_counter()
+    image_paths = list(image_paths)
+    groups, hashed = exact_groups(image_paths)
+    copies = {group[0]: group[1:] for group in groups}
+    duplicate_set = {path for group in groups for path in group[1:]}
+    exact_count = len(duplicate_set)
+
+    perceptual_count = 0
+    near = set()
+    if perceptual_threshold is not None:
+        remaining = [path for path in image_paths if path not in duplicate_set]
+        for group in perceptual_groups(remaining, perceptual_threshold):
+            representative = group[0]
+            for path in group[1:]:
+                # A near-duplicate also takes along its own byte-identical copies
+                own_copies = [path] + copies.pop(path, [])
+                copies.setdefault(representative, []).extend(own_copies)
+                near.update(own_copies)
+                duplicate_set.add(path)
+                perceptual_count += 1
+    unique = [path for path in image_paths if path not in duplicate_set]
+    return DedupResult(unique, copies, exact_count, perceptual_count, hashed, time.perf_counter() - start, near)
+
+
+def _save_json(path, data, **kwargs):
+    """Writes a temp file and renames it, so a crash never leaves a half-written index."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def _output_name(path):
+    """Same naming as process_image: <category>_<name>"""
+    return f"{os.path.basename(os.path.dirname(path))}_{os.path.basename(path)}"
+
+
+def link_duplicates(output_folder, dedup, task_options):
+    """
+    Gives every copy the outputs of its representative. Returns the number of outputs linked.
+    Files of byte-identical copies are hard-linked (copied if the file system cannot
+    link), those of near-identical ones copied; with --shard-output or --array-store
+    the copies become aliases in the index instead.
+    """
+    aliases = {_output_name(copy): _output_name(representative)
+               for representative, group in dedup.copies.items() for copy in group}
+    near = {_output_name(copy) for copy in dedup.near}
+    # The full map is always kept next to the outputs
+    _save_json(os.path.join(output_folder, DUPLICATES_NAME), aliases, indent=1)
+
+    if task_options.get("array_store"):
+        index_path = os.path.join(task_options["array_store"][0], "index.json")
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        index["aliases"] = aliases
+        _save_json(index_path, index)
+        return len(aliases) * len(task_options["filters"])
+
+    linked = 0
+    folders = prepare_output_folders(output_folder, task_options["filters"])
+    for folder in folders.values():
+        if task_options.get("shard_output"):
+            index_path = os.path.join(folder, SHARD_INDEX_NAME)
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            for copy, representative in aliases.items():
+                if representative in index["entries"]:
+                    index["entries"][copy] = index["entries"][representative]
+                    linked += 1
+            _save_json(index_path, index)
+            continue
+        for copy, representative in aliases.items():
+            source = os.path.join(folder, representative)
+            target = os.path.join(folder, copy)
+            if not os.path.exists(source):
+                continue # the representative failed: its own error is already reported
+            if os.path.lexists(target):
+                os.remove(target) # never write into a file that may share its inode
+            if copy in near:
+                shutil.copyfile(source, target) # its own outputs may differ in a run without --dedup
+            else:
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copyfile(source, target) # e.g. file systems without hard links
+            linked += 1
+    return linked
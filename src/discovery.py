@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+import concurrent.futures
+
+# LAZY STREAMING IMAGE DISCOVERY
+# Building the full image list with os.walk before any processing starts
+# takes minutes (and a lot of memory) on trees with millions of files. Instead:
+#   - an os.scandir walk yields image paths while it is still walking, so the
+#     pools start on the first images within milliseconds
+#   - optional parallel traversal scans several directories at once on threads
+#     (helps on network file systems, where each listing waits on the server)
+#   - an optional file index remembers the image names of every directory,
+#     keyed by the directory's mtime: unchanged directories are not listed again
+# A directory's mtime changes whenever an entry is added, removed or renamed,
+# so a matching mtime means the cached listing is still correct.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+INDEX_VERSION = 1
+
+
+def scan_directory(path):
+    """Lists one directory. Returns (mtime_ns, image file names, subdirectory names)."""
+    mtime_ns = os.stat(path).st_mtime_ns # before listing, so a concurrent change invalidates the entry
+    files = []
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # Like os.walk: symlinked directories are listed but not descended into
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                files.append(entry.name)
+    return mtime_ns, files, dirs
+
+
+def load_index(index_path):
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index.get("dirs", {})
+
+
+def save_index(index_path, dirs):
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"version": INDEX_VERSION, "updated": time.time(), "dirs": dirs}, f)
+    os.replace(tmp_path, index_path)
+
+
+class DirectoryLister:
+    """Lists directories, reusing index entries whose mtime still matches."""
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.old = load_index(index_path) if index_path else {}
+        self.new = {}
+        self.reused = 0
+        self.scanned = 0
+        self.lock = threading.Lock() # list() runs on several threads during a parallel walk
+
+    def list(self, path):
+        """Returns (image file names, subdirectory names)."""
+        cached = self.old.get(path)
+        if cached is not None:
+            try:
+                if os.stat(path).st_mtime_ns == cached["mtime_ns"]:
+                    with self.lock:
+                        self.new[path] = cached
+                        self.reused += 1
+                    return cached["files"], cached["dirs"]
+            except OSError:
+                pass
+        mtime_ns, files, dirs = scan_directory(path)
+        with self.lock:
+            self.new[path] = {"mtime_ns": mtime_ns, "files": files, "dirs": dirs}
+            self.scanned += 1
+        return files, dirs
+
+    def save(self):
+        """Writes the index (only call after a complete walk, so deleted folders drop out)."""
+        if self.index_path:
+            save_index(self.index_path, self.new)
+
+
+def iter_images(root, scan_threads=0, index_path=None, lister=None):
+    """
+    Yields the path of every image under root while walking.
+    scan_threads > 1 lists that many directories at once; index_path enables the file index.
+    """
+    lister = lister or DirectoryLister(index_path)
+    if scan_threads and scan_threads > 1:
+        walk = _walk_parallel(root, lister, scan_threads)
+    else:
+        walk = _walk_serial(root, lister)
+    for path in walk:
+        yield path
+    lister.save() # only reached when the walk finished
+
+
+def _walk_serial(root, lister):
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            files, dirs = lister.list(path)
+        except OSError as e:
+            print(f"❌ Error: Could not list {path}: {e}")
+            continue
+        for name in files:
+            yield os.path.join(path, name)
+        # Reversed so folders come out in listing order
+        stack.extend(os.path.join(path, name) for name in reversed(dirs))
+
+
+def _walk_parallel(root, lister, scan_threads):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=scan_threads) as executor:
+        pending = {executor.submit(lister.list, root): root}
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    files, dirs = future.result()
+                except OSError as e:
+                    print(f"❌ Error: Could not list {path}: {e}")
+                    continue
+                # Queue the subdirectories first, so the threads keep scanning while we yield
+                for name in dirs:
+                    sub = os.path.join(path, name)
+                    pending[executor.submit(lister.list, sub)] = sub
+                for name in files:
+                    yield os.path.join(path, name)
+
+
+class ImageSource:
+    """
+    Re-iterable, lazy view of the images under a folder: every iteration walks
+    again (cheap with the file index), so each benchmark run streams its own paths.
+    found holds the number of images yielded by the last complete walk.
+    """
+
+    def __init__(self, root, scan_threads=0, index_path=None):
+        self.root = root
+        self.scan_threads = scan_threads
+        self.index_path = index_path
+        self.found = 0
+        self.lister = None
+
+    def __iter__(self):
+        self.lister = DirectoryLister(self.index_path)
+        count = 0
+        for path in iter_images(self.root, self.scan_threads, lister=self.lister):
+            count += 1
+            yield path
+        self.found = count
+
+    def is_empty(self):
+        """True if there is no image at all (stops at the first one found)."""
+        return next(iter(iter_images(self.root, self.scan_threads)), None) is None
+
+    def describe(self):
+        if self.lister is None:
+            return "not walked yet"
+        text = f"{self.found} images, {self.lister.scanned} folders listed"
+        if self.index_path:
+            text += f", {self.lister.reused} reused from the file index"
+        return text
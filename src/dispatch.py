@@ -0,0 +1,254 @@
+import os
+import math
+import time
+import threading
+import functools
+import itertools
+import concurrent.futures
+from filters import process_image
+from memory_stats import read_status_kb
+
+# TASK DISPATCH SHARED BY BOTH POOL BACKENDS
+# Instead of building every task up front and waiting for all of them:
+#   - tasks are grouped into chunks, so one pickle/IPC round-trip carries many images
+#   - the chunk size is auto-tuned from how long chunks actually take on the workers
+#   - at most max_in_flight chunks are queued or running, so the parent never
+#     holds the whole task list or every pending result in memory
+#   - results are yielded as soon as their chunk finishes (streaming completion)
+# The executor backend also drives ThreadPoolExecutor, and the hybrid mode
+# (P processes x T threads) where each process filters a chunk on its own threads.
+
+TARGET_CHUNK_SECONDS = 0.2 # auto chunk size aims for chunks of roughly this duration
+MAX_CHUNKSIZE = 64
+
+
+def make_work(engine, image_paths, output_folder, task_options=None, batch_size=None):
+    """
+    Returns (worker function that takes one item, items to process).
+    Items are image paths, or batches of paths for the numpy engine.
+    """
+    task_options = task_options or {}
+    if engine == "numpy":
+        # Imported here so pillow-engine workers never load numpy (faster worker startup)
+        from numpy_engine import process_batch, make_batches, DEFAULT_BATCH_SIZE
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        worker_func = functools.partial(process_batch, output_folder=output_folder, **task_options)
+        return worker_func, make_batches(image_paths, batch_size)
+    worker_func = functools.partial(process_image, output_folder=output_folder, **task_options)
+    return worker_func, image_paths
+
+
+def known_total(items):
+    """Number of items if known up front (lists), None for a lazily discovered stream."""
+    return len(items) if isinstance(items, (list, tuple)) else None
+
+
+def task_name(item):
+    """Image path -> file name; in-memory tasks are tuples that start with their name."""
+    return os.path.basename(item) if isinstance(item, str) else item[0]
+
+
+def error_results(item, error):
+    """Status dictionaries for an item whose task raised instead of returning."""
+    items = item if isinstance(item, list) else [item]
+    return [{"status": "Error", "filename": task_name(one), "error": str(error), "pid": None}
+            for one in items]
+
+
+def run_chunk(worker_func, items):
+    """
+    Runs on the worker: processes one chunk and times it.
+    Returns (flat list of per-image results, number of items, seconds).
+    """
+    start = time.perf_counter()
+    results = []
+    for item in items:
+        item_start = time.perf_counter()
+        try:
+            result = worker_func(item)
+        except Exception as e:
+            result = error_results(item, e)
+        # process_batch returns a list, process_image a single dictionary
+        result = result if isinstance(result, list) else [result]
+        # Thread id for the load-balancing breakdown of the thread backends,
+        # time in the task for the per-worker busy/idle report (a batch's time is shared)
+        tid = threading.get_native_id()
+        task_seconds = (time.perf_counter() - item_start) / max(len(result), 1)
+        for one in result:
+            one["tid"] = tid
+            one["task_seconds"] = task_seconds
+        results.extend(result)
+    # The worker's peak RSS so far, for the parent's memory report (one /proc read per chunk)
+    peak_rss_kb = read_status_kb(field="VmHWM")
+    for result in results:
+        result["peak_rss_kb"] = peak_rss_kb
+    return results, len(items), time.perf_counter() - start
+
+
+# Threads of this hybrid worker process (created on its first chunk)
+_chunk_threads = None
+
+
+def run_chunk_threaded(worker_func, num_threads, items):
+    """
+    Hybrid mode, runs on a worker process: spreads the items of one chunk over
+    num_threads threads. Same return value as run_chunk.
+    """
+    global _chunk_threads
+    if _chunk_threads is None:
+        _chunk_threads = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads)
+    start = time.perf_counter()
+    results = []
+    for part, _, _ in _chunk_threads.map(functools.partial(run_chunk, worker_func), [[item] for item in items]):
+        results.extend(part)
+    return results, len(items), time.perf_counter() - start
+
+
+class ChunkSizer:
+    """
+    Picks the size of the next chunk. A fixed chunksize is used as is; otherwise
+    the first chunks hold one item each, and later ones are sized from the measured
+    time per item so a chunk takes about TARGET_CHUNK_SECONDS. When the total is
+    known, chunks also shrink towards the end so the last workers are not left idle.
+    With costs (estimated work of each item, in dispatch order), a chunk also holds
+    at most 1/(4 x workers) of the remaining estimated work, so the expensive
+    items dispatched first go out alone and the tail goes out in small chunks.
+    """
+
+    def __init__(self, num_workers, total=None, chunksize=None, min_size=1, costs=None):
+        self.num_workers = num_workers
+        self.total = total
+        self.fixed = chunksize
+        self.min_size = min_size # hybrid mode: at least one item per thread
+        self.costs = costs
+        self.remaining_cost = sum(costs) if costs else 0
+        self.dispatched = 0
+        self.chunks = 0
+        self.observed_items = 0
+        self.observed_seconds = 0.0
+        self.sizes = []
+        self.lock = threading.Lock()
+
+    def next_size(self):
+        with self.lock:
+            if self.fixed:
+                return self.fixed
+            if self.observed_items == 0:
+                return self.min_size # probe: nothing measured yet
+            per_item = self.observed_seconds / self.observed_items
+            size = TARGET_CHUNK_SECONDS / per_item if per_item > 0 else MAX_CHUNKSIZE
+            if self.total is not None:
+                remaining = max(self.total - self.dispatched, 1)
+                size = min(size, math.ceil(remaining / (self.num_workers * 4)))
+            size = max(self.min_size, min(int(size), MAX_CHUNKSIZE))
+            if self.costs:
+                size = self._fit_cost(size)
+            return size
+
+    def _fit_cost(self, size):
+        """Shrinks a chunk to the cost budget (never below min_size)."""
+        budget = self.remaining_cost / (self.num_workers * 4)
+        count = 0
+        cost = 0
+        for item_cost in self.costs[self.dispatched:self.dispatched + size]:
+            if count >= self.min_size and cost + item_cost > budget:
+                break
+            count += 1
+            cost += item_cost
+        return max(count, 1)
+
+    def dispatched_chunk(self, size):
+        with self.lock:
+            if self.costs:
+                self.remaining_cost -= sum(self.costs[self.dispatched:self.dispatched + size])
+            self.dispatched += size
+            self.chunks += 1
+            self.sizes.append(size)
+
+    def record(self, items, seconds):
+        with self.lock:
+            self.observed_items += items
+            self.observed_seconds += seconds
+
+    def describe(self):
+        if not self.sizes:
+            return "no chunks"
+        mode = "fixed" if self.fixed else "auto"
+        return (f"{self.chunks} chunks ({mode}), size min {min(self.sizes)} / "
+                f"avg {sum(self.sizes) / len(self.sizes):.1f} / max {max(self.sizes)}")
+
+
+def iter_chunks(items, sizer, slots=None, stop=None):
+    """
+    Cuts items into chunks as they are needed. With slots (a semaphore), waits
+    for a free in-flight slot before producing the next chunk.
+    """
+    iterator = iter(items)
+    while True:
+        if slots is not None:
+            while not slots.acquire(timeout=0.1):
+                if stop is not None and stop.is_set():
+                    return
+        chunk = list(itertools.islice(iterator, sizer.next_size()))
+        if not chunk:
+            if slots is not None:
+                slots.release()
+            return
+        sizer.dispatched_chunk(len(chunk))
+        yield chunk
+
+
+def default_in_flight(num_workers, max_in_flight=None):
+    return max_in_flight or num_workers * 2
+
+
+def stream_pool_results(pool, worker_func, items, sizer, max_in_flight=None):
+    """multiprocessing.Pool backend: yields per-image results as chunks finish."""
+    slots = threading.Semaphore(default_in_flight(sizer.num_workers, max_in_flight))
+    stop = threading.Event()
+    # imap_unordered pulls chunks from the generator on its own thread; the
+    # semaphore makes that thread wait whenever max_in_flight chunks are out
+    chunks = iter_chunks(items, sizer, slots, stop)
+    try:
+        for results, count, seconds in pool.imap_unordered(functools.partial(run_chunk, worker_func), chunks):
+            slots.release()
+            sizer.record(count, seconds)
+            yield from results
+    finally:
+        stop.set()
+
+
+def stream_executor_results(executor, worker_func, items, sizer, max_in_flight=None, threads=None):
+    """
+    concurrent.futures backend: yields per-image results as chunks finish.
+    With threads, each worker process runs its chunks on that many threads (hybrid mode).
+    """
+    limit = default_in_flight(sizer.num_workers, max_in_flight)
+    chunks = iter_chunks(items, sizer)
+    pending = {} # future -> chunk
+
+    def submit_more():
+        # Keep up to `limit` chunks in flight
+        while len(pending) < limit:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            if threads:
+                pending[executor.submit(run_chunk_threaded, worker_func, threads, chunk)] = chunk
+            else:
+                pending[executor.submit(run_chunk, worker_func, chunk)] = chunk
+
+    submit_more()
+    while pending:
+        # Like as_completed(), but lets us top the window back up after every completion
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            chunk = pending.pop(future)
+            try:
+                results, count, seconds = future.result()
+                sizer.record(count, seconds)
+            except Exception as e:
+                # The whole chunk failed (e.g. a worker crashed)
+                results = [error for item in chunk for error in error_results(item, e)]
+            yield from results
+        submit_more()
@@ -0,0 +1,547 @@
+import os
+import sys
+import time
+import queue
+import socket
+import argparse
+import itertools
+import threading
+import subprocess
+from multiprocessing.connection import Listener, Client
+from filters import prepare_output_folders
+from writer import close_writer
+from dispatch import make_work, run_chunk, error_results
+from stage_trace import StageRecorder, trace_base_path
+from scheduling import ScheduleReport
+from memory_stats import MemoryReport
+from shards import begin_shard_run, write_shard_index
+from run_options import (add_processing_arguments, task_options_from_args, print_run_options,
+                         input_folder_from_args, image_source_from_args, trace_dir_from_args,
+                         baseline_options, baseline_mismatches)
+
+# DISTRIBUTED MODE: ONE COORDINATOR, MANY TCP WORKER AGENTS
+# The pool scripts can only scale up to the cores of one machine. Here:
+#   - the coordinator walks input_images (lazily) and hands out leases: a few
+#     tasks at a time, over TCP (multiprocessing.connection, authenticated)
+#   - each agent runs process_image / process_batch on its lease and sends
+#     back the same result dictionaries the pool workers return
+#   - a lease not returned within --lease-timeout seconds (or whose agent
+#     disconnects) goes back in the queue and is retried by another agent, at
+#     most --max-retries times before its images are reported as failed
+#   - a result arriving after its lease was retried elsewhere is dropped, so
+#     no image is counted twice
+# Agents read and write the images at the same paths as the coordinator, so
+# on several machines input_images/ and the output folder must be shared (NFS...).
+# Messages are pickled, so whoever passes the authkey check can run code on
+# the other side: there is no default key. Local mode makes a random one for
+# its own agents; coordinator and agent modes refuse to start without
+# CST435_AUTHKEY (the same secret everywhere), and the coordinator only
+# listens on 127.0.0.1 unless --listen says otherwise.
+#
+#   python3 src/distributed.py local --agents 2,4,8          # one machine, local agents
+#   export CST435_AUTHKEY=<shared secret>                   # every machine, e.g. openssl rand -hex 32
+#   python3 src/distributed.py coordinator --listen 0.0.0.0:6000
+#   python3 src/distributed.py agent --connect <coordinator ip>:6000
+
+DEFAULT_PORT = 6000
+DEFAULT_LEASE_SIZE = 4       # tasks per lease (images, or numpy batches)
+DEFAULT_LEASE_TIMEOUT = 60.0 # seconds before an unreturned lease is retried
+DEFAULT_MAX_RETRIES = 2
+POLL_SECONDS = 0.2           # how long an agent waits when every task is leased out
+AUTHKEY_ENV = "CST435_AUTHKEY"
+
+
+def network_authkey():
+    """The shared secret from CST435_AUTHKEY (exits when it is not set: there is no safe default)."""
+    key = os.environ.get(AUTHKEY_ENV)
+    if not key:
+        print(f"❌ Error: {AUTHKEY_ENV} is not set!")
+        print(f"Set it to the same secret on the coordinator and every agent, e.g. export {AUTHKEY_ENV}=$(openssl rand -hex 32)")
+        exit(1)
+    return key.encode()
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    """'host:port', 'host' or ':port' -> (host, port)."""
+    host, _, port = text.rpartition(":") if ":" in text else (text, "", "")
+    return host or default_host, int(port) if port else DEFAULT_PORT
+
+
+class LeaseTable:
+    """
+    Coordinator side: groups the items into leases and tracks who holds what.
+    A group that comes back is done; an expired group is queued again with one
+    more attempt. Every finished result (or the error results of a group out
+    of retries) is put on the results queue.
+    """
+
+    def __init__(self, items, lease_size=DEFAULT_LEASE_SIZE, lease_timeout=DEFAULT_LEASE_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        self.items = iter(items)
+        self.lease_size = lease_size
+        self.lease_timeout = lease_timeout
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.results = queue.Queue()
+        self.groups = {}    # group id -> (items, attempts) until the group is done
+        self.retry = []     # group ids waiting to be leased again
+        self.leases = {}    # lease id -> (group id, agent, deadline)
+        self.expired_leases = {} # lease id -> group id, to recognise late results (until the group is done)
+        self.group_ids = itertools.count()
+        self.lease_ids = itertools.count()
+        self.exhausted = False
+        self.issued = self.expired = self.duplicates = self.abandoned = 0
+        self.first_lease_at = None
+
+    def lease(self, agent):
+        """(lease id, items) for agent, or None if nothing can be handed out right now."""
+        with self.lock:
+            self._expire()
+            group = None
+            while self.retry and group is None:
+                candidate = self.retry.pop(0)
+                group = candidate if candidate in self.groups else None
+            if group is None and not self.exhausted:
+                # Discovery runs here, a lease at a time
+                items = list(itertools.islice(self.items, self.lease_size))
+                if len(items) < self.lease_size:
+                    self.exhausted = True
+                    self.results.put(None) # wakes stream() to check whether everything is done
+                if items:
+                    group = next(self.group_ids)
+                    self.groups[group] = (items, 0)
+            if group is None:
+                return None
+            lease_id = next(self.lease_ids)
+            self.leases[lease_id] = (group, agent, time.monotonic() + self.lease_timeout)
+            self.issued += 1
+            if self.first_lease_at is None:
+                self.first_lease_at = time.time()
+            return lease_id, self.groups[group][0]
+
+    def complete(self, lease_id, agent, results):
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+            # An expired lease's group may still be waiting for its retry: accept the late result
+            group = lease[0] if lease else self.expired_leases.pop(lease_id, None)
+            if group not in self.groups:
+                self.duplicates += 1 # finished elsewhere already (late result of a retried lease)
+                return
+            self._finish_group(group)
+            for result in results:
+                result["agent"] = agent
+                self.results.put(result)
+
+    def release(self, agent):
+        """An agent disconnected: its leases expire now instead of at their deadline."""
+        with self.lock:
+            for lease_id, (group, holder, _) in list(self.leases.items()):
+                if holder == agent:
+                    self._expire_lease(lease_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        for lease_id, (_, _, deadline) in list(self.leases.items()):
+            if deadline < now:
+                self._expire_lease(lease_id)
+
+    def _expire_lease(self, lease_id):
+        group, agent, _ = self.leases.pop(lease_id)
+        if group not in self.groups:
+            return
+        self.expired_leases[lease_id] = group
+        self.expired += 1
+        items, attempts = self.groups[group]
+        if attempts >= self.max_retries:
+            # Out of retries: report the images as failed instead of waiting forever
+            self._finish_group(group)
+            self.abandoned += 1
+            for item in items:
+                for result in error_results(item, f"lease expired {attempts + 1} times (last on {agent})"):
+                    self.results.put(result)
+        else:
+            self.groups[group] = (items, attempts + 1)
+            self.retry.append(group)
+
+    def _finish_group(self, group):
+        """Done or abandoned: a late result of one of its expired leases is now just a duplicate."""
+        del self.groups[group]
+        if self.expired_leases:
+            for lease_id in [lease_id for lease_id, expired in self.expired_leases.items() if expired == group]:
+                del self.expired_leases[lease_id]
+
+    def finished(self):
+        with self.lock:
+            return self.exhausted and not self.groups
+
+    def unfinished(self):
+        """(leases still out or waiting for a retry, their images) right now."""
+        with self.lock:
+            return len(self.groups), sum(len(items) for items, _ in self.groups.values())
+
+    def stream(self, check=None):
+        """Yields results as they come back until every group is done. check() may raise to abort."""
+        while True:
+            with self.lock:
+                if self.exhausted and not self.groups and self.results.empty():
+                    return
+            try:
+                result = self.results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                with self.lock:
+                    self._expire()
+                if check:
+                    check()
+                continue
+            if result is not None:
+                yield result
+
+    def describe(self):
+        return (f"{self.issued} leases issued | {self.expired} expired | {self.abandoned} abandoned "
+                f"| {self.duplicates} late duplicates dropped")
+
+
+class Coordinator:
+    """Listens for agents and serves each connection on its own thread."""
+
+    def __init__(self, address, table, job, authkey=None):
+        self.table = table
+        self.job = job # what every agent needs to build its worker function
+        self.listener = Listener(address, authkey=authkey or network_authkey())
+        self.address = self.listener.address
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return # listener closed
+            except Exception as e:
+                # Wrong authkey or a client that is not an agent
+                print(f"\n❌ Error: rejected connection: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        agent = None
+        try:
+            agent = conn.recv()["agent"]
+            conn.send({"type": "job", **self.job})
+            while True:
+                message = conn.recv()
+                if message["type"] == "results":
+                    self.table.complete(message["lease"], agent, message["results"])
+                    continue
+                lease = self.table.lease(agent)
+                if lease is not None:
+                    conn.send({"type": "tasks", "lease": lease[0], "items": lease[1]})
+                elif self.table.finished():
+                    conn.send({"type": "done"})
+                    return
+                else:
+                    # Everything is leased out: ask again later, a lease may expire
+                    conn.send({"type": "wait", "seconds": POLL_SECONDS})
+        except (EOFError, OSError):
+            pass # agent gone: its leases are retried
+        finally:
+            if agent is not None:
+                self.table.release(agent)
+            conn.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def run_agent(address, authkey=None, name=None, fault=None, fault_after=0):
+    """
+    Worker agent: asks for leases until the coordinator says done.
+    fault = "crash" (exit) or "stall" (hang) after fault_after leases, to exercise retries.
+    Returns the number of leases completed.
+    """
+    conn = Client(address, authkey=authkey or network_authkey())
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    conn.send({"agent": name})
+    job = conn.recv()
+    prepare_output_folders(job["output_folder"], job["task_options"]["filters"])
+    worker_func, _ = make_work(job["engine"], [], job["output_folder"], job["task_options"], job["batch_size"])
+
+    completed = 0
+    while True:
+        try:
+            conn.send({"type": "lease"})
+            reply = conn.recv()
+        except (EOFError, OSError):
+            break # the coordinator finished (or went away) before telling this agent
+        if reply["type"] == "done":
+            break
+        if reply["type"] == "wait":
+            time.sleep(reply["seconds"])
+            continue
+        if fault and completed >= fault_after:
+            print(f"Agent {name}: simulated {fault} holding lease {reply['lease']}", file=sys.stderr)
+            if fault == "crash":
+                os._exit(1)
+            while True:
+                time.sleep(3600)
+        results, _, _ = run_chunk(worker_func, reply["items"])
+        if job["task_options"].get("async_write"):
+            # The lease is only complete once its files are on disk
+            _, write_errors = close_writer()
+            for save_path, error in write_errors:
+                results.append({"status": "Error", "filename": os.path.basename(save_path),
+                                "error": error, "pid": os.getpid()})
+        conn.send({"type": "results", "lease": reply["lease"], "results": results})
+        completed += 1
+    conn.close()
+    return completed
+
+
+def collect_results(table, num_workers, check=None, recorder=None):
+    """
+    Aggregates the results like the pool scripts do.
+    Returns (success, failed, agent -> images, schedule report, memory report).
+    """
+    success_count = fail_count = 0
+    agent_stats = {} # Track how many images each agent processed for load balancing analysis
+    schedule_report = ScheduleReport(num_workers)
+    memory_report = MemoryReport()
+    for result in table.stream(check):
+        if recorder:
+            recorder.add(result)
+        agent = result.get("agent")
+        schedule_report.add(result, worker=agent)
+        memory_report.add(result)
+        if result.get("status") == "Success":
+            success_count += 1
+        else:
+            fail_count += 1
+            print(f"\n❌ Error: {result.get('filename')}: {result.get('error')}")
+        if agent:
+            agent_stats[agent] = agent_stats.get(agent, 0) + 1
+    memory_report.finish()
+    return success_count, fail_count, agent_stats, schedule_report, memory_report
+
+
+def print_run_report(duration, success_count, fail_count, agent_stats, table, schedule_report,
+                     memory_report, recorder=None, trace_dir=None, run_label="distributed"):
+    print(f"Done! ({duration:.4f}s)")
+    print(f"      [Stats] Success: {success_count} | Failed: {fail_count}")
+    print(f"      [Leases] {table.describe()}")
+    schedule_report.print_report(duration)
+    memory_report.print_report()
+    if recorder:
+        recorder.finish()
+        recorder.print_report()
+        trace_path, csv_path = recorder.export(trace_base_path(trace_dir, run_label))
+        print(f"      [Trace] {trace_path} | {csv_path}")
+    print(f"      [Load Balancing] Agent Breakdown:")
+    for agent, count in sorted(agent_stats.items()):
+        print(f"         - Agent {agent}: Processed {count} images")
+    print("")
+
+
+def make_job(args, output_folder, task_options):
+    # Every run gets its own output shards (--shard-output); agents on other
+    # machines write theirs to their own output folder
+    return {"engine": args.engine, "batch_size": args.batch_size,
+            "output_folder": output_folder, "task_options": begin_shard_run(output_folder, task_options)}
+
+
+class AgentsLost(RuntimeError):
+    """A local run lost all of its agents with work still outstanding."""
+
+
+def run_test_with_agents(num_agents, args, image_paths, output_folder, task_options, trace_dir=None):
+    """Local scale-out run: a coordinator on 127.0.0.1 and num_agents agent processes. Returns the time."""
+    print(f"   Testing with {num_agents} agent(s)...", end=" ", flush=True)
+    start_time = time.time()
+
+    _, items = make_work(args.engine, image_paths, output_folder, task_options, args.batch_size)
+    table = LeaseTable(items, args.lease_size, args.lease_timeout, args.max_retries)
+    # A fresh random key per run, handed to the agents through their environment (not the command line)
+    authkey = os.urandom(32).hex()
+    coordinator = Coordinator(("127.0.0.1", 0), table, make_job(args, output_folder, task_options), authkey.encode())
+    host, port = coordinator.address
+
+    # Agents are separate Python processes, as they would be on other machines
+    agents = []
+    for index in range(num_agents):
+        command = [sys.executable, os.path.abspath(__file__), "agent", "--connect", f"{host}:{port}"]
+        if args.fault and index == 0:
+            command += ["--fault", args.fault, "--fault-after", str(args.fault_after)]
+        # Their own progress lines would interleave with the report (errors still go to stderr)
+        agents.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, env=dict(os.environ, **{AUTHKEY_ENV: authkey})))
+
+    def check():
+        if all(agent.poll() is not None for agent in agents) and not table.finished():
+            groups, items = table.unfinished()
+            raise AgentsLost(f"every agent exited before the work was done: {groups} lease(s) "
+                             f"with {items} task(s) never came back ({table.describe()})")
+
+    recorder = StageRecorder() if trace_dir else None
+    try:
+        stats = collect_results(table, num_agents, check, recorder)
+        # Agents exit on their next lease request; a stalled one (--fault stall) never asks again
+        deadline = time.monotonic() + 10 * POLL_SECONDS
+        for agent in agents:
+            try:
+                agent.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                agent.kill()
+                agent.wait()
+    finally:
+        coordinator.close()
+        for agent in agents:
+            if agent.poll() is None:
+                agent.kill()
+    if task_options.get("shard_output"):
+        write_shard_index(output_folder)
+    duration = time.time() - start_time
+
+    print_run_report(duration, *stats[:3], table, *stats[3:], recorder, trace_dir, f"distributed_{num_agents}")
+    return duration
+
+
+def load_serial_baseline(project_root, options):
+    """
+    Serial baseline from serial_baseline_value.csv, or None if serial_baseline.py
+    has not run or measured other work (options differ, see run_options.baseline_options).
+    """
+    import csv
+    try:
+        with open(os.path.join(project_root, "serial_baseline_value.csv"), 'r') as f:
+            rows = {row['metric']: row['value'] for row in csv.DictReader(f)}
+    except FileNotFoundError:
+        return None
+    mismatches = baseline_mismatches(rows, options)
+    if mismatches:
+        print("Serial baseline ignored (measured with other options: "
+              + ", ".join(f"{name} {saved} vs {value}" for name, saved, value in mismatches) + ")")
+        return None
+    return float(rows['serial_baseline']) if 'serial_baseline' in rows else None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Distributed image processing: coordinator and TCP worker agents")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    local = modes.add_parser("local", help="Coordinator plus N local agents (scale-out benchmark on one machine)")
+    coordinator = modes.add_parser("coordinator", help="Serve one run to agents on other machines")
+    for sub in (local, coordinator):
+        add_processing_arguments(sub)
+        sub.add_argument("--lease-size", type=int, default=DEFAULT_LEASE_SIZE,
+                         help="Tasks handed to an agent at a time")
+        sub.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT,
+                         help="Seconds before an unreturned lease is given to another agent")
+        sub.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                         help="Retries of an expired lease before its images count as failed")
+    local.add_argument("--agents", default="2,4,8", help="Comma separated agent counts to test")
+    coordinator.add_argument("--listen", default=f"127.0.0.1:{DEFAULT_PORT}",
+                             help="host:port to accept agents on (0.0.0.0:<port> for agents on other machines)")
+    coordinator.add_argument("--num-agents", type=int, default=1,
+                             help="Agents expected (only used for the idle-time report)")
+
+    agent = modes.add_parser("agent", help="Process leases from a coordinator")
+    agent.add_argument("--connect", default=f"127.0.0.1:{DEFAULT_PORT}", help="Coordinator host:port")
+    agent.add_argument("--name", default=None, help="Name in the reports (default: host:pid)")
+
+    # Fault injection, to see lease timeouts and retries on one machine
+    for sub in (local, agent):
+        sub.add_argument("--fault", choices=["crash", "stall"], default=None,
+                         help="Make an agent crash or hang while holding a lease" +
+                              (" (the first agent)" if sub is local else ""))
+        sub.add_argument("--fault-after", type=int, default=1, help="Leases completed before the fault")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.mode in ("coordinator", "agent"):
+        authkey = network_authkey() # before any work: no networked run without a shared secret
+    if args.mode == "agent":
+        completed = run_agent(parse_address(args.connect), authkey, name=args.name,
+                              fault=args.fault, fault_after=args.fault_after)
+        print(f"Agent finished: {completed} leases")
+        return
+
+    print(f"\n{'='*60}")
+    print(f"Automated Performance Test: Distributed ({args.mode})")
+    print(f"{'='*60}")
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = input_folder_from_args(args, project_root) # input_images, or --input-shards
+    OUTPUT_FOLDER = os.path.join(project_root, "output_distributed")
+
+    if args.array_store:
+        print("Array store: off (agents on other machines cannot share one memory map)")
+        args.array_store = False
+    task_options = task_options_from_args(args, project_root)
+    print_run_options(args, task_options)
+    print(f"Leases: {args.lease_size} tasks | timeout {args.lease_timeout:g}s | {args.max_retries} retries")
+    trace_dir = trace_dir_from_args(args, project_root)
+
+    if not os.path.exists(INPUT_FOLDER):
+        print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
+        return
+
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    prepare_output_folders(OUTPUT_FOLDER, task_options["filters"])
+
+    image_paths = image_source_from_args(args, INPUT_FOLDER, project_root)
+    if image_paths.is_empty():
+        print(f"No images found. Please add images to 'input_images' folder.")
+        return
+    print(f"Streaming images from {INPUT_FOLDER}\n")
+
+    if args.mode == "coordinator":
+        _, items = make_work(args.engine, image_paths, OUTPUT_FOLDER, task_options, args.batch_size)
+        table = LeaseTable(items, args.lease_size, args.lease_timeout, args.max_retries)
+        coordinator = Coordinator(parse_address(args.listen), table,
+                                  make_job(args, OUTPUT_FOLDER, task_options), authkey)
+        host, port = coordinator.address
+        print(f"Waiting for agents on {host}:{port} "
+              f"(python3 src/distributed.py agent --connect <this host>:{port})")
+        try:
+            # Timed from the first lease, not while waiting for the agents to be started
+            while table.first_lease_at is None:
+                time.sleep(POLL_SECONDS)
+            print(f"   Running...", end=" ", flush=True)
+            recorder = StageRecorder() if trace_dir else None
+            stats = collect_results(table, args.num_agents, None, recorder)
+        finally:
+            coordinator.close()
+        if task_options.get("shard_output"):
+            write_shard_index(OUTPUT_FOLDER)
+        duration = time.time() - table.first_lease_at
+        print_run_report(duration, *stats[:3], table, *stats[3:], recorder, trace_dir, "distributed_coordinator")
+        print("Test Complete.")
+        return
+
+    serial_time = load_serial_baseline(project_root, baseline_options(args, task_options))
+    if serial_time:
+        print(f"Using serial baseline: {serial_time:.4f}s")
+    print("Starting Distributed Tests...")
+    agent_counts = [int(n) for n in args.agents.split(",")]
+    results = {}
+    for count in agent_counts:
+        try:
+            results[count] = run_test_with_agents(count, args, image_paths, OUTPUT_FOLDER, task_options, trace_dir)
+        except AgentsLost as e:
+            print(f"\n❌ Error: {e}")
+            exit(1)
+
+    print(f"{'-'*60}")
+    print(f"{'Agents':<10} | {'Time (s)':<15} | {'Speedup (x)':<15}")
+    print(f"{'-'*60}")
+    for count in agent_counts:
+        speedup = f"{serial_time / results[count]:.2f}" if serial_time else "-"
+        print(f"{count:<10} | {results[count]:<15.4f} | {speedup:<15}")
+    print(f"Discovery: {image_paths.describe()}")
+    print(f"{'='*60}")
+    print("Test Complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import numpy as np
+from PIL import Image
+import PIL
+from filters import FILTER_NAMES, FILTER_GRAPH, BLUR_RADIUS, BRIGHTNESS_FACTOR
+from numpy_engine import (batch_grayscale, batch_blur, batch_edges, batch_sharpen, batch_brightness,
+                          _with_border, EDGE_KERNEL, TOLERANCE)
+
+# Optional backends: used only when installed
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+# PLUGGABLE FILTER BACKENDS (--backends)
+# Every filter of the Pillow graph can be computed by several implementations:
+#   pillow (the reference), numpy (the batch engine's kernels on one image),
+#   and opencv / scipy when those packages are installed.
+# --backends auto runs a microbenchmark on a sample image once per machine:
+#   - every implementation is first checked against the Pillow output and
+#     rejected if any pixel differs by more than the filter's TOLERANCE
+#   - the fastest accepted implementation of each filter is chosen
+#   - the choice is cached in filter_backends.json (keyed by machine and
+#     library versions), so later runs start without benchmarking
+# "grayscale" selects the implementation of the shared luminance plane
+# (edge reads from it too). Pillow stays the default.
+
+BACKEND_NAMES = ("pillow", "numpy", "opencv", "scipy")
+SAMPLE_SIZE = (640, 480) # synthetic sample image (width, height)
+REPEATS = 5              # timed runs per implementation (the median is kept)
+
+# Filter name -> graph node it replaces
+FILTER_NODE = {"grayscale": "luminance", "blur": "blur", "edge": "edge",
+               "sharpen": "sharpen", "brightness": "brightness"}
+
+
+def _on_one(batch_func):
+    """Runs a numpy batch kernel on a single PIL image."""
+    return lambda img: Image.fromarray(batch_func(np.asarray(img)[np.newaxis])[0])
+
+
+def _cv2_edges(lum):
+    pixels = np.asarray(lum)
+    if min(pixels.shape) < 3:
+        return lum.copy()
+    # filter2D saturates to uint8 like Pillow; its border is replaced by the original pixels
+    edges = cv2.filter2D(pixels, -1, EDGE_KERNEL.astype(np.float32))
+    return Image.fromarray(_with_border(pixels[np.newaxis], edges[1:-1, 1:-1])[0])
+
+
+def _scipy_edges(lum):
+    pixels = np.asarray(lum)
+    if min(pixels.shape) < 3:
+        return lum.copy()
+    edges = np.clip(ndimage.convolve(pixels.astype(np.int32), EDGE_KERNEL, mode="nearest"), 0, 255)
+    return Image.fromarray(_with_border(pixels[np.newaxis], edges[1:-1, 1:-1].astype(np.uint8))[0])
+
+
+def _scipy_blur(rgb):
+    pixels = np.asarray(rgb).astype(np.float32)
+    out = ndimage.gaussian_filter(pixels, sigma=(BLUR_RADIUS, BLUR_RADIUS, 0), mode="nearest")
+    return Image.fromarray(np.clip(out + 0.5, 0, 255).astype(np.uint8))
+
+
+def _implementations():
+    """Graph node -> {backend: function taking the node's PIL inputs}."""
+    impls = {node: {"pillow": FILTER_GRAPH[node][1]} for node in FILTER_NODE.values()}
+    impls["luminance"]["numpy"] = _on_one(batch_grayscale)
+    impls["blur"]["numpy"] = _on_one(batch_blur)
+    impls["edge"]["numpy"] = _on_one(batch_edges)
+    impls["sharpen"]["numpy"] = _on_one(batch_sharpen)
+    impls["brightness"]["numpy"] = _on_one(batch_brightness)
+    if cv2 is not None:
+        impls["luminance"]["opencv"] = lambda rgb: Image.fromarray(cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2GRAY))
+        impls["blur"]["opencv"] = lambda rgb: Image.fromarray(
+            cv2.GaussianBlur(np.asarray(rgb), (0, 0), BLUR_RADIUS, borderType=cv2.BORDER_REPLICATE))
+        impls["edge"]["opencv"] = _cv2_edges
+        impls["brightness"]["opencv"] = lambda rgb: Image.fromarray(
+            cv2.convertScaleAbs(np.asarray(rgb), alpha=BRIGHTNESS_FACTOR))
+    if ndimage is not None:
+        impls["blur"]["scipy"] = _scipy_blur
+        impls["edge"]["scipy"] = _scipy_edges
+    return impls
+
+
+IMPLEMENTATIONS = _implementations()
+
+
+def available_backends(name):
+    """Backends that implement one filter on this machine."""
+    return tuple(backend for backend in BACKEND_NAMES if backend in IMPLEMENTATIONS[FILTER_NODE[name]])
+
+
+def node_function(node, backends):
+    """Build function of a graph node under a filter -> backend selection (None = Pillow)."""
+    for name, mapped in FILTER_NODE.items():
+        if mapped == node and backends and name in backends:
+            return IMPLEMENTATIONS[node][backends[name]]
+    return FILTER_GRAPH[node][1]
+
+
+def parse_backends(text):
+    """
+    "pillow", "numpy" (every filter it implements) or "blur=numpy,edge=opencv".
+    Returns filter -> backend for the non-Pillow choices, or None for all Pillow.
+    """
+    selection = {}
+    for part in [part.strip() for part in text.split(",") if part.strip()]:
+        if "=" in part:
+            name, backend = [value.strip() for value in part.split("=", 1)]
+            if name not in FILTER_NAMES:
+                raise ValueError(f"Unknown filter '{name}'. Choose from: {', '.join(FILTER_NAMES)}")
+            if backend not in available_backends(name):
+                raise ValueError(f"No '{backend}' backend for {name} here. "
+                                 f"Available: {', '.join(available_backends(name))}")
+            selection[name] = backend
+        elif part in BACKEND_NAMES:
+            selection.update({name: part for name in FILTER_NAMES if part in available_backends(name)})
+        else:
+            raise ValueError(f"Unknown backend '{part}'. Choose from: auto, {', '.join(BACKEND_NAMES)}")
+    return {name: backend for name, backend in selection.items() if backend != "pillow"} or None
+
+
+def sample_image(size=SAMPLE_SIZE):
+    """Deterministic photo-like test image: smooth gradients, hard edges and noise."""
+    width, height = size
+    rng = np.random.default_rng(435)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    base[height // 3: 2 * height // 3, width // 3: 2 * width // 3] = (240, 30, 60)
+    noisy = base + rng.normal(0, 20, base.shape)
+    return Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+
+
+def max_difference(a, b):
+    return int(np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).max())
+
+
+def microbenchmark(img=None, repeats=REPEATS):
+    """
+    Times every implementation of every filter on one image.
+    Returns (filter -> chosen backend, filter -> {backend: median ms}, filter -> {backend: reason rejected}).
+    """
+    img = sample_image() if img is None else img
+    inputs = {"rgb": img, "luminance": FILTER_GRAPH["luminance"][1](img)}
+    chosen, timings, rejected = {}, {}, {}
+    for name in FILTER_NAMES:
+        node = FILTER_NODE[name]
+        node_input = inputs[FILTER_GRAPH[node][0][0]]
+        reference = IMPLEMENTATIONS[node]["pillow"](node_input)
+        timings[name], rejected[name] = {}, {}
+        for backend, func in IMPLEMENTATIONS[node].items():
+            try:
+                diff = max_difference(func(node_input), reference)
+            except Exception as e:
+                rejected[name][backend] = f"error: {e}"
+                continue
+            if diff > TOLERANCE[name]:
+                rejected[name][backend] = f"max diff {diff} > tolerance {TOLERANCE[name]}"
+                continue
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                func(node_input)
+                samples.append((time.perf_counter() - start) * 1000)
+            timings[name][backend] = sorted(samples)[len(samples) // 2]
+        chosen[name] = min(timings[name], key=timings[name].get)
+    return chosen, timings, rejected
+
+
+def machine_key():
+    """Cached choices are only reused on the same machine with the same libraries."""
+    versions = [f"pillow {PIL.__version__}", f"numpy {np.__version__}"]
+    if cv2 is not None:
+        versions.append(f"opencv {cv2.__version__}")
+    if ndimage is not None:
+        import scipy
+        versions.append(f"scipy {scipy.__version__}")
+    return " | ".join([socket.gethostname(), platform.machine(), f"{os.cpu_count()} cpus"] + versions)
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {} # missing or unreadable cache: benchmark again
+
+
+def benchmark_and_cache(cache_path, img=None):
+    """Runs the microbenchmark and stores its result for this machine. Returns the entry."""
+    chosen, timings, rejected = microbenchmark(img)
+    entry = {"chosen": chosen, "timings_ms": timings, "rejected": rejected,
+             "created": time.strftime('%Y-%m-%d %H:%M:%S')}
+    cache = _load_cache(cache_path)
+    cache[machine_key()] = entry
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    return entry
+
+
+def auto_backends(cache_path):
+    """Per-filter choice from the cache file, benchmarking (and caching) on a miss."""
+    entry = _load_cache(cache_path).get(machine_key()) or benchmark_and_cache(cache_path)
+    # A backend cached before it was uninstalled falls back to Pillow
+    return {name: backend for name, backend in entry["chosen"].items()
+            if backend != "pillow" and backend in available_backends(name)} or None
+
+
+def describe_backends(backends):
+    return ", ".join(f"{name}={(backends or {}).get(name, 'pillow')}" for name in FILTER_NAMES)
+
+
+if __name__ == "__main__":
+    # Benchmark every backend on this machine and refresh the cached choice
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cache_path = os.path.join(project_root, "filter_backends.json")
+    sample = Image.open(sys.argv[1]).convert("RGB") if len(sys.argv) > 1 else None
+    entry = benchmark_and_cache(cache_path, sample)
+    print(f"Filter backend microbenchmark ({'synthetic sample' if sample is None else sys.argv[1]})")
+    for name in FILTER_NAMES:
+        results = " | ".join(f"{backend} {ms:.2f} ms" for backend, ms in sorted(entry["timings_ms"][name].items(),
+                                                                                key=lambda item: item[1]))
+        print(f"   {name:<11} -> {entry['chosen'][name]:<7} ({results})")
+        for backend, reason in entry["rejected"][name].items():
+            print(f"   {'':<11}    {backend} rejected: {reason}")
+    print(f"✅ Saved choice for this machine to: {cache_path}")
@@ -1,9 +1,189 @@
 import os
+import io
 from PIL import Image, ImageFilter, ImageEnhance
+from writer import get_writer
+from result_cache import get_cache, cache_key, hash_bytes
+from stage_trace import stage, drain, traced_save_func
+from shards import read_input, open_input, shard_save_func
 
-def process_image(file_path, output_folder):
+# Filter parameters (shared by every engine so outputs stay comparable)
+BLUR_RADIUS = 3
+SHARPNESS_FACTOR = 3.0
+BRIGHTNESS_FACTOR = 1.5
+
+# The five outputs, in the order they are saved
+FILTER_NAMES = ("grayscale", "blur", "edge", "sharpen", "brightness")
+
+# Parameters of each output (part of the result cache key)
+FILTER_PARAMS = {
+    "grayscale": {},
+    "blur": {"radius": BLUR_RADIUS},
+    "edge": {},
+    "sharpen": {"factor": SHARPNESS_FACTOR},
+    "brightness": {"factor": BRIGHTNESS_FACTOR},
+}
+
+# FILTER GRAPH
+# Each node lists the nodes it reads from and the function that builds it.
+# "rgb" is the decoded source image. Shared nodes (e.g. "luminance") are
+# computed once per image no matter how many filters depend on them.
+# Pillow's convert/filter/enhance all return NEW images, so no node needs
+# to copy its input first.
+FILTER_GRAPH = {
+    "luminance": (("rgb",), lambda rgb: rgb.convert("L")),
+    "grayscale": (("luminance",), lambda lum: lum),
+    "blur": (("rgb",), lambda rgb: rgb.filter(ImageFilter.GaussianBlur(radius=BLUR_RADIUS))),
+    "edge": (("luminance",), lambda lum: lum.filter(ImageFilter.FIND_EDGES)),
+    "sharpen": (("rgb",), lambda rgb: ImageEnhance.Sharpness(rgb).enhance(SHARPNESS_FACTOR)),
+    "brightness": (("rgb",), lambda rgb: ImageEnhance.Brightness(rgb).enhance(BRIGHTNESS_FACTOR)),
+}
+
+
+def resolve_filters(filters=None):
+    """Validates a filter selection. None means all five, in the default order."""
+    if filters is None:
+        return FILTER_NAMES
+    if isinstance(filters, str):
+        filters = [name.strip() for name in filters.split(",") if name.strip()]
+    unknown = [name for name in filters if name not in FILTER_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(unknown)}. Choose from: {', '.join(FILTER_NAMES)}")
+    # Keep the canonical order and drop duplicates
+    return tuple(name for name in FILTER_NAMES if name in filters)
+
+
+# Output folders this process has already created (so os.makedirs runs once per folder, not per save)
+_created_dirs = set()
+
+
+def prepare_output_folders(output_folder, filters=None):
+    """Creates output/<filter> once at startup. Returns filter name -> folder path."""
+    folders = {}
+    for name in resolve_filters(filters):
+        target_dir = os.path.join(output_folder, name)
+        if target_dir not in _created_dirs:
+            os.makedirs(target_dir, exist_ok=True)
+            _created_dirs.add(target_dir)
+        folders[name] = target_dir
+    return folders
+
+
+def run_filter_graph(original_img, filters=None, trace_label=None, backends=None, quality="exact"):
+    """
+    Evaluates only the requested filters (and the nodes they depend on).
+    Returns a dictionary of filter name -> PIL image.
+    With trace_label set, every node is timed as its own stage.
+    With backends (filter -> backend name), those nodes use another implementation (see filter_backends).
+    With quality="fast", blur and sharpen are approximated (see fast_filters).
+    """
+    computed = {"rgb": original_img}
+    trace = trace_label is not None
+    graph = FILTER_GRAPH
+    if quality == "fast" and backends:
+        # The fast graph has its own blur and sharpen (sharpen reads the blur node), which
+        # the backend implementations of the exact nodes do not fit
+        raise ValueError("Filter backends cannot be combined with quality='fast'")
+    if quality == "fast":
+        from fast_filters import FAST_GRAPH
+        graph = FAST_GRAPH
+    if backends:
+        from filter_backends import node_function
+
+    def evaluate(node):
+        if node not in computed:
+            inputs, build = graph[node]
+            if backends:
+                build = node_function(node, backends)
+            args = [evaluate(dep) for dep in inputs]
+            with stage(node, trace, trace_label):
+                computed[node] = build(*args)
+        return computed[node]
+
+    return {name: evaluate(name) for name in resolve_filters(filters)}
+
+
+def decoded_size(size, max_side=None):
+    """(width, height) that open_image decodes an image of this size to."""
+    if max_side and max(size) > max_side:
+        # Same aspect ratio, so draft() can pick the largest reduction
+        scale = max_side / max(size)
+        return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+    return size
+
+
+def open_image(source, max_side=None):
+    """
+    Decodes an image to RGB. With max_side set, the result is at most
+    max_side x max_side pixels: JPEGs are first decoded at 1/2, 1/4 or 1/8
+    scale in the DCT domain (Image.draft), so the full-size frame is never
+    built, then thumbnail() trims the rest.
+    source can also be an image inside an input shard (see shards).
+    """
+    img = Image.open(open_input(source))
+    if max_side and max(img.size) > max_side:
+        target = decoded_size(img.size, max_side)
+        img.draft("RGB", target) # no-op for formats other than JPEG
+        img = img.convert("RGB")
+        if img.size != target:
+            img = img.resize(target, Image.BOX) # area average: cheapest good-quality downscale
+        return img
+    return img.convert("RGB")
+
+
+def output_save_func(shard_output=None, array_store=None):
+    """
+    save_func(img, path) for the outputs that are not one file per image:
+    per-filter shards (see shards) or the memory-mapped array store (see array_store).
+    None means a plain img.save(path).
+    """
+    if array_store:
+        from array_store import store_save_func # numpy is only loaded when the store is used
+        return store_save_func(array_store)
+    if shard_output:
+        return shard_save_func(shard_output)
+    return None
+
+
+def fetch_cached_outputs(cache, file_path, filename, folders, filters, max_side=None, quality="exact",
+                         backends=None):
     """
-    Applies 5 separate filters to an image and organizes them into subfolders.
+    Copies every output of this input that is already in the result cache.
+    Returns (input file bytes, filter name -> cache key, filters still missing).
+    """
+    data = read_input(file_path)
+    content_hash = hash_bytes(data)
+    ext = os.path.splitext(filename)[1]
+    keys = {}
+    missing = []
+    for name in filters:
+        params = dict(FILTER_PARAMS[name])
+        if max_side:
+            params["max_side"] = max_side # reduced-resolution outputs are different results
+        if quality != "exact":
+            params["quality"] = quality # so are approximated ones
+        if backends and name in backends:
+            params["backend"] = backends[name] # and those of another library (not bit-identical to Pillow)
+        keys[name] = cache_key(content_hash, name, params)
+        if not cache.fetch(keys[name], ext, os.path.join(folders[name], filename)):
+            missing.append(name)
+    return data, keys, tuple(missing)
+
+
+def process_image(file_path, output_folder, filters=None, async_write=False, cache_dir=None,
+                  max_side=None, trace=False, backends=None, shard_output=None, array_store=None,
+                  quality="exact"):
+    """
+    Applies the selected filters (all 5 by default) to an image and organizes them into subfolders.
+    With async_write=True the encode/write is handed to this process's background writer.
+    With cache_dir set, outputs already in the result cache are copied instead of recomputed.
+    With max_side set, the image is decoded at reduced resolution (see open_image).
+    With trace=True, per-stage timings are returned under "stages" (see stage_trace).
+    With backends set, the chosen filters run on NumPy/OpenCV/SciPy instead of Pillow.
+    With shard_output (a run id from shards.begin_shard_run), outputs are appended to
+    per-filter shards instead of written as files.
+    With array_store (from array_store.begin_array_store), pixels are copied into a
+    memory-mapped array store and never encoded.
+    With quality="fast", blur and sharpen use the approximate kernels of fast_filters.
     Returns a dictionary with status and worker PID for tracking.
     """
     # Initialize filename just in case an error occurs before it's set
@@ -20,51 +200,70 @@ def process_image(file_path, output_folder):
         # This prevents overwriting when different folders have images with the same name
         filename = f"{category_name}_{original_name}"
         
-        # Open the original image ONCE
-        original_img = Image.open(file_path).convert("RGB")
-        
+        # Subfolders (e.g., output/blur) are only created the first time this process sees them
+        folders = prepare_output_folders(output_folder, filters)
+        filters = resolve_filters(filters)
+
+        # RESULT CACHE: copy every output we already have, only compute the rest
+        cache = get_cache(cache_dir) if cache_dir else None
+        cache_hits = 0
+        source = file_path
+        keys = {}
+        ext = os.path.splitext(filename)[1]
+        if cache:
+            with stage("cache", trace, filename):
+                data, keys, missing = fetch_cached_outputs(cache, file_path, filename, folders, filters, max_side,
+                                                           quality, backends)
+            source = io.BytesIO(data) # decode from the bytes we already read
+            cache_hits = len(filters) - len(missing)
+            filters = missing
+
+        # Open the original image ONCE (and not at all if everything was cached)
+        outputs = {}
+        if filters:
+            with stage("decode", trace, filename):
+                original_img = open_image(source, max_side)
+
+            # Run the filter graph (shared nodes like the luminance plane are built once)
+            outputs = run_filter_graph(original_img, filters, filename if trace else None, backends, quality)
+
         # Helper function to save to specific subfolder
         def save_to_subfolder(img_obj, subfolder_name):
-            # Create the subfolder (e.g., output/blur)
-            target_dir = os.path.join(output_folder, subfolder_name)
-            os.makedirs(target_dir, exist_ok=True) 
-            
             # Save the image inside
-            save_path = os.path.join(target_dir, filename)
-            img_obj.save(save_path)
+            save_path = os.path.join(folders[subfolder_name], filename)
+            save_func = None
+            if cache:
+                # Encode once into the cache, then copy to the output folder
+                key = keys[subfolder_name]
+                save_func = lambda img, path: cache.store(key, ext, img, path)
+            else:
+                # Appended to output/<filter>/part-*.tar, or copied into the array store
+                save_func = output_save_func(shard_output, array_store)
+            if trace:
+                save_func = traced_save_func(save_func, filename) # separate encode / write timings
+            if async_write:
+                with stage("submit", trace, filename): # blocks while the writer queue is full
+                    get_writer().submit(img_obj, save_path, save_func) # encoded and written in the background
+            elif save_func:
+                save_func(img_obj, save_path)
+            else:
+                img_obj.save(save_path)
 
-        # FILTER 1: Grayscale 
-        img_gray = original_img.copy().convert("L")
-        save_to_subfolder(img_gray, "grayscale")
-        
-        # FILTER 2: Blur 
-        img_blur = original_img.copy()
-        img_blur = img_blur.filter(ImageFilter.GaussianBlur(radius=3))
-        save_to_subfolder(img_blur, "blur")
-        
-        # FILTER 3: Edge Detection
-        img_edge = original_img.copy().convert("L")
-        img_edge = img_edge.filter(ImageFilter.FIND_EDGES)
-        save_to_subfolder(img_edge, "edge")
-        
-        # FILTER 4: Sharpening
-        img_sharp = original_img.copy()
-        enhancer = ImageEnhance.Sharpness(img_sharp)
-        img_sharp = enhancer.enhance(3.0) 
-        save_to_subfolder(img_sharp, "sharpen")
-        
-        # FILTER 5: Brightness
-        img_bright = original_img.copy()
-        enhancer = ImageEnhance.Brightness(img_bright)
-        img_bright = enhancer.enhance(1.5) 
-        save_to_subfolder(img_bright, "brightness")
+        for subfolder_name, img_obj in outputs.items():
+            save_to_subfolder(img_obj, subfolder_name)
 
         # Return Success and the Worker PID
-        return {
+        result = {
             "status": "Success", 
             "filename": filename, 
             "pid": os.getpid() # Track which worker did this job
         }
+        if cache:
+            result["cache_hits"] = cache_hits
+            result["cache_misses"] = len(outputs)
+        if trace:
+            result["stages"] = drain()
+        return result
 
     except Exception as e:
         # Return Error AND the Worker PID
@@ -73,4 +272,4 @@ def process_image(file_path, output_folder):
             "filename": filename, 
             "error": str(e),
             "pid": os.getpid() # Track errors by worker too
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,120 @@
+import os
+import threading
+
+# PEAK MEMORY (RSS) REPORTING
+# To size worker counts against a container memory limit we need to know how
+# much memory a run really uses. Read from /proc (Linux only):
+#   - every worker reports its own peak RSS (VmHWM) with each chunk of results
+#   - the parent's own peak RSS (VmHWM)
+#   - a sampler thread in the parent adds up the current RSS of the parent and
+#     all its descendant processes every SAMPLE_INTERVAL seconds, giving the
+#     peak total the whole run needed at once (forkserver workers are children
+#     of the fork server, not of the parent, so the whole tree is walked)
+# On systems without /proc everything reports as unavailable.
+
+SAMPLE_INTERVAL = 0.1 # seconds
+
+
+def read_status_kb(pid="self", field="VmRSS"):
+    """A memory field of /proc/<pid>/status in kB (VmRSS = now, VmHWM = peak), or None."""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def child_pids(pid):
+    """Direct children of pid (from the task 'children' files, else by scanning /proc)."""
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children", 'r') as f:
+                children.extend(int(child) for child in f.read().split())
+        return children
+    except OSError:
+        pass
+    # Kernel without /proc/<pid>/task/<tid>/children: find processes whose parent is pid
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def descendant_pids(pid):
+    """Children, grandchildren, ... of pid (every process of the tree below it)."""
+    found = []
+    seen = {pid}
+    pending = [pid]
+    while pending:
+        for child in child_pids(pending.pop()):
+            if child not in seen: # a reused pid must not loop
+                seen.add(child)
+                found.append(child)
+                pending.append(child)
+    return found
+
+
+class MemoryReport:
+    """Peak RSS of the parent, of each worker, and of the whole process tree during one run."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.available = read_status_kb() is not None
+        self.worker_peaks = {} # pid -> peak RSS kB reported by the worker
+        self.total_peak = 0
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        if self.available:
+            self.thread = threading.Thread(target=self._sample, daemon=True)
+            self.thread.start()
+
+    def _sample(self):
+        pid = os.getpid()
+        while True:
+            total = read_status_kb() or 0
+            for child in descendant_pids(pid):
+                total += read_status_kb(child) or 0
+            self.total_peak = max(self.total_peak, total)
+            self.samples += 1
+            if self.stop_event.wait(self.interval):
+                return
+
+    def add(self, result):
+        pid = result.get("pid")
+        peak = result.get("peak_rss_kb")
+        if pid and peak:
+            self.worker_peaks[pid] = max(self.worker_peaks.get(pid, 0), peak)
+
+    def finish(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def print_report(self, indent="      "):
+        if not self.available:
+            print(f"{indent}[Memory] Peak RSS unavailable (no /proc on this system)")
+            return
+        parent_peak = read_status_kb(field="VmHWM") or 0
+        print(f"{indent}[Memory] Peak RSS: parent {parent_peak / 1024:.1f} MB | "
+              f"whole run (sampled) {self.total_peak / 1024:.1f} MB")
+        for pid, peak in sorted(self.worker_peaks.items()):
+            # The parent's own threads report the parent's peak (thread backends)
+            if pid != os.getpid():
+                print(f"{indent}         - Worker PID {pid}: {peak / 1024:.1f} MB")
@@ -1,70 +1,189 @@
 import os
 import time
-import multiprocessing
-from filters import process_image 
+from worker_pool import worker_pool, in_flight_limit
+from writer import shared_error_count
+from filters import prepare_output_folders, output_save_func
+from result_cache import print_cache_report, format_hit_rate
+from dispatch import make_work, known_total, ChunkSizer, stream_pool_results
+from stage_trace import StageRecorder, trace_base_path
+from scheduling import apply_schedule, item_costs, ScheduleReport
+from memory_stats import MemoryReport
+from cpu_affinity import CoreUtilization
+from shards import begin_shard_run, write_shard_index
+from dedup import link_duplicates
+import functools
+from run_options import (add_processing_arguments, add_dispatch_arguments,
+                         task_options_from_args, print_run_options, input_folder_from_args, image_source_from_args,
+                         trace_dir_from_args, add_tiling_arguments, tile_options_from_args,
+                         add_worker_arguments, worker_counts_from_args,
+                         add_startup_arguments, startup_options_from_args,
+                         add_dedup_arguments, dedup_from_args, baseline_options, baseline_mismatches,
+                         DEFAULT_BATCH_SIZE)
 import csv
+import argparse
 
 # Serial Benchmark Values Loader
-def load_serial_baseline():
-    """Load the serial baseline from CSV file."""
+def load_serial_baseline(options):
+    """Load the serial baseline from CSV file (it must be measured with the same result-changing options)."""
     try:
         script_dir = os.path.dirname(os.path.abspath(__file__))
         project_root = os.path.dirname(script_dir)
         baseline_path = os.path.join(project_root, "serial_baseline_value.csv")
 
         with open(baseline_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['metric'] == 'serial_baseline':
-                    return float(row['value'])
+            rows = {row['metric']: row['value'] for row in csv.DictReader(f)}
 
     except FileNotFoundError:
         print("❌ Error: serial_baseline_value.csv not found!")
         print("Please run serial_baseline.py first!")
         exit(1)
 
-    print("❌ Error: serial baseline not found in CSV!")
-    exit(1)
+    if 'serial_baseline' not in rows:
+        print("❌ Error: serial baseline not found in CSV!")
+        exit(1)
+
+    # A baseline of other work (another engine, --max-side, --cache, ...) would give a meaningless speedup
+    mismatches = baseline_mismatches(rows, options)
+    if mismatches:
+        print("❌ Error: the serial baseline was measured with other options!")
+        for name, saved, value in mismatches:
+            print(f"   {name}: {saved} (baseline) vs {value} (this run)")
+        print("Please run serial_baseline.py with the same options first!")
+        exit(1)
+    return float(rows['serial_baseline'])
 
 
 # MULTIPROCESSING TEST FUNCTION 
-def run_test_with_processes(num_processes, image_paths, output_folder):
+def run_test_with_processes(num_processes, image_paths, output_folder, task_options=None,
+                            engine="pillow", batch_size=DEFAULT_BATCH_SIZE,
+                            chunksize=None, max_in_flight=None, frames=None, transport="shared",
+                            trace_dir=None, costs=None, tile_options=None, startup=None, dedup=None):
     # LOAD BALANCING: multiprocessing.Pool automatically distributes the 
-    # tasks in the 'tasks' list across the available processes.
+    # chunks of tasks across the available processes.
     print(f"    Testing with {num_processes} process(es)...", end=" ", flush=True)
     
     start_time = time.time()
     
-    # Prepare arguments for process_image(file_path, output_folder)
-    tasks = [(img_path, output_folder) for img_path in image_paths]
+    # Worker function is process_image(file_path, output_folder, **task_options)
+    # The numpy engine gets one task per batch of images instead
+    task_options = task_options or {}
+    task_options = begin_shard_run(output_folder, task_options) # fresh output shards per trial (--shard-output)
+    if task_options.get("array_store"):
+        from array_store import begin_array_store # numpy is only loaded for the array store
+        task_options, image_paths = begin_array_store(output_folder, task_options, image_paths) # preallocated
+    job = None
+    splitter = None
+    if frames is not None:
+        # In-memory mode: frames were decoded by the parent, outputs stay in memory
+        from shared_transport import InMemoryJob
+        job = InMemoryJob(frames, transport, task_options.get("filters"), engine)
+        worker_func, items = job.worker_func, job.items
+    else:
+        if tile_options:
+            from tiling import LargeImageSplitter, process_tiled # numpy is only loaded for --tile
+            # Images above the threshold are held back and tiled across the pool at the end
+            splitter = LargeImageSplitter(image_paths, tile_options["threshold_mp"])
+            image_paths = splitter.normal_images()
+        worker_func, items = make_work(engine, image_paths, output_folder, task_options, batch_size)
+    # Size-aware scheduling: chunks are limited by estimated cost (--schedule lpt)
+    sizer = ChunkSizer(num_processes, total=known_total(items), chunksize=chunksize,
+                       costs=item_costs(items, costs) if costs and job is None else None)
+    schedule_report = ScheduleReport(num_processes) # makespan vs ideal, idle per worker
+    memory_report = MemoryReport() # peak RSS of the parent, each worker and the whole run
+    core_report = CoreUtilization() # how busy every core was during the run
     
     success_count = 0
+    cache_hits = 0
+    cache_misses = 0
     fail_count = 0
     process_stats = {} # Dictionary to count tasks per worker (PID -> Count)
+    recorder = StageRecorder() if trace_dir else None # per-stage timings (--trace)
 
     # USES multiprocessing.Pool (The Classic Parallel Paradigm)
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        # starmap applies the function to the list of tuples (tasks)
-        results = pool.starmap(process_image, tasks)
+    # (started with --start-method, and reused across trials with --persistent-pool)
+    # Failed background writes are only known when the workers exit (--async-write)
+    write_errors = shared_error_count() if task_options.get("async_write") else None
+    with worker_pool("pool", num_processes, write_errors=write_errors, **(startup or {})) as (pool, limit):
+        # imap_unordered streams results back as each chunk finishes,
+        # with a bounded number of chunks in flight
+        results = stream_pool_results(pool, worker_func, items, sizer, in_flight_limit(max_in_flight, limit))
         
-        # ANALYZE RESULTS 
+        # ANALYZE RESULTS (as they arrive)
         for result in results:
+            if job is not None:
+                job.collect(result)
+            if recorder:
+                recorder.add(result)
+            schedule_report.add(result)
+            memory_report.add(result)
             if result.get("status") == "Success":
                 success_count += 1
             else:
                 fail_count += 1
             
+            # Result cache outputs reused vs computed
+            cache_hits += result.get("cache_hits", 0)
+            cache_misses += result.get("cache_misses", 0)
+
             # Track Worker PIDs to demonstrate parallel execution
             pid = result.get("pid")
             if pid:
                 # If PID exists in dict, add 1. If not, set to 1.
                 process_stats[pid] = process_stats.get(pid, 0) + 1
 
+        # Tiled mode: every large image is spread over the whole pool, one image at a time
+        tiled_count = 0
+        for large_path in (splitter.large if splitter else []):
+            result = process_tiled(large_path, output_folder, functools.partial(stream_pool_results, pool, max_in_flight=limit),
+                                   num_processes, task_options.get("filters"), engine, tile_options["tile_size"],
+                                   output_save_func(task_options.get("shard_output"), task_options.get("array_store")))
+            if result["status"] == "Success":
+                success_count += 1
+                tiled_count += result["tiles"]
+            else:
+                fail_count += 1
+                print(f"\n❌ Error: {result['filename']}: {result['error']}")
+
+        # worker_pool lets the workers exit normally (close + join) so background writers flush
+
+    if write_errors is not None and write_errors.value:
+        fail_count += write_errors.value
+        print(f"\n❌ {write_errors.value} output file(s) could not be written")
+    if task_options.get("shard_output"):
+        shard_outputs, shard_files = write_shard_index(output_folder) # per-filter index.json
+    if dedup and job is None:
+        linked = link_duplicates(output_folder, dedup, task_options) # copies get the outputs of the first
     end_time = time.time()
+    memory_report.finish()
+    core_report.finish()
+    if recorder:
+        recorder.finish()
     duration = end_time - start_time
     
     print(f"Done! ({duration:.4f}s)")
     print(f"      [Stats] Success: {success_count} | Failed: {fail_count}")
+    print(f"      [Dispatch] {sizer.describe()}")
+    if splitter is not None and splitter.large:
+        print(f"      [Tiling] {len(splitter.large)} large image(s) in {tiled_count} tiles")
+    if task_options.get("shard_output"):
+        print(f"      [Shards] {shard_outputs} outputs in {shard_files} shard file(s)")
+    if task_options.get("array_store"):
+        from array_store import describe_store
+        print(f"      [Array store] {describe_store(task_options['array_store'][0])}")
+    if dedup and job is None:
+        print(f"      [Dedup] {dedup.saved} task(s) saved, {linked} outputs linked")
+    schedule_report.print_report(duration)
+    memory_report.print_report()
+    core_report.print_report()
+    if job is not None:
+        print(f"      [Transport] {transport}: {job.bytes_through_pipe / 1024 / 1024:.1f} MB of pixels through the pipe")
+        job.close()
+    if task_options.get("cache_dir"):
+        print(f"      [Cache] {format_hit_rate(cache_hits, cache_misses)}")
+    if recorder:
+        recorder.print_report()
+        trace_path, csv_path = recorder.export(trace_base_path(trace_dir, f"multiprocessing_{num_processes}"))
+        print(f"      [Trace] {trace_path} | {csv_path}")
     
     # PRINT WORKER BREAKDOWN (Restored!) 
     # This proves how the work was distributed (Load Balancing)
@@ -75,7 +194,20 @@ def run_test_with_processes(num_processes, image_paths, output_folder):
     
     return duration
 
+# Command line options (defaults reproduce the original benchmark)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multiprocessing image processing benchmark")
+    add_processing_arguments(parser)
+    add_dispatch_arguments(parser)
+    add_tiling_arguments(parser)
+    add_worker_arguments(parser)
+    add_startup_arguments(parser)
+    add_dedup_arguments(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+
     print(f"\n{'='*60}")
     print(f"Automated Performance Test: Multiprocessing")
     print(f"{'='*60}")
@@ -83,41 +215,68 @@ def main():
     # Path setup - Exactly tallied to Alin's paths
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_script_dir)
-    INPUT_FOLDER = os.path.join(project_root, "input_images")
+    INPUT_FOLDER = input_folder_from_args(args, project_root) # input_images, or --input-shards
     OUTPUT_FOLDER = os.path.join(project_root, "output_multiprocessing")
     SERIAL_OUTPUT = os.path.join(project_root, "output_serial_bench")
+
+    task_options = task_options_from_args(args, project_root)
+    print_run_options(args, task_options)
     
     if not os.path.exists(INPUT_FOLDER):
         print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
         return
 
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    prepare_output_folders(OUTPUT_FOLDER, task_options["filters"]) # create output/<filter> once, before the workers start
     os.makedirs(SERIAL_OUTPUT, exist_ok=True)
 
-    # Load images using os.walk
-    image_paths = []
-    for root, dirs, files in os.walk(INPUT_FOLDER):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                image_paths.append(os.path.join(root, file))
+    # Images are discovered lazily: the pools start on the first paths while
+    # the rest of the tree is still being walked
+    image_paths = image_source_from_args(args, INPUT_FOLDER, project_root)
 
-    if not image_paths:
+    if image_paths.is_empty():
         print(f"No images found. Please add images to 'input_images' folder.")
         return
 
-    print(f"Found {len(image_paths)} images.\n")
+    print(f"Streaming images from {INPUT_FOLDER}\n")
+
+    tile_options = tile_options_from_args(args)
+    if tile_options:
+        from shared_transport import share_tracker_with_workers
+        share_tracker_with_workers() # tiles live in shared memory the workers attach to
+
+    # Duplicate inputs are dropped before dispatch (--dedup); their outputs are linked after every run
+    image_paths, dedup = dedup_from_args(args, image_paths)
+
+    # Size-aware scheduling reads every header up front (fifo keeps the lazy stream)
+    image_paths, costs = apply_schedule(args.schedule, image_paths, args.max_side)
+
+    # In-memory mode: decode once up front (the "upstream stage"), outside the timed runs
+    frames = None
+    if args.in_memory:
+        decode_start = time.time()
+        from shared_transport import decode_frames # numpy is only loaded for --in-memory
+        frames = decode_frames(image_paths, args.max_side)
+        print(f"Decoded {len(frames)} frames for in-memory mode in {time.time() - decode_start:.4f}s "
+              f"({args.in_memory} transport)\n")
 
     # STEP 1: GET THE SERIAL BASELINE 
-    serial_time = load_serial_baseline()
+    serial_time = load_serial_baseline(baseline_options(args, task_options))
     print(f"Using serial baseline: {serial_time:.4f}s")
 
     # STEP 2: RUN PARALLEL TESTS 
     print("Starting Parallel Tests...")
-    process_counts = [2, 4, 8]
+    process_counts = worker_counts_from_args(args, project_root, "multiprocessing") # 2, 4, 8 by default
+    startup = startup_options_from_args(args, task_options, process_counts)
     results = {} 
 
     for count in process_counts:
-        time_taken = run_test_with_processes(count, image_paths, OUTPUT_FOLDER)
+        time_taken = run_test_with_processes(count, image_paths, OUTPUT_FOLDER, task_options,
+                                             args.engine, args.batch_size,
+                                             args.chunksize, args.max_in_flight,
+                                             frames, args.in_memory,
+                                             trace_dir_from_args(args, project_root), costs,
+                                             tile_options, startup, dedup)
         results[count] = time_taken
 
     print(f"{'-'*60}")
@@ -129,7 +288,11 @@ def main():
         speedup = serial_time / time_taken 
         print(f"{count:<10} | {time_taken:<15.4f} | {speedup:<15.2f}") 
     
+    if costs is None and dedup is None: # (both read the whole list up front)
+        print(f"Discovery: {image_paths.describe()}")
     print(f"{'='*60}")
+    if task_options["cache_dir"]:
+        print_cache_report(task_options["cache_dir"], max_mb=args.cache_max_mb, max_age_days=args.cache_max_age_days)
     print("Test Complete.")
 
 if __name__ == '__main__':
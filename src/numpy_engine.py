@@ -0,0 +1,339 @@
+import os
+import itertools
+import numpy as np
+from PIL import Image
+from filters import (process_image, resolve_filters, prepare_output_folders, fetch_cached_outputs, open_image,
+                     output_save_func,
+                     BLUR_RADIUS, SHARPNESS_FACTOR, BRIGHTNESS_FACTOR)
+from run_options import DEFAULT_BATCH_SIZE # default number of images decoded into one batch
+from writer import get_writer
+from result_cache import get_cache
+from stage_trace import stage, drain, traced_save_func
+
+# VECTORIZED NUMPY BATCH ENGINE
+# Instead of calling Pillow once per image and per filter, a batch of images
+# is decoded into one (N, H, W, C) uint8 array per image size and every
+# filter runs once over the whole stack. Images are only split back into
+# individual files at encode time.
+
+# 3x3 kernels used by Pillow (ImageFilter.FIND_EDGES and ImageFilter.SMOOTH)
+EDGE_KERNEL = np.array([[-1, -1, -1],
+                        [-1,  8, -1],
+                        [-1, -1, -1]], dtype=np.int32)
+SMOOTH_KERNEL = np.array([[1, 1, 1],
+                          [1, 5, 1],
+                          [1, 1, 1]], dtype=np.int32)
+SMOOTH_SCALE = 13
+
+
+def decode_batch(file_paths, max_side=None):
+    """
+    Decodes images (optionally at reduced resolution) and groups them by size.
+    Returns a dictionary of (height, width) -> (list of paths, (N, H, W, 3) uint8 array).
+    """
+    groups = {}
+    for file_path in file_paths:
+        pixels = np.asarray(open_image(file_path, max_side))
+        groups.setdefault(pixels.shape[:2], []).append((file_path, pixels))
+
+    return {
+        size: ([path for path, _ in items], np.stack([pixels for _, pixels in items]))
+        for size, items in groups.items()
+    }
+
+
+# BATCHED FILTERS
+# Every function takes and returns a stack of images with the batch on axis 0.
+
+def batch_grayscale(rgb):
+    """ITU-R 601-2 luma, using the same fixed-point rounding as Pillow's convert("L")."""
+    rgb = rgb.astype(np.uint32)
+    lum = rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000
+    return (lum >> 16).astype(np.uint8)
+
+
+def batch_brightness(rgb, factor=BRIGHTNESS_FACTOR):
+    """Same as ImageEnhance.Brightness: blend with black, truncate and clip."""
+    out = rgb.astype(np.float32) * np.float32(factor)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def _convolve3x3(stack, kernel):
+    """
+    Applies a 3x3 kernel to every image in the stack (axes 1 and 2).
+    Returns int32 sums for the interior pixels only, like Pillow's filter3x3.
+    """
+    stack = stack.astype(np.int32)
+    height, width = stack.shape[1], stack.shape[2]
+    total = np.zeros((stack.shape[0], height - 2, width - 2) + stack.shape[3:], dtype=np.int32)
+    for dy in range(3):
+        for dx in range(3):
+            weight = kernel[dy, dx]
+            if weight:
+                total += weight * stack[:, dy:dy + height - 2, dx:dx + width - 2]
+    return total
+
+
+def _with_border(stack, interior):
+    """Pillow leaves the 1 pixel border of a 3x3 filter untouched."""
+    out = stack.copy()
+    out[:, 1:-1, 1:-1] = interior
+    return out
+
+
+def batch_edges(lum):
+    """ImageFilter.FIND_EDGES on a stack of luminance planes."""
+    if lum.shape[1] < 3 or lum.shape[2] < 3:
+        return lum.copy()
+    interior = np.clip(_convolve3x3(lum, EDGE_KERNEL), 0, 255).astype(np.uint8)
+    return _with_border(lum, interior)
+
+
+def batch_smooth(rgb):
+    """ImageFilter.SMOOTH (the degenerate image used by ImageEnhance.Sharpness)."""
+    if rgb.shape[1] < 3 or rgb.shape[2] < 3:
+        return rgb.copy()
+    total = _convolve3x3(rgb, SMOOTH_KERNEL)
+    interior = np.clip((total + SMOOTH_SCALE // 2) // SMOOTH_SCALE, 0, 255).astype(np.uint8)
+    return _with_border(rgb, interior)
+
+
+def batch_sharpen(rgb, factor=SHARPNESS_FACTOR):
+    """Same as ImageEnhance.Sharpness: blend the smoothed image with the original."""
+    degenerate = batch_smooth(rgb).astype(np.float32)
+    out = degenerate + np.float32(factor) * (rgb.astype(np.float32) - degenerate)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def box_blur_radius(radius=BLUR_RADIUS, passes=3):
+    """
+    Pillow approximates a Gaussian with 3 box blurs of a fractional ("extended") radius.
+    This is the same radius formula as Pillow's BoxBlur.c.
+    """
+    sigma2 = np.float32(radius) * np.float32(radius) / passes
+    L = np.sqrt(np.float32(12.0) * sigma2 + 1)
+    l = np.floor((L - 1) / 2)
+    a = (2 * l + 1) * (l * (l + 1) - 3 * sigma2)
+    a /= 6 * (sigma2 - (l + 1) * (l + 1))
+    return np.float32(l + a)
+
+
+def _box_blur_axis(stack, box_radius, axis):
+    """
+    One extended box blur pass along one axis, using running sums (cumsum).
+    Pixels outside the image are clamped to the edge, like Pillow.
+    """
+    r = int(box_radius)
+    ww = int((1 << 24) / (np.float32(box_radius) * 2 + 1)) # weight of the whole pixels
+    fw = ((1 << 24) - (r * 2 + 1) * ww) // 2 # weight of the two partial pixels
+    size = stack.shape[axis]
+
+    pad = [(0, 0)] * stack.ndim
+    pad[axis] = (r + 1, r + 1)
+    padded = np.pad(stack.astype(np.int64), pad, mode="edge")
+    cumulative = np.cumsum(padded, axis=axis)
+    zero = np.zeros_like(padded.take([0], axis=axis))
+    cumulative = np.concatenate([zero, cumulative], axis=axis)
+
+    def span(start):
+        return np.arange(start, start + size)
+
+    window = cumulative.take(span(2 * r + 2), axis=axis) - cumulative.take(span(1), axis=axis)
+    edges = padded.take(span(0), axis=axis) + padded.take(span(2 * r + 2), axis=axis)
+    return ((window * ww + edges * fw + (1 << 23)) >> 24).astype(np.uint8)
+
+
+def batch_blur(rgb, radius=BLUR_RADIUS, passes=3):
+    """
+    ImageFilter.GaussianBlur: separable, 3 box passes along rows then 3 along columns.
+    Each pass costs the same no matter how large the radius is.
+    """
+    box_radius = box_blur_radius(radius, passes)
+    out = rgb
+    for axis in (2, 1):
+        for _ in range(passes):
+            out = _box_blur_axis(out, box_radius, axis)
+    return out
+
+
+def run_batch_filters(rgb, filters=None, trace_label=None):
+    """
+    Runs the selected filters over an (N, H, W, 3) stack.
+    Returns a dictionary of filter name -> stacked output.
+    With trace_label set, every filter is timed as its own stage.
+    """
+    filters = resolve_filters(filters)
+    trace = trace_label is not None
+    outputs = {}
+    lum = None
+    if "grayscale" in filters or "edge" in filters:
+        with stage("luminance", trace, trace_label):
+            lum = batch_grayscale(rgb) # shared luminance plane, computed once per batch
+
+    for name in filters:
+        with stage(name, trace, trace_label):
+            if name == "grayscale":
+                outputs[name] = lum
+            elif name == "blur":
+                outputs[name] = batch_blur(rgb)
+            elif name == "edge":
+                outputs[name] = batch_edges(lum)
+            elif name == "sharpen":
+                outputs[name] = batch_sharpen(rgb)
+            elif name == "brightness":
+                outputs[name] = batch_brightness(rgb)
+    return outputs
+
+
+def output_filename(file_path):
+    """Same naming as process_image: <category>_<name>.jpg"""
+    category_name = os.path.basename(os.path.dirname(file_path))
+    return f"{category_name}_{os.path.basename(file_path)}"
+
+
+def process_batch(file_paths, output_folder, filters=None, async_write=False, cache_dir=None,
+                  max_side=None, trace=False, backends=None, shard_output=None, array_store=None,
+                  quality="exact"):
+    """
+    Batch version of process_image.
+    Returns one status dictionary per image (same format as process_image).
+    With trace=True, decode and filter stages are timed per batch, encode/write per image.
+    backends only applies to the per-image fallback (the batch kernels are the numpy backend).
+    The batch kernels are exact; quality is passed on to the per-image fallback.
+    """
+    filters = resolve_filters(filters)
+    results = []
+    pid = os.getpid()
+    folders = prepare_output_folders(output_folder, filters)
+
+    # RESULT CACHE: images with every output cached are copied and never decoded.
+    # Partially cached images are recomputed in full (the batch runs all filters anyway).
+    cache = get_cache(cache_dir) if cache_dir else None
+    keys = {}
+    if cache:
+        remaining = []
+        for file_path in file_paths:
+            filename = output_filename(file_path)
+            try:
+                with stage("cache", trace, filename):
+                    _, keys[file_path], missing = fetch_cached_outputs(cache, file_path, filename, folders,
+                                                                       filters, max_side)
+            except Exception as e:
+                results.append({"status": "Error", "filename": filename, "error": str(e), "pid": pid})
+                continue
+            if missing:
+                remaining.append(file_path)
+            else:
+                results.append({"status": "Success", "filename": filename, "pid": pid,
+                                "cache_hits": len(filters), "cache_misses": 0})
+        file_paths = remaining
+
+    batch_label = f"batch of {len(file_paths)}"
+    try:
+        with stage("decode", trace, batch_label):
+            groups = decode_batch(file_paths, max_side)
+    except Exception:
+        # One bad file should not fail the whole batch: fall back to per-image processing
+        return results + [process_image(file_path, output_folder, filters, async_write, cache_dir, max_side, trace,
+                                        backends, shard_output, array_store, quality)
+                          for file_path in file_paths]
+
+    for size, (paths, rgb) in groups.items():
+        try:
+            outputs = run_batch_filters(rgb, filters, f"batch of {len(paths)}" if trace else None)
+        except Exception as e:
+            for file_path in paths:
+                results.append({"status": "Error", "filename": output_filename(file_path),
+                                "error": str(e), "pid": pid})
+            continue
+
+        # Split back into individual images only at encode time
+        for i, file_path in enumerate(paths):
+            filename = output_filename(file_path)
+            try:
+                ext = os.path.splitext(filename)[1]
+                for name, stack in outputs.items():
+                    save_path = os.path.join(folders[name], filename)
+                    save_func = None
+                    if cache:
+                        key = keys[file_path][name]
+                        save_func = lambda img, path, key=key, ext=ext: cache.store(key, ext, img, path)
+                    else:
+                        save_func = output_save_func(shard_output, array_store) # shards / array store
+                    if trace:
+                        save_func = traced_save_func(save_func, filename) # separate encode / write timings
+                    if async_write:
+                        with stage("submit", trace, filename):
+                            get_writer().submit(Image.fromarray(stack[i]), save_path, save_func)
+                    elif save_func:
+                        save_func(Image.fromarray(stack[i]), save_path)
+                    else:
+                        Image.fromarray(stack[i]).save(save_path)
+                result = {"status": "Success", "filename": filename, "pid": pid}
+                if cache:
+                    result["cache_hits"] = 0
+                    result["cache_misses"] = len(outputs)
+                results.append(result)
+            except Exception as e:
+                results.append({"status": "Error", "filename": filename, "error": str(e), "pid": pid})
+
+    if trace and results:
+        results[-1]["stages"] = drain() # every span of the batch rides back with one result
+    return results
+
+
+def make_batches(image_paths, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Splits the image list into batches. Paths are sorted by folder so sizes tend to repeat.
+    A lazy stream of paths (discovery.ImageSource) gives a lazy stream of batches.
+    """
+    if isinstance(image_paths, list):
+        return [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    return _iter_batches(image_paths, batch_size)
+
+
+def _iter_batches(image_paths, batch_size):
+    iterator = iter(image_paths)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def compare_with_pillow(file_path, filters=None):
+    """
+    Tolerance check: runs both engines on one image (in memory).
+    Returns a dictionary of filter name -> maximum absolute pixel difference.
+    """
+    from filters import run_filter_graph
+    rgb_img = Image.open(file_path).convert("RGB")
+    reference = run_filter_graph(rgb_img, filters)
+    batched = run_batch_filters(np.asarray(rgb_img)[np.newaxis], filters)
+    return {
+        name: int(np.abs(np.asarray(reference[name], dtype=np.int16) - batched[name][0].astype(np.int16)).max())
+        for name in reference
+    }
+
+
+# Maximum pixel difference accepted per filter (0 = bit compatible)
+TOLERANCE = {"grayscale": 0, "edge": 0, "brightness": 0, "sharpen": 1, "blur": 1}
+
+
+if __name__ == "__main__":
+    # Run the tolerance check against the Pillow engine on a sample of the dataset
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    input_folder = os.path.join(project_root, "input_images")
+    sample = []
+    for root, dirs, files in os.walk(input_folder):
+        sample += [os.path.join(root, f) for f in files if f.lower().endswith(('.png', '.jpg', '.jpeg'))][:2]
+
+    worst = {}
+    for file_path in sample:
+        for name, diff in compare_with_pillow(file_path).items():
+            worst[name] = max(worst.get(name, 0), diff)
+
+    print(f"Checked {len(sample)} images against Pillow")
+    for name, diff in worst.items():
+        status = "OK" if diff <= TOLERANCE[name] else "FAIL"
+        print(f"   {name:<12} max diff {diff:<4} (tolerance {TOLERANCE[name]}) {status}")
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import argparse
+import statistics
+import tempfile
+import numpy as np
+from PIL import Image
+from filters import process_image, prepare_output_folders, resolve_filters
+from stage_trace import StageRecorder
+from benchmark import run_backend, environment_info, BACKENDS
+
+# PERFORMANCE REGRESSION SUITE (no dataset needed)
+# Every other script needs the Kaggle images in input_images/. This one
+# generates its own deterministic workload and checks it against a stored
+# baseline, so a slower filters.py or runner is caught on any Linux box, offline:
+#   1. synthetic images: seeded gradients, texture, shapes and noise (so JPEG
+#      and PNG compress like photos, not like flat colour) for every size and
+#      aspect ratio in SIZES, alternating JPEG and PNG, in a temp folder
+#   2. stage timings: process_image runs over every image with tracing on;
+#      the mean time per image of every stage (decode, filters, encode, write)
+#   3. throughput: every backend (serial + the pools at --workers) through
+#      benchmark.run_backend, median images/s over --repeats runs
+#   4. comparison with results/perf_baseline.json: a regression is throughput
+#      below baseline x (1 - --tolerance), and any regression exits with
+#      status 1. Single stages are too noisy to gate on (a few ms per image,
+#      shared CPUs), so a stage slower than baseline x (1 + --stage-tolerance)
+#      is only reported as a warning, to show where a regression comes from.
+# The baseline belongs to one machine: record it with --update-baseline on the
+# box the suite runs on (the first run records it automatically).
+
+# (width, height) of the synthetic images: landscape, portrait, square, HD, a strip and a thumbnail
+SIZES = [(640, 480), (480, 640), (512, 512), (1024, 768), (1920, 1080), (1200, 300), (96, 64)]
+FORMATS = ("jpg", "png")
+SEED = 435
+BASELINE_NAME = os.path.join("results", "perf_baseline.json")
+BASELINE_VERSION = 1
+
+DEFAULT_TOLERANCE = 0.15       # throughput may drop by up to 15%
+DEFAULT_STAGE_TOLERANCE = 0.30 # single stages are noisier (warnings only)
+MIN_STAGE_MS = 1.0             # stages faster than this are reported, not checked (timer noise)
+
+
+def synthetic_image(width, height, rng):
+    """RGB uint8 array: a colour gradient with sinusoidal texture, a few flat shapes and sensor-like noise."""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    fx, fy = rng.uniform(0.01, 0.08, size=2)
+    channels = []
+    for c in range(3):
+        gradient = 255 * (x / max(width - 1, 1) * rng.uniform(0.2, 0.8) + y / max(height - 1, 1) * rng.uniform(0.2, 0.8)) / 1.6
+        texture = 40 * np.sin(x * fx * (c + 1) + rng.uniform(0, 6.3)) * np.cos(y * fy + rng.uniform(0, 6.3))
+        channels.append(gradient + texture)
+    pixels = np.stack(channels, axis=-1)
+    for _ in range(6):
+        left, top = rng.integers(0, width), rng.integers(0, height)
+        right, bottom = left + rng.integers(width // 10 + 1, width // 3 + 2), top + rng.integers(height // 10 + 1, height // 3 + 2)
+        pixels[top:bottom, left:right] = rng.uniform(0, 255, size=3)
+    pixels += rng.normal(0, 6, size=pixels.shape)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def generate_images(folder, per_size, seed=SEED):
+    """Writes per_size images for every size in SIZES to folder/<w>x<h>/. Returns their paths (always the same)."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for width, height in SIZES:
+        category = os.path.join(folder, f"{width}x{height}")
+        os.makedirs(category, exist_ok=True)
+        for i in range(per_size):
+            ext = FORMATS[i % len(FORMATS)]
+            path = os.path.join(category, f"synthetic_{i:03d}.{ext}")
+            img = Image.fromarray(synthetic_image(width, height, rng))
+            if ext == "jpg":
+                img.save(path, quality=90)
+            else:
+                img.save(path)
+            paths.append(path)
+    return paths
+
+
+def measure_stages(image_paths, output_folder, filters, repeats):
+    """Stage -> mean ms per image (the fastest of the repeats), from process_image with tracing on."""
+    best = {}
+    for _ in range(repeats):
+        recorder = StageRecorder()
+        for img_path in image_paths:
+            result = process_image(img_path, output_folder, filters, trace=True)
+            if result["status"] != "Success":
+                print(f"❌ Error: {result['filename']}: {result['error']}")
+            recorder.add(result)
+        recorder.finish()
+        for name, (count, total, *_rest) in recorder.stage_summary().items():
+            ms = total / len(image_paths) * 1000
+            best[name] = min(best.get(name, ms), ms)
+    return best
+
+
+def measure_throughput(backend, workers, image_paths, output_folder, filters, repeats):
+    """Median images/s over repeats (after one warmup)."""
+    task_options = {"filters": filters}
+    prepare_output_folders(output_folder, filters)
+    run_backend(backend, workers, image_paths, output_folder, task_options, "pillow", None)
+    rates = []
+    for _ in range(repeats):
+        seconds, success, failed = run_backend(backend, workers, image_paths, output_folder, task_options,
+                                               "pillow", None)
+        if failed:
+            print(f"❌ {failed} image(s) failed in the {backend} run")
+        rates.append(len(image_paths) / seconds)
+    return statistics.median(rates)
+
+
+def compare(current, baseline, tolerance, stage_tolerance):
+    """
+    Returns a list of (kind, name, baseline value, current value, change, beyond tolerance).
+    Only throughput rows fail the run; slow stage rows are warnings.
+    """
+    rows = []
+    for name, rate in current["throughput"].items():
+        if name in baseline["throughput"]:
+            base = baseline["throughput"][name]
+            change = rate / base - 1
+            rows.append(("throughput", name, base, rate, change, change < -tolerance))
+    for name, ms in current["stages_ms"].items():
+        if name in baseline["stages_ms"]:
+            base = baseline["stages_ms"][name]
+            change = ms / base - 1 if base else 0.0
+            checked = base >= MIN_STAGE_MS
+            rows.append(("stage", name, base, ms, change, checked and change > stage_tolerance))
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Synthetic-workload performance regression check (no dataset needed)")
+    parser.add_argument("--per-size", type=int, default=4, help="Synthetic images per size (half JPEG, half PNG)")
+    parser.add_argument("--workers", type=int, default=4, help="Workers for the parallel backends")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help=f"Comma separated backends to run ({', '.join(BACKENDS)})")
+    parser.add_argument("--filters", default=None, help="Comma separated filters to run (default: all 5)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per measurement")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative throughput drop before failing")
+    parser.add_argument("--stage-tolerance", type=float, default=DEFAULT_STAGE_TOLERANCE,
+                        help="Relative slowdown of a single stage before it is flagged (warning only)")
+    parser.add_argument("--baseline", default=None,
+                        help=f"Baseline file (default: <project>/{BASELINE_NAME})")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Save this run as the new baseline instead of comparing")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    baseline_path = args.baseline or os.path.join(project_root, BASELINE_NAME)
+    filters = resolve_filters(args.filters)
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    for backend in backends:
+        if backend not in BACKENDS:
+            print(f"❌ Error: unknown backend {backend} (choose from {', '.join(BACKENDS)})")
+            exit(1)
+
+    # Settings that change the workload: a baseline only compares with the same ones
+    config = {"sizes": SIZES, "per_size": args.per_size, "seed": SEED, "workers": args.workers,
+              "filters": list(filters)}
+    config = json.loads(json.dumps(config)) # tuples -> lists, as they come back from the file
+
+    print(f"\n{'='*60}")
+    print(f"Performance Regression Suite: {len(SIZES) * args.per_size} synthetic images | "
+          f"{', '.join(backends)} | {args.workers} workers")
+    print(f"{'='*60}")
+
+    with tempfile.TemporaryDirectory(prefix="cst435_perf_") as work_folder:
+        start = time.perf_counter()
+        image_paths = generate_images(os.path.join(work_folder, "input"), args.per_size)
+        print(f"Generated {len(image_paths)} images ({len(SIZES)} sizes, JPEG + PNG) "
+              f"in {time.perf_counter() - start:.2f}s")
+
+        print("Timing stages (process_image with tracing)...", flush=True)
+        stages_ms = measure_stages(image_paths, os.path.join(work_folder, "stages"), filters, args.repeats)
+
+        throughput = {}
+        for backend in backends:
+            workers = 1 if backend == "serial" else args.workers
+            name = f"{backend} x{workers}"
+            print(f"Timing {name}...", flush=True)
+            throughput[name] = measure_throughput(backend, workers, image_paths,
+                                                  os.path.join(work_folder, backend), filters, args.repeats)
+
+    current = {"version": BASELINE_VERSION, "config": config,
+               "environment": environment_info(project_root),
+               "throughput": throughput, "stages_ms": stages_ms}
+
+    baseline = None
+    if not args.update_baseline:
+        try:
+            with open(baseline_path, 'r') as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"No baseline at {baseline_path} yet: this run becomes the baseline")
+
+    if baseline is None:
+        os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"{'-'*60}")
+        for name, rate in throughput.items():
+            print(f"{name:<22} | {rate:8.1f} images/s")
+        print(f"✅ Baseline saved to: {baseline_path}")
+        return
+
+    if baseline.get("config") != config:
+        print(f"❌ Error: {baseline_path} was recorded with other settings: {baseline.get('config')}")
+        print("Run with the same options, or record a new baseline with --update-baseline")
+        exit(1)
+    base_env, env = baseline.get("environment", {}), current["environment"]
+    for key in ("hostname", "cpu_count", "python", "pillow"):
+        if base_env.get(key) != env.get(key):
+            print(f"Note: baseline {key} was {base_env.get(key)}, now {env.get(key)} (results may not be comparable)")
+
+    rows = compare(current, baseline, args.tolerance, args.stage_tolerance)
+    print(f"{'-'*60}")
+    print(f"{'Metric':<28} | {'Baseline':>9} | {'Now':>9} | {'Change':>7} | Status")
+    print(f"{'-'*60}")
+    for kind, name, base, value, change, regressed in rows:
+        unit = "img/s" if kind == "throughput" else "ms"
+        label = f"{name} ({unit})" if kind == "throughput" else f"stage {name} ({unit})"
+        if regressed and kind == "throughput":
+            status = "❌ REGRESSION"
+        elif regressed:
+            status = "⚠️ slower"
+        elif kind == "stage" and base < MIN_STAGE_MS:
+            status = "(not checked)"
+        else:
+            status = "OK"
+        print(f"{label:<28} | {base:>9.2f} | {value:>9.2f} | {change * 100:>+6.1f}% | {status}")
+    print(f"{'='*60}")
+
+    slow_stages = [row for row in rows if row[-1] and row[0] == "stage"]
+    if slow_stages:
+        print(f"Warning: {len(slow_stages)} stage(s) more than {args.stage_tolerance * 100:.0f}% slower "
+              f"(not a failure on its own: single stages are noisy)")
+    regressions = [row for row in rows if row[-1] and row[0] == "throughput"]
+    if regressions:
+        print(f"❌ {len(regressions)} throughput regression(s) beyond -{args.tolerance * 100:.0f}%")
+        exit(1)
+    print("✅ No performance regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import statistics
+import tempfile
+from filters import open_image, run_filter_graph, resolve_filters, prepare_output_folders
+from fast_filters import compare_with_exact, QUALITY_FLOOR
+from benchmark import run_backend
+
+# QUALITY BENCHMARK (--quality fast vs exact)
+# 1. Quality: both modes run on a sample of the dataset in memory; every
+#    output is scored against the exact Pillow output (PSNR and SSIM), and the
+#    mean is checked against fast_filters.QUALITY_FLOOR
+# 2. Filter throughput: the filter graph alone on already decoded images
+# 3. End-to-end throughput: decode + filter + encode + write with the serial
+#    runner and a process pool (benchmark.run_backend)
+
+
+def filter_seconds(images, filters, quality, repeats):
+    """Best-of-N seconds to run the filter graph over every decoded image."""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for img in images:
+            run_filter_graph(img, filters, quality=quality)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def end_to_end_seconds(backend, workers, image_paths, output_folder, task_options, repeats):
+    """Median seconds of full runs (after one warmup)."""
+    shutil.rmtree(output_folder, ignore_errors=True)
+    prepare_output_folders(output_folder, task_options["filters"])
+    run_backend(backend, workers, image_paths, output_folder, task_options, "pillow", None)
+    times = []
+    for _ in range(repeats):
+        seconds, success, failed = run_backend(backend, workers, image_paths, output_folder, task_options,
+                                               "pillow", None)
+        if failed:
+            print(f"❌ {failed} image(s) failed in the {backend} run")
+        times.append(seconds)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast approximate filters vs exact Pillow: quality and throughput")
+    parser.add_argument("--sample", type=int, default=50,
+                        help="Number of images to score and time")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Timed runs per mode (best of N in memory, median end to end)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Processes for the end-to-end pool run (0 = serial only)")
+    parser.add_argument("--filters", default=None,
+                        help="Comma separated filters to compare (default: all 5)")
+    parser.add_argument("--max-side", type=int, default=None)
+    args = parser.parse_args()
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = os.path.join(project_root, "input_images")
+
+    image_paths = []
+    for root, dirs, files in os.walk(INPUT_FOLDER):
+        for file in files:
+            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                image_paths.append(os.path.join(root, file))
+    image_paths = sorted(image_paths)[:args.sample]
+
+    if not image_paths:
+        print(f"No images found in {INPUT_FOLDER}.")
+        return
+
+    filters = resolve_filters(args.filters)
+    print(f"\n{'='*60}")
+    print(f"Quality Benchmark: fast vs exact filters ({len(image_paths)} images)")
+    print(f"{'='*60}")
+
+    # 1. QUALITY
+    scores = {name: [] for name in filters}
+    for img_path in image_paths:
+        for name, score in compare_with_exact(img_path, filters, args.max_side).items():
+            scores[name].append(score)
+
+    print(f"{'Filter':<12} | {'PSNR mean (dB)':<14} | {'PSNR min':<8} | {'SSIM mean':<9} | {'SSIM min':<8} | Status")
+    print(f"{'-'*60}")
+    all_ok = True
+    for name in filters:
+        psnrs = [psnr for psnr, _ in scores[name]]
+        ssims = [ssim for _, ssim in scores[name]]
+        if name in QUALITY_FLOOR:
+            floor_psnr, floor_ssim = QUALITY_FLOOR[name]
+            ok = statistics.mean(psnrs) >= floor_psnr and statistics.mean(ssims) >= floor_ssim
+            status = "OK" if ok else f"FAIL (floor {floor_psnr:g} dB / {floor_ssim:g})"
+            all_ok = all_ok and ok
+        else:
+            status = "exact" if min(psnrs) == float("inf") else "DIFFERS"
+        print(f"{name:<12} | {statistics.mean(psnrs):<14.2f} | {min(psnrs):<8.2f} | "
+              f"{statistics.mean(ssims):<9.4f} | {min(ssims):<8.4f} | {status}")
+
+    # 2. FILTER THROUGHPUT (decoded images in memory)
+    images = [open_image(img_path, args.max_side) for img_path in image_paths]
+    exact_time = filter_seconds(images, filters, "exact", args.repeats)
+    fast_time = filter_seconds(images, filters, "fast", args.repeats)
+    print(f"{'-'*60}")
+    print(f"{'Stage':<20} | {'Mode':<6} | {'ms / image':<10} | {'Images/s':<8} | {'Speedup':<7}")
+    print(f"{'-'*60}")
+    count = len(images)
+    for mode, seconds in (("exact", exact_time), ("fast", fast_time)):
+        print(f"{'Filters (memory)':<20} | {mode:<6} | {seconds / count * 1000:<10.3f} | "
+              f"{count / seconds:<8.1f} | {exact_time / seconds:<7.2f}")
+
+    # 3. END-TO-END THROUGHPUT (decode, filter, encode, write)
+    runs = [("serial", 1)] + ([("multiprocessing", args.workers)] if args.workers else [])
+    with tempfile.TemporaryDirectory(prefix="cst435_quality_") as output_root:
+        for backend, workers in runs:
+            times = {}
+            for mode in ("exact", "fast"):
+                task_options = {"filters": filters, "max_side": args.max_side, "quality": mode}
+                times[mode] = end_to_end_seconds(backend, workers, image_paths,
+                                                 os.path.join(output_root, f"{backend}_{mode}"),
+                                                 task_options, args.repeats)
+            for mode, seconds in times.items():
+                label = f"{backend} x{workers}"
+                print(f"{label:<20} | {mode:<6} | {seconds / count * 1000:<10.3f} | "
+                      f"{count / seconds:<8.1f} | {times['exact'] / seconds:<7.2f}")
+    print(f"{'='*60}")
+    if not all_ok:
+        print("❌ Quality below the floor (see fast_filters.QUALITY_FLOOR)")
+        sys.exit(1)
+    print("Quality within the floor for every approximated filter")
+
+
+if __name__ == "__main__":
+    main()
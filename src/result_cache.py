@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+# CONTENT-ADDRESSED RESULT CACHE
+# Every filtered output is stored under a key built from:
+#   SHA-256 of the input file bytes + filter name + filter parameters
+#   (including --max-side, --quality and a non-Pillow filter backend)
+# so an unchanged input is never decoded or filtered again, no matter where
+# it lives or what it is called. Layout on disk:
+#   <cache_dir>/objects/<2 hex chars>/<key><ext>   cached outputs
+#   <cache_dir>/manifest.json                       size / last use of every object
+# Objects are written to a temporary file and renamed into place, so a crash
+# never leaves a half-written entry behind; after a crash the next run simply
+# re-uses everything that was finished (resume-after-crash).
+
+CACHE_VERSION = 1 # bump to invalidate every entry (e.g. when a filter changes)
+MANIFEST_NAME = "manifest.json"
+TMP_SUFFIX = ".tmp"
+
+
+def hash_bytes(data):
+    """Content hash of an input file."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(content_hash, filter_name, params):
+    """Key for one filter output of one input."""
+    params_text = json.dumps(params, sort_keys=True)
+    text = f"v{CACHE_VERSION}|{content_hash}|{filter_name}|{params_text}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of filtered images. Safe to share between worker processes."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def object_path(self, key, ext):
+        return os.path.join(self.objects_dir, key[:2], key + ext)
+
+    def fetch(self, key, ext, dest_path):
+        """Copies a cached output to dest_path. Returns True on a hit."""
+        src = self.object_path(key, ext)
+        try:
+            shutil.copyfile(src, dest_path)
+        except FileNotFoundError:
+            return False
+        # Record the use for LRU eviction (the manifest is rebuilt from mtimes)
+        try:
+            os.utime(src)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key, ext, img_obj, dest_path):
+        """
+        Saves img_obj into the cache (atomically) and copies it to dest_path.
+        The image is only encoded once.
+        """
+        path = self.object_path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per writer: threads of one process (threads / hybrid runners) can store the same key at once
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        # Pillow picks the encoder from the extension, so pass the format explicitly for the .tmp name
+        img_obj.save(tmp_path, format=_format_for(ext))
+        os.replace(tmp_path, path)
+        shutil.copyfile(path, dest_path)
+
+    # MANIFEST AND EVICTION (run by the parent process, not the workers)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"version": CACHE_VERSION, "entries": {}}
+
+    def sync_manifest(self):
+        """
+        Rebuilds the manifest from the objects on disk and removes temporary
+        files left behind by a crashed run. Returns the manifest.
+        """
+        entries = {}
+        for sub in os.scandir(self.objects_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(TMP_SUFFIX):
+                    os.remove(entry.path) # leftover from an interrupted write
+                    continue
+                stat = entry.stat()
+                entries[entry.name] = {"size": stat.st_size, "last_used": stat.st_mtime}
+
+        manifest = {"version": CACHE_VERSION, "updated": time.time(), "entries": entries}
+        tmp_path = self.manifest_path + TMP_SUFFIX
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        return manifest
+
+    def evict(self, max_bytes=None, max_age_days=None):
+        """
+        Removes entries older than max_age_days, then the least recently used
+        entries until the cache is at most max_bytes. Returns (removed, bytes freed).
+        """
+        entries = self.sync_manifest()["entries"]
+        now = time.time()
+        removed = 0
+        freed = 0
+
+        # Oldest first, so the size limit removes least recently used entries
+        ordered = sorted(entries.items(), key=lambda item: item[1]["last_used"])
+        total = sum(info["size"] for _, info in ordered)
+        for name, info in ordered:
+            too_old = max_age_days is not None and now - info["last_used"] > max_age_days * 86400
+            too_big = max_bytes is not None and total > max_bytes
+            if not (too_old or too_big):
+                continue
+            try:
+                os.remove(os.path.join(self.objects_dir, name[:2], name))
+            except FileNotFoundError:
+                pass
+            total -= info["size"]
+            freed += info["size"]
+            removed += 1
+
+        if removed:
+            self.sync_manifest()
+        return removed, freed
+
+    def summary(self):
+        """Returns (number of entries, total bytes) according to the manifest."""
+        entries = self.load_manifest()["entries"]
+        return len(entries), sum(info["size"] for info in entries.values())
+
+
+def _format_for(ext):
+    ext = ext.lower()
+    if ext in (".jpg", ".jpeg"):
+        return "JPEG"
+    if ext == ".png":
+        return "PNG"
+    return None
+
+
+# One cache object per process and directory
+_caches = {}
+
+
+def get_cache(cache_dir):
+    if cache_dir not in _caches:
+        _caches[cache_dir] = ResultCache(cache_dir)
+    return _caches[cache_dir]
+
+
+def format_hit_rate(hits, misses):
+    total = hits + misses
+    hit_rate = (hits / total * 100) if total else 0.0
+    return f"Hits: {hits} | Misses: {misses} | Hit rate: {hit_rate:.1f}%"
+
+
+def print_cache_report(cache_dir, hits=None, misses=None, max_mb=None, max_age_days=None):
+    """Run summary: hit/miss counts (if given), eviction and cache size."""
+    cache = get_cache(cache_dir)
+    max_bytes = max_mb * 1024 * 1024 if max_mb is not None else None
+    removed, freed = cache.evict(max_bytes, max_age_days)
+    entries, size = cache.summary()
+    if hits is not None:
+        print(f"[Cache] {format_hit_rate(hits, misses)}")
+    if removed:
+        print(f"[Cache] Evicted {removed} entries ({freed / 1024 / 1024:.1f} MB)")
+    print(f"[Cache] {entries} entries, {size / 1024 / 1024:.1f} MB in {cache_dir}")
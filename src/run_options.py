@@ -0,0 +1,343 @@
+import os
+import json
+from filters import resolve_filters
+from discovery import ImageSource
+from shards import ShardSource
+from worker_pool import START_METHODS, persistent_allowed
+
+# COMMAND LINE OPTIONS SHARED BY THE ENTRY POINTS
+# serial_baseline.py, multiprocessing_image.py and concurrent_futures.py all
+# accept the same processing options; the defaults reproduce the original benchmark.
+# Nothing here imports numpy: it is only loaded by the options that use it
+# (--engine numpy, --in-memory, --tile, --array-store, ...).
+
+# Images decoded into one batch by the numpy engine
+DEFAULT_BATCH_SIZE = 32
+# --tile defaults (see tiling)
+DEFAULT_TILE_SIZE = 1024
+DEFAULT_THRESHOLD_MP = 16 # images above this many megapixels are tiled
+
+
+def add_processing_arguments(parser, backends_flag="--backends"):
+    """
+    Options that change what process_image does. benchmark.py already uses
+    --backends for its runners, so it names the filter backends flag differently.
+    """
+    parser.add_argument("--filters", default=None,
+                        help="Comma separated filters to run (default: all 5)")
+    parser.add_argument("--engine", choices=["pillow", "numpy"], default="pillow",
+                        help="pillow = one image per task, numpy = vectorized batches")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Images per batch for the numpy engine")
+    parser.add_argument("--async-write", action="store_true",
+                        help="Encode and write outputs on background writer threads")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse outputs of unchanged inputs from the result cache")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Result cache folder (default: <project>/result_cache)")
+    parser.add_argument("--cache-max-mb", type=float, default=None,
+                        help="Evict least recently used cache entries above this size")
+    parser.add_argument("--cache-max-age-days", type=float, default=None,
+                        help="Evict cache entries not used for this many days")
+    parser.add_argument("--max-side", type=int, default=None,
+                        help="Decode at reduced resolution: outputs are at most this many pixels per side")
+    parser.add_argument("--scan-threads", type=int, default=0,
+                        help="List this many input folders at once while discovering images")
+    parser.add_argument("--file-index", nargs="?", const="", default=None,
+                        help="Reuse folder listings whose mtime is unchanged "
+                             "(default path: <project>/image_index.json)")
+    parser.add_argument("--input-shards", nargs="?", const="", default=None,
+                        help="Read images from .tar/.zip shards (a shard or a folder of them) instead of "
+                             "input_images (default: <project>/input_shards, see shards.py pack)")
+    parser.add_argument("--shard-output", action="store_true",
+                        help="Append outputs to one tar shard per filter and worker, with an index.json "
+                             "per filter, instead of writing one file per output")
+    parser.add_argument("--array-store", action="store_true",
+                        help="Copy raw pixels into preallocated memory-mapped .npy arrays per filter "
+                             "(output/array_store, with an index) instead of encoding JPEGs")
+    parser.add_argument("--quality", choices=["exact", "fast"], default="exact",
+                        help="fast = approximate blur (box passes at half resolution) and sharpen "
+                             "(unsharp mask on the blurred plane) for previews, see quality_benchmark.py")
+    parser.add_argument(backends_flag, dest="filter_backends", default=None,
+                        help="Filter implementations for the pillow engine: auto (fastest per filter, "
+                             "benchmarked once per machine), numpy, or e.g. blur=numpy,edge=opencv")
+    parser.add_argument("--trace", nargs="?", const="", default=None,
+                        help="Time every stage (decode, filters, encode, write) and export a "
+                             "Chrome/Perfetto trace + CSV per run (default folder: <project>/results/traces)")
+
+
+def add_dispatch_arguments(parser, in_memory=True):
+    """Options for how tasks are handed to a worker pool."""
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Tasks per chunk sent to a worker (default: auto-tuned)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Maximum chunks queued or running at once (default: 2 x workers)")
+    parser.add_argument("--schedule", choices=["fifo", "lpt"], default="fifo",
+                        help="fifo = discovery order, lpt = largest images first (sizes read from headers)")
+    if in_memory:
+        parser.add_argument("--in-memory", choices=["shared", "pickle"], default=None,
+                            help="Decode everything up front and filter in memory, moving pixels "
+                                 "through shared memory or pickled arrays (no files are written)")
+
+
+def add_startup_arguments(parser):
+    """How worker processes are started (see worker_pool)."""
+    parser.add_argument("--start-method", choices=START_METHODS, default="default",
+                        help="Worker start method; forkserver preloads filters and PIL once for every worker")
+    parser.add_argument("--persistent-pool", action="store_true",
+                        help="Start the pool once and reuse it for every worker-count trial "
+                             "(not with --async-write, whose writers flush when a worker exits)")
+    parser.add_argument("--pin", action="store_true",
+                        help="Bind every worker to its own core (set) with sched_setaffinity (Linux)")
+    parser.add_argument("--worker-threads", type=int, default=None,
+                        help="Cap the internal threads of NumPy/BLAS/OpenMP/OpenCV in every worker")
+
+
+def persistent_from_args(args, task_options):
+    """--persistent-pool, unless background writers need the workers to exit."""
+    if args.persistent_pool and not persistent_allowed(task_options):
+        print("Persistent pool: off (--async-write flushes when the workers exit)")
+        return False
+    return args.persistent_pool
+
+
+def startup_options_from_args(args, task_options, worker_counts):
+    """Keyword arguments for worker_pool (a persistent pool is sized for the largest trial)."""
+    if args.pin or args.worker_threads:
+        from cpu_affinity import describe_cpus, can_pin
+        print(f"CPUs: {describe_cpus()}")
+        if args.pin and not can_pin():
+            print("Pinning: off (os.sched_setaffinity is not available on this system)")
+        elif args.pin:
+            print("Pinning: every worker bound to its own core set")
+        if args.worker_threads:
+            from cpu_affinity import thread_cap_mechanism
+            mechanism = thread_cap_mechanism(args.start_method)
+            if mechanism:
+                print(f"Library threads: {args.worker_threads} per worker via {mechanism}")
+            else:
+                print("❌ Library threads: no effect (numpy was loaded before the cap and threadpoolctl "
+                      "is not installed: pip install threadpoolctl)")
+    return {"start_method": args.start_method, "persistent": persistent_from_args(args, task_options),
+            "reserve": max(worker_counts), "pin": args.pin, "worker_threads": args.worker_threads}
+
+
+def add_dedup_arguments(parser):
+    """Duplicate input detection between discovery and dispatch (see dedup)."""
+    from dedup import DEFAULT_PERCEPTUAL_THRESHOLD
+    parser.add_argument("--dedup", action="store_true",
+                        help="Process byte-identical inputs once and hard-link the outputs of the copies")
+    parser.add_argument("--dedup-perceptual", type=int, nargs="?", const=DEFAULT_PERCEPTUAL_THRESHOLD, default=None,
+                        help="Also treat images whose perceptual hashes differ in at most this many of "
+                             f"64 bits as duplicates (default {DEFAULT_PERCEPTUAL_THRESHOLD}; implies --dedup)")
+
+
+def dedup_from_args(args, image_paths):
+    """
+    (images to process, DedupResult or None). Reads the whole image list,
+    so it runs once before the timed runs.
+    """
+    if not args.dedup and args.dedup_perceptual is None:
+        return image_paths, None
+    from dedup import find_duplicates
+    dedup = find_duplicates(image_paths, args.dedup_perceptual)
+    print(f"Dedup: {dedup.describe()}")
+    print(f"Dedup: {dedup.saved} task(s) saved per run\n")
+    return dedup.unique, dedup
+
+
+def add_worker_arguments(parser):
+    """Worker counts the pool scripts test."""
+    parser.add_argument("--workers", default="2,4,8",
+                        help="Comma separated worker counts, 'auto' for one per usable CPU (within the "
+                             "cgroup CPU quota), or 'tuned' for the best configuration found by autotune.py")
+
+
+def tuned_config_path(project_root):
+    return os.path.join(project_root, "results", "autotune_best.json")
+
+
+def worker_counts_from_args(args, project_root, backend):
+    """
+    Worker counts to test. With --workers tuned, the single count autotune.py
+    recommended for this backend (its chunk size too, unless --chunksize is given).
+    With --workers auto, one worker per CPU the container may actually use.
+    """
+    if args.workers == "auto":
+        from cpu_affinity import effective_cpu_count, describe_cpus
+        print(f"Worker count: {describe_cpus()}")
+        return [effective_cpu_count()]
+    if args.workers != "tuned":
+        return [int(count) for count in args.workers.split(",")]
+    try:
+        with open(tuned_config_path(project_root), 'r') as f:
+            tuned = json.load(f)[backend]
+    except (FileNotFoundError, KeyError):
+        print(f"❌ Error: no tuned configuration for {backend}!")
+        print(f"Please run: python3 src/autotune.py --backend {backend}")
+        exit(1)
+    if args.chunksize is None:
+        args.chunksize = tuned["chunksize"]
+    print(f"Tuned configuration: {tuned['workers']} workers, chunksize {tuned['chunksize'] or 'auto'} "
+          f"(autotune.py, {tuned['tuned_at']})")
+    return [tuned["workers"]]
+
+
+def add_tiling_arguments(parser):
+    """Options for splitting very large images into tiles across the pool."""
+    parser.add_argument("--tile", action="store_true",
+                        help="Split very large images into tiles (with halos) filtered across the whole pool")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE,
+                        help="Tile width and height in pixels")
+    parser.add_argument("--tile-threshold-mp", type=float, default=DEFAULT_THRESHOLD_MP,
+                        help="Images above this many megapixels are tiled")
+
+
+def tile_options_from_args(args):
+    """None when tiling is off (reduced-resolution decodes are never large enough to tile)."""
+    if not args.tile or args.max_side or args.quality == "fast":
+        return None
+    return {"tile_size": args.tile_size, "threshold_mp": args.tile_threshold_mp}
+
+
+def task_options_from_args(args, project_root):
+    """Keyword arguments for process_image / process_batch."""
+    # Thread caps first: only numpy / BLAS loaded after this read them, in this process and in forked workers
+    if getattr(args, "worker_threads", None):
+        from cpu_affinity import set_thread_env
+        set_thread_env(args.worker_threads)
+
+    # Result cache location (None = caching disabled)
+    cache_dir = None
+    if args.cache or args.cache_dir:
+        cache_dir = args.cache_dir or os.path.join(project_root, "result_cache")
+    if cache_dir and (args.shard_output or args.array_store):
+        print("Result cache: off (cached outputs are copied as files, not into shards or arrays)")
+        cache_dir = None
+    if args.shard_output and args.array_store:
+        print("Shard output: off (--array-store replaces the encoded outputs)")
+        args.shard_output = False
+
+    if args.quality == "fast" and args.engine == "numpy":
+        print("Quality: exact (the numpy batch kernels have no fast mode)")
+        args.quality = "exact"
+    if args.quality == "fast" and args.filter_backends:
+        print("Filter backends: off (--quality fast has its own blur and sharpen)")
+        args.filter_backends = None
+
+    # Filter backends (None = Pillow for every filter)
+    backends = None
+    if args.filter_backends:
+        # Imported only when asked for: it probes for OpenCV and SciPy
+        from filter_backends import parse_backends, auto_backends
+    if args.filter_backends == "auto":
+        backends = auto_backends(os.path.join(project_root, "filter_backends.json"))
+    elif args.filter_backends:
+        backends = parse_backends(args.filter_backends)
+
+    return {
+        "filters": resolve_filters(args.filters),
+        "async_write": args.async_write,
+        "cache_dir": cache_dir,
+        "max_side": args.max_side,
+        "trace": args.trace is not None,
+        "backends": backends,
+        "quality": args.quality,
+        "shard_output": args.shard_output, # replaced by a run id in shards.begin_shard_run
+        "array_store": args.array_store,   # replaced by (folder, run id) in array_store.begin_array_store
+    }
+
+
+# A serial baseline is only a fair T1 for runs that do the same work. These
+# options change the outputs or skip work, so serial_baseline.py saves them
+# next to the time and the runners refuse a baseline measured with other ones.
+# (Workers, dispatch, tiling, async writes etc. only change how the work runs.)
+BASELINE_DEFAULTS = {"engine": "pillow", "filters": "all", "max_side": "full", "quality": "exact",
+                     "backends": "pillow", "cache": "off", "dedup": "off", "output": "files", "input": "files"}
+
+
+def baseline_options(args, task_options):
+    """Result-changing option -> value (as text) for this run, in serial_baseline_value.csv form."""
+    dedup = "off"
+    if getattr(args, "dedup_perceptual", None) is not None:
+        dedup = f"perceptual {args.dedup_perceptual}"
+    elif getattr(args, "dedup", False):
+        dedup = "exact"
+    output = "files"
+    if task_options["array_store"]:
+        output = "arrays"
+    elif task_options["shard_output"]:
+        output = "shards"
+    backends = task_options["backends"]
+    filters = ",".join(task_options["filters"])
+    return {
+        "engine": args.engine,
+        "filters": "all" if filters == ",".join(resolve_filters(None)) else filters,
+        "max_side": str(task_options["max_side"] or "full"),
+        "quality": task_options["quality"],
+        "backends": ",".join(f"{name}={backend}" for name, backend in sorted(backends.items())) if backends else "pillow",
+        "cache": "on" if task_options["cache_dir"] else "off",
+        "dedup": dedup,
+        "output": output,
+        "input": "shards" if getattr(args, "input_shards", None) is not None else "files",
+    }
+
+
+def baseline_mismatches(rows, options):
+    """
+    (option, baseline value, this run) for every option the baseline CSV rows
+    (metric -> value) disagree on. Options missing from older baselines count as the defaults.
+    """
+    return [(name, rows.get(name, BASELINE_DEFAULTS[name]), value)
+            for name, value in options.items() if rows.get(name, BASELINE_DEFAULTS[name]) != value]
+
+
+def trace_dir_from_args(args, project_root):
+    """Folder for stage traces, or None when tracing is disabled."""
+    if args.trace is None:
+        return None
+    return args.trace or os.path.join(project_root, "results", "traces")
+
+
+def input_folder_from_args(args, project_root):
+    """input_images, or the shard (folder) given with --input-shards."""
+    if getattr(args, "input_shards", None) is None:
+        return os.path.join(project_root, "input_images")
+    return args.input_shards or os.path.join(project_root, "input_shards")
+
+
+def image_source_from_args(args, input_folder, project_root):
+    """Lazy, re-iterable stream of the input image paths (shard members with --input-shards)."""
+    if getattr(args, "input_shards", None) is not None:
+        return ShardSource(input_folder)
+    index_path = None
+    if args.file_index is not None:
+        index_path = args.file_index or os.path.join(project_root, "image_index.json")
+    return ImageSource(input_folder, args.scan_threads, index_path)
+
+
+def print_run_options(args, task_options):
+    print(f"Filters: {', '.join(task_options['filters'])}")
+    print(f"Engine: {args.engine}{' + async writer' if args.async_write else ''}")
+    if args.max_side:
+        print(f"Reduced-resolution decode: max side {args.max_side}px")
+    if task_options["quality"] == "fast":
+        print("Quality: fast (approximate blur and sharpen)")
+    if task_options["backends"]:
+        from filter_backends import describe_backends
+        print(f"Filter backends: {describe_backends(task_options['backends'])}")
+    if getattr(args, "input_shards", None) is not None:
+        print(f"Input: shards in {args.input_shards or 'input_shards'}")
+    if args.shard_output:
+        print("Output: per-filter shards + index.json")
+    if args.array_store:
+        print("Output: memory-mapped array store (no encoding)")
+    if args.trace is not None:
+        print("Stage tracing: on")
+    if getattr(args, "tile", False):
+        if args.max_side:
+            print("Tiling: off (--max-side already bounds the image size)")
+        elif args.quality == "fast":
+            print("Tiling: off (tile halos are sized for the exact kernels)")
+        else:
+            print(f"Tiling: images above {args.tile_threshold_mp:g} MP in {args.tile_size}px tiles")
@@ -0,0 +1,111 @@
+import time
+import concurrent.futures
+from PIL import Image
+from shards import open_input
+
+# SIZE-AWARE SCHEDULING (--schedule lpt)
+# Handing out images in os.walk order means a few very large images that
+# arrive late keep one worker busy while the others sit idle at the end.
+# Instead:
+#   - image dimensions are read from the file headers only (Image.open does
+#     not decode the pixels), several files at a time on threads
+#   - each task's cost is estimated from its pixel count
+#   - tasks are dispatched longest-first (LPT)
+#   - ChunkSizer limits every chunk to a share of the remaining estimated
+#     work, so the tail is handed out in single small tasks that idle workers
+#     pull from the shared queue (self-scheduling instead of a fixed split)
+# ScheduleReport measures the result: makespan vs ideal and idle per worker.
+
+HEADER_THREADS = 8
+# Fixed per-image cost (open, file writes, ...) expressed in pixels
+PER_IMAGE_COST = 20000
+
+
+def read_dimensions(file_path):
+    """(width, height) from the image header, or None if it cannot be read."""
+    try:
+        with Image.open(open_input(file_path)) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def estimate_cost(size, max_side=None):
+    """Estimated work for one image: pixels actually filtered plus a fixed overhead."""
+    width, height = size
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        width, height = width * scale, height * scale
+    return width * height + PER_IMAGE_COST
+
+
+def lpt_order(image_paths, max_side=None, threads=HEADER_THREADS):
+    """
+    Returns (paths sorted longest-first, path -> estimated cost).
+    Unreadable headers get the median cost (the task will report its own error).
+    """
+    image_paths = list(image_paths)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        sizes = list(executor.map(read_dimensions, image_paths))
+
+    known = sorted(estimate_cost(size, max_side) for size in sizes if size)
+    fallback = known[len(known) // 2] if known else PER_IMAGE_COST
+    costs = {path: estimate_cost(size, max_side) if size else fallback
+             for path, size in zip(image_paths, sizes)}
+    # sorted() is stable: equal sizes keep their folder order (helps numpy batches)
+    return sorted(image_paths, key=lambda path: -costs[path]), costs
+
+
+def apply_schedule(schedule, image_paths, max_side=None):
+    """
+    fifo: paths as discovered (costs None). lpt: longest-first order and cost estimates.
+    Returns (paths, path -> cost or None).
+    """
+    if schedule != "lpt":
+        return image_paths, None
+    start = time.perf_counter()
+    ordered, costs = lpt_order(image_paths, max_side)
+    print(f"Size-aware schedule: read {len(ordered)} image headers in {time.perf_counter() - start:.4f}s "
+          f"(largest first)\n")
+    return ordered, costs
+
+
+def item_costs(items, costs):
+    """Estimated cost of each dispatch item (an image path or a numpy batch of paths)."""
+    return [sum(costs[path] for path in item) if isinstance(item, list) else costs[item]
+            for item in items]
+
+
+class ScheduleReport:
+    """
+    Parent side: per-worker busy time from the task_seconds stamped by
+    dispatch.run_chunk. Idle = makespan - busy, including pool startup.
+    """
+
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self.start = time.perf_counter()
+        self.busy = {}     # worker -> seconds spent in tasks
+        self.last_done = {} # worker -> when its last result arrived (s since start)
+
+    def add(self, result, worker=None):
+        worker = worker if worker is not None else result.get("pid")
+        if worker is None:
+            return
+        self.busy[worker] = self.busy.get(worker, 0.0) + result.get("task_seconds", 0.0)
+        self.last_done[worker] = time.perf_counter() - self.start
+
+    def print_report(self, makespan, indent="      "):
+        total_busy = sum(self.busy.values())
+        # Perfect balance: all work spread evenly over every worker
+        ideal = total_busy / self.num_workers if self.num_workers else 0.0
+        balance = ideal / makespan * 100 if makespan else 0.0
+        print(f"{indent}[Schedule] Makespan {makespan:.4f}s vs ideal {ideal:.4f}s "
+              f"({balance:.0f}% of the run spent on work)")
+        # Workers that never got a task are idle for the whole run
+        for _ in range(self.num_workers - len(self.busy)):
+            print(f"{indent}         - (no tasks): idle {makespan:.4f}s")
+        for worker, busy in sorted(self.busy.items(), key=lambda item: str(item[0])):
+            tail = makespan - self.last_done[worker]
+            print(f"{indent}         - Worker {worker}: busy {busy:.4f}s | idle {max(makespan - busy, 0.0):.4f}s "
+                  f"| finished {tail:.4f}s before the end")
@@ -1,9 +1,18 @@
 import os  # Handle file paths
 import time  # Measure execution time for benchmarking
 import threading  # For TID retrieval
-import pandas as pd  # CSV report
 import csv  # For saving baseline value
-from filters import process_image  # For image processing
+import argparse  # Command line options
+from filters import prepare_output_folders  # For image processing
+from dispatch import make_work  # process_image (or process_batch) with this run's options
+from run_options import (add_processing_arguments, task_options_from_args, print_run_options,
+                         input_folder_from_args, image_source_from_args, trace_dir_from_args,
+                         add_dedup_arguments, dedup_from_args, baseline_options)  # Shared options
+from stage_trace import StageRecorder, trace_base_path  # Per-stage timings (--trace)
+from writer import close_writer  # Background encode/write stage
+from shards import begin_shard_run, write_shard_index, close_shard_writers  # Sharded archive output
+from dedup import link_duplicates  # Duplicate input detection (--dedup)
+from result_cache import print_cache_report  # Content-addressed result cache
 
 # This section used for current Process ID and Thread ID retrieval
 # Ensure that the process is executing in serial sequence
@@ -14,8 +23,18 @@ def get_thread_info():
     return f"PID: {pid} | TID: {tid}"
 
 
+# Command line options (defaults reproduce the original benchmark)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serial baseline image processing benchmark")
+    add_processing_arguments(parser)
+    add_dedup_arguments(parser)
+    return parser.parse_args()
+
+
 # The header of the output 
 def main():
+    args = parse_args()
+
     print(f"\n{'='*60}")
     print(f"Serial Baseline (No Parallelism)")
     print(f"{'='*60}")
@@ -24,9 +43,15 @@ def main():
     # This is to determine the project path, ensure script run correctly
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_script_dir)
-    INPUT_FOLDER = os.path.join(project_root, "input_images")
+    INPUT_FOLDER = input_folder_from_args(args, project_root) # input_images, or --input-shards
     OUTPUT_FOLDER = os.path.join(project_root, "output_serial")
 
+    task_options = task_options_from_args(args, project_root)
+    cache_dir = task_options["cache_dir"]
+    print_run_options(args, task_options)
+    # Saved with the baseline: the parallel runners only compare against the same options
+    options = baseline_options(args, task_options)
+
     # For input dataset validation
     if not os.path.exists(INPUT_FOLDER):
         print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
@@ -34,61 +59,108 @@ def main():
 
     # For output file validation
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    prepare_output_folders(OUTPUT_FOLDER, task_options["filters"])
 
     # Get dataset from the input directory
-    # Find files in the sub folder
-    image_paths = []
-    for root, dirs, files in os.walk(INPUT_FOLDER):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                full_path = os.path.join(root, file)
-                image_paths.append(full_path)
+    # Images are found lazily (sub folders included) while processing runs
+    image_paths = image_source_from_args(args, INPUT_FOLDER, project_root)
 
     # If no image is found, the execution will automatically abort
-    if not image_paths:
+    if image_paths.is_empty():
         print(f"No images found in {INPUT_FOLDER}.")
         return
 
-    print(f"Found {len(image_paths)} images. Starting Serial Execution...")
+    # Duplicate inputs are found before the timer starts (--dedup); only the first copy is processed
+    unique_paths, dedup = dedup_from_args(args, image_paths)
+
+    print(f"Streaming images from {INPUT_FOLDER}. Starting Serial Execution...")
     print(f"{'-'*60}")
 
     # Serial Processing Loop
     results_data = []
+    trace_dir = trace_dir_from_args(args, project_root)
+    recorder = StageRecorder() if trace_dir else None
     
     global_start_time = time.time()  # Global start time. This is for the total execution of benchmark
     
     # Indicate that image is processed one after another
-    for index, img_path in enumerate(image_paths):
+    # (the numpy engine processes one batch after another instead)
+    task_options = begin_shard_run(OUTPUT_FOLDER, task_options)  # new output shards (--shard-output)
+    # (the array store needs the full list up front to preallocate its slots)
+    run_paths = unique_paths
+    if task_options["array_store"]:
+        from array_store import begin_array_store  # Memory-mapped array output (loads numpy)
+        task_options, run_paths = begin_array_store(OUTPUT_FOLDER, task_options, unique_paths)  # --array-store
+    worker_func, work_units = make_work(args.engine, run_paths, OUTPUT_FOLDER, task_options, args.batch_size)
+
+    index = 0
+    for unit in work_units:
         # Start timer
         start_time = time.time()
         
-        # Process the image
-        result = process_image(img_path, OUTPUT_FOLDER)
+        # Process the image (or the whole batch)
+        unit_results = worker_func(unit)
+        if not isinstance(unit_results, list):
+            unit_results = [unit_results]
         
-        # Stop timer
-        duration = time.time() - start_time
-
-        real_name = result.get("filename", os.path.basename(img_path))
-        
-        # Print execution status including PID and TID
-        print(f"[{index+1}/{len(image_paths)}] {real_name:<30} | Time: {duration:.4f}s | {get_thread_info()}")
-        
-        # Collect data for CSV
-        results_data.append({
-            "filename": real_name,  # Save the new name to CSV too
-            "duration_seconds": duration,
-            "status": result.get("status"),
-            "pid": os.getpid(),
-            "tid": threading.get_ident()
-        })
+        # Stop timer (a batch's time is shared evenly between its images)
+        duration = (time.time() - start_time) / len(unit_results)
+
+        for result in unit_results:
+            if recorder:
+                recorder.add(result)
+            index += 1
+            real_name = result.get("filename", "unknown")
+            
+            # Print execution status including PID and TID
+            print(f"[{index}] {real_name:<30} | Time: {duration:.4f}s | {get_thread_info()}")
+            
+            # Collect data for CSV
+            results_data.append({
+                "filename": real_name,  # Save the new name to CSV too
+                "duration_seconds": duration,
+                "status": result.get("status"),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "cache_hits": result.get("cache_hits", 0),
+                "cache_misses": result.get("cache_misses", 0)
+            })
     
+    # Wait for the background writer (if used) so the total includes every write
+    written, write_errors = close_writer()
+    if write_errors:
+        print(f"❌ {len(write_errors)} output file(s) could not be written")
+    if task_options["shard_output"]:
+        close_shard_writers()  # finish the archives, then index them
+        shard_outputs, shard_files = write_shard_index(OUTPUT_FOLDER)
+    if dedup:
+        linked = link_duplicates(OUTPUT_FOLDER, dedup, task_options)  # copies get the outputs of the first
+
     # Used for total execution time calculation
     total_time = time.time() - global_start_time
+    if recorder:
+        recorder.finish()
 
     # Serial Execution Summarization
     print(f"{'='*60}")
     print(f"Serial Processing Complete!")
     print(f"Total Execution Time: {total_time:.4f} seconds")
+    print(f"Discovery: {image_paths.describe()}")
+    if task_options["shard_output"]:
+        print(f"Shards: {shard_outputs} outputs in {shard_files} shard file(s)")
+    if task_options["array_store"]:
+        from array_store import describe_store
+        print(f"Array store: {describe_store(task_options['array_store'][0])}")
+    if dedup:
+        print(f"Dedup: {dedup.saved} task(s) saved, {linked} outputs linked")
+    if recorder:
+        recorder.print_report(indent="")
+        trace_path, csv_path = recorder.export(trace_base_path(trace_dir, "serial"))
+        print(f"[Trace] {trace_path} | {csv_path}")
+    if cache_dir:
+        hits = sum(row.get("cache_hits", 0) for row in results_data)
+        misses = sum(row.get("cache_misses", 0) for row in results_data)
+        print_cache_report(cache_dir, hits, misses, args.cache_max_mb, args.cache_max_age_days)
     print(f"{'='*60}")
 
 
@@ -100,7 +172,9 @@ def main():
             writer = csv.writer(f)
             writer.writerow(['metric', 'value'])
             writer.writerow(['serial_baseline', total_time])
-            writer.writerow(['num_images', len(image_paths)])
+            writer.writerow(['num_images', index])
+            for name, value in options.items():
+                writer.writerow([name, value])
             writer.writerow(['timestamp', time.strftime('%Y-%m-%d %H:%M:%S')])
         
         print(f"\n{'='*60}")
@@ -0,0 +1,104 @@
+import os
+import shutil
+import argparse
+import itertools
+import statistics
+import tempfile
+from filters import prepare_output_folders, resolve_filters
+from benchmark import run_backend
+from shards import pack, ShardSource
+from run_options import image_source_from_args
+
+# SHARD BENCHMARK
+# Runs the same images through the directory layout (input_images -> one
+# file per output) and the shard layout (packed input shards -> per-filter
+# output shards + index), for the serial baseline and a process pool, and
+# counts the files each layout creates. On a local SSD the difference is
+# small; on a network file system every avoided open/close/metadata call counts.
+
+
+def count_files(folder):
+    return sum(len(files) for _, _, files in os.walk(folder))
+
+
+def time_layout(backend, workers, image_paths, output_folder, task_options, repeats):
+    """Median seconds over repeats (after one warmup), and the files left in output_folder."""
+    shutil.rmtree(output_folder, ignore_errors=True)
+    prepare_output_folders(output_folder, task_options["filters"])
+    run_backend(backend, workers, image_paths, output_folder, task_options, "pillow", None)
+    times = []
+    for _ in range(repeats):
+        seconds, success, failed = run_backend(backend, workers, image_paths, output_folder, task_options,
+                                               "pillow", None)
+        if failed:
+            print(f"❌ {failed} image(s) failed in the {backend} run")
+        times.append(seconds)
+    return statistics.median(times), count_files(output_folder)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Directory layout vs tar shards (input and output)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--images", type=int, default=0, help="Images to use (0 = all)")
+    parser.add_argument("--images-per-shard", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per configuration (median kept)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = os.path.join(project_root, "input_images")
+    OUTPUT_FOLDER = os.path.join(project_root, "output_benchmark")
+
+    if not os.path.exists(INPUT_FOLDER):
+        print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
+        return
+    image_source = image_source_from_args(argparse.Namespace(scan_threads=0, file_index=None),
+                                          INPUT_FOLDER, project_root)
+    image_paths = list(itertools.islice(image_source, args.images or None))
+    if not image_paths:
+        print(f"No images found. Please add images to 'input_images' folder.")
+        return
+
+    print(f"\n{'='*60}")
+    print(f"Shard Benchmark: {len(image_paths)} images | serial and {args.workers} workers")
+    print(f"{'='*60}")
+
+    filters = resolve_filters(None)
+    directory_options = {"filters": filters}
+    shard_options = {"filters": filters, "shard_output": True}
+
+    with tempfile.TemporaryDirectory(prefix="cst435_shards_") as shard_folder:
+        # Pack exactly the sampled images (in a staging tree, so the sample matches)
+        staging = os.path.join(shard_folder, "staging")
+        for img_path in image_paths:
+            category = os.path.join(staging, os.path.basename(os.path.dirname(img_path)))
+            os.makedirs(category, exist_ok=True)
+            os.symlink(os.path.abspath(img_path), os.path.join(category, os.path.basename(img_path)))
+        packed, shard_count = pack(staging, os.path.join(shard_folder, "input"), args.images_per_shard)
+        shard_paths = list(ShardSource(os.path.join(shard_folder, "input")))
+        print(f"Packed {packed} images into {shard_count} input shard(s)\n")
+
+        rows = []
+        for backend, workers in (("serial", 1), ("multiprocessing", args.workers)):
+            for layout, paths, options in (("directory", image_paths, directory_options),
+                                           ("shards", shard_paths, shard_options)):
+                output_folder = os.path.join(OUTPUT_FOLDER, f"{layout}_{backend}")
+                seconds, files = time_layout(backend, workers, paths, output_folder, options, args.repeats)
+                rows.append((backend, workers, layout, seconds, files))
+                shutil.rmtree(output_folder, ignore_errors=True)
+
+    print(f"{'Backend':<16} | {'Workers':<7} | {'Layout':<9} | {'Median (s)':<10} | {'Images/s':<8} | {'Files':<6}")
+    print(f"{'-'*60}")
+    for backend, workers, layout, seconds, files in rows:
+        print(f"{backend:<16} | {workers:<7} | {layout:<9} | {seconds:<10.4f} | "
+              f"{len(image_paths) / seconds:<8.1f} | {files:<6}")
+    print(f"{'='*60}")
+    print(f"Input: {len(image_paths)} files vs {shard_count} shard(s); "
+          f"output files counted after the run (shards: parts + index per filter)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import tarfile
+import zipfile
+import argparse
+import threading
+import multiprocessing.util
+from result_cache import _format_for
+
+# SHARDED ARCHIVE INPUT AND OUTPUT (--input-shards, --shard-output)
+# A run normally opens thousands of small JPEGs and creates five small files
+# per input; on network file systems the per-file open/close and metadata
+# round-trips cost more than the bytes. With shards:
+#   - input: images are read from a few large uncompressed .tar (or .zip)
+#     files, listed sequentially. Each image is a ShardMember, a path-like
+#     string "<shard>/<category>/<name>" that also knows where its bytes are
+#     in the shard, so the usual <category>_<name>.jpg naming still works and
+#     workers read it with one positioned read on a shard they keep open
+#   - output: every worker appends its outputs to one tar shard per filter
+#     (output/<filter>/part-<run>-<pid>.tar) and writes where each output
+#     starts to a small index next to it (.idx, one JSON line per output).
+#     After the run the parent merges them into output/<filter>/index.json,
+#     which gives random access to any output by its usual file name
+# Every output is flushed as soon as it is added, so shards are readable
+# even while a (persistent) pool is still running.
+# Pack a dataset with: python3 src/shards.py pack input_images input_shards
+
+SHARD_EXTENSIONS = (".tar", ".zip")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+DEFAULT_IMAGES_PER_SHARD = 1000
+INDEX_NAME = "index.json"
+INDEX_VERSION = 1
+PART_PREFIX = "part-"
+
+
+class ShardMember(str):
+    """
+    An image inside an input shard. Its string value is a virtual path
+    (<shard>/<member>), so os.path.basename/dirname give the usual names.
+    """
+
+    def __new__(cls, shard, member, offset=None, size=None):
+        self = super().__new__(cls, os.path.join(shard, member))
+        self.shard = shard
+        self.member = member
+        self.offset = offset # data offset inside a tar (None for zip members)
+        self.size = size
+        return self
+
+    def __getnewargs__(self):
+        # Pickled with its location, so workers can read it
+        return self.shard, self.member, self.offset, self.size
+
+
+# INPUT
+
+def list_shards(path):
+    """A shard file, or every shard in a folder (sorted, so runs are repeatable)."""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.lower().endswith(SHARD_EXTENSIONS))
+
+
+def iter_shard(shard_path):
+    """Yields a ShardMember for every image in one shard, in archive order."""
+    if shard_path.lower().endswith(".zip"):
+        # Zip members are found through the central directory at the end of the file
+        with zipfile.ZipFile(shard_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    yield ShardMember(shard_path, info.filename, None, info.file_size)
+        return
+    # "r:" = uncompressed only: compressed tars have no offsets to read members from
+    # (JPEG and PNG do not compress any further anyway)
+    with tarfile.open(shard_path, "r:") as archive:
+        for info in archive: # reads one header at a time, seeking over the data
+            if info.isfile() and info.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield ShardMember(shard_path, info.name, info.offset_data, info.size)
+
+
+class ShardSource:
+    """
+    Re-iterable, lazy view of the images in a set of shards (same interface
+    as discovery.ImageSource). Shards are read one after another.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.shards = list_shards(root)
+        self.found = 0
+
+    def __iter__(self):
+        count = 0
+        for shard_path in self.shards:
+            for member in iter_shard(shard_path):
+                count += 1
+                yield member
+        self.found = count
+
+    def is_empty(self):
+        return next(iter(self), None) is None
+
+    def describe(self):
+        return f"{self.found} images from {len(self.shards)} shard(s)"
+
+
+# Open input shards of this process: (pid, shard path) -> file or ZipFile.
+# Keyed by PID so a forked worker never shares a file position with its parent.
+_input_handles = {}
+_input_lock = threading.Lock()
+
+
+def _input_handle(shard_path):
+    key = (os.getpid(), shard_path)
+    with _input_lock:
+        if key not in _input_handles:
+            if shard_path.lower().endswith(".zip"):
+                _input_handles[key] = zipfile.ZipFile(shard_path)
+            else:
+                _input_handles[key] = open(shard_path, 'rb')
+        return _input_handles[key]
+
+
+def read_member(member):
+    """Bytes of one input image from its shard."""
+    handle = _input_handle(member.shard)
+    if member.offset is None:
+        return handle.read(member.member) # ZipFile reads are thread-safe
+    if hasattr(os, "pread"):
+        return os.pread(handle.fileno(), member.size, member.offset)
+    with _input_lock: # no pread (Windows): seek + read must not interleave
+        handle.seek(member.offset)
+        return handle.read(member.size)
+
+
+def read_input(file_path):
+    """Bytes of an input image, from a file or a shard."""
+    if isinstance(file_path, ShardMember):
+        return read_member(file_path)
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def open_input(file_path):
+    """Something Image.open accepts: the path itself, or the member's bytes."""
+    if isinstance(file_path, ShardMember):
+        return io.BytesIO(read_member(file_path))
+    return file_path
+
+
+# OUTPUT
+
+def _padded(size):
+    """Bytes a member's data takes in a tar (rounded up to whole blocks)."""
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+class ShardWriter:
+    """One output tar shard of this process, plus its index of (name, offset, size)."""
+
+    def __init__(self, tar_path):
+        self.tar_path = tar_path
+        self.tar = tarfile.open(tar_path, "w")
+        self.index = open(os.path.splitext(tar_path)[0] + ".idx", 'w')
+        self.lock = threading.Lock() # background writer and thread-pool threads share it
+
+    def add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        with self.lock:
+            self.tar.addfile(info, io.BytesIO(data))
+            offset = self.tar.offset - _padded(len(data))
+            self.index.write(json.dumps([name, offset, len(data)]) + "\n")
+            # Flushed per output: the parent merges the index while workers may still be alive
+            self.tar.fileobj.flush()
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            self.tar.close()
+            self.index.close()
+
+
+# This process's output shards: (pid, filter folder, run id) -> ShardWriter
+# (keyed by PID so a forked worker never appends through its parent's file)
+_writers = {}
+_writers_lock = threading.Lock()
+_finalizer_pid = None
+
+
+def get_shard_writer(folder, run):
+    """The shard this process appends to in one filter folder during one run."""
+    global _finalizer_pid
+    pid = os.getpid()
+    key = (pid, folder, run)
+    with _writers_lock:
+        if key not in _writers:
+            # A new run (persistent pool): the previous run's shards are finished
+            for old_key in [old for old in _writers if old[0] == pid and old[2] != run]:
+                _writers.pop(old_key).close()
+            path = os.path.join(folder, f"{PART_PREFIX}{run}-{pid}.tar")
+            _writers[key] = ShardWriter(path)
+            if _finalizer_pid != pid:
+                # Runs after the background writer's finalizer (exitpriority 10), which may still add outputs
+                multiprocessing.util.Finalize(None, close_shard_writers, exitpriority=5)
+                _finalizer_pid = pid
+        return _writers[key]
+
+
+def close_shard_writers():
+    """Writes the end-of-archive blocks of every shard this process has open."""
+    pid = os.getpid()
+    with _writers_lock:
+        writers = [_writers.pop(key) for key in list(_writers) if key[0] == pid]
+    for writer in writers:
+        writer.close()
+
+
+def encode(img_obj, name):
+    """Encodes an image to bytes in the format its file name implies (like img.save(path))."""
+    buffer = io.BytesIO()
+    img_obj.save(buffer, format=_format_for(os.path.splitext(name)[1]))
+    return buffer.getvalue()
+
+
+def shard_save_func(run):
+    """save_func(img, path) that appends to the filter's shard instead of creating path."""
+    def save(img_obj, save_path):
+        folder, name = os.path.split(save_path)
+        get_shard_writer(folder, run).add(name, encode(img_obj, name))
+    return save
+
+
+def begin_shard_run(output_folder, task_options):
+    """
+    Parent side, before every run with --shard-output: removes the previous
+    run's shards and returns task options with a new run id (workers of a
+    persistent pool then start new shards instead of appending to old ones).
+    """
+    if not task_options or not task_options.get("shard_output"):
+        return task_options
+    for folder in _filter_folders(output_folder):
+        for name in os.listdir(folder):
+            if name.startswith(PART_PREFIX) or name == INDEX_NAME:
+                os.remove(os.path.join(folder, name))
+    return dict(task_options, shard_output=uuid.uuid4().hex[:8])
+
+
+def _filter_folders(output_folder):
+    if not os.path.isdir(output_folder):
+        return []
+    return [os.path.join(output_folder, name) for name in sorted(os.listdir(output_folder))
+            if os.path.isdir(os.path.join(output_folder, name))]
+
+
+def write_shard_index(output_folder):
+    """
+    Parent side, after a run: merges every part index into <filter>/index.json.
+    Returns (outputs indexed, shard files).
+    """
+    total_outputs = 0
+    total_shards = 0
+    for folder in _filter_folders(output_folder):
+        parts = sorted(name for name in os.listdir(folder) if name.startswith(PART_PREFIX) and name.endswith(".tar"))
+        if not parts:
+            continue
+        entries = {}
+        for number, part in enumerate(parts):
+            with open(os.path.join(folder, os.path.splitext(part)[0] + ".idx"), 'r') as f:
+                for line in f:
+                    if line.endswith("\n"): # a line still being written is skipped
+                        name, offset, size = json.loads(line)
+                        entries[name] = [number, offset, size]
+        tmp_path = os.path.join(folder, f"{INDEX_NAME}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": INDEX_VERSION, "shards": parts, "entries": entries}, f)
+        os.replace(tmp_path, os.path.join(folder, INDEX_NAME))
+        total_outputs += len(entries)
+        total_shards += len(parts)
+    return total_outputs, total_shards
+
+
+class ShardIndex:
+    """Random access to the outputs of one filter folder written with --shard-output."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        index_path = os.path.join(folder, INDEX_NAME)
+        if not os.path.exists(index_path):
+            write_shard_index(os.path.dirname(os.path.abspath(folder)))
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        self.entries = index["entries"]
+
+    def names(self):
+        return sorted(self.entries)
+
+    def read(self, name):
+        """Bytes of one output, e.g. index.read("apple_pie_1005649.jpg")."""
+        number, offset, size = self.entries[name]
+        with open(os.path.join(self.folder, self.shards[number]), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+
+# PACKING A DATASET INTO SHARDS
+
+def pack(input_folder, shard_folder, images_per_shard=DEFAULT_IMAGES_PER_SHARD, fmt="tar"):
+    """
+    Packs every image under input_folder into shards of images_per_shard images,
+    as <category>/<name> members (the folder layout process_image names outputs by).
+    Returns (images packed, shards written).
+    """
+    from discovery import iter_images
+    os.makedirs(shard_folder, exist_ok=True)
+    count = 0
+    shard_count = 0
+    archive = None
+    for img_path in iter_images(input_folder):
+        if count % images_per_shard == 0:
+            if archive is not None:
+                archive.close()
+            shard_path = os.path.join(shard_folder, f"shard-{shard_count:05d}.{fmt}")
+            # Stored, not deflated: JPEG and PNG are already compressed
+            if fmt == "zip":
+                archive = zipfile.ZipFile(shard_path, "w", zipfile.ZIP_STORED)
+            else:
+                archive = tarfile.open(shard_path, "w", dereference=True)
+            shard_count += 1
+        member = f"{os.path.basename(os.path.dirname(img_path))}/{os.path.basename(img_path)}"
+        if fmt == "zip":
+            archive.write(img_path, member)
+        else:
+            archive.add(img_path, member)
+        count += 1
+    if archive is not None:
+        archive.close()
+    return count, shard_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack input images into shards, or read an output shard")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="Pack an image folder into .tar/.zip shards")
+    pack_parser.add_argument("input_folder")
+    pack_parser.add_argument("shard_folder")
+    pack_parser.add_argument("--images-per-shard", type=int, default=DEFAULT_IMAGES_PER_SHARD)
+    pack_parser.add_argument("--format", choices=["tar", "zip"], default="tar")
+    extract_parser = commands.add_parser("extract", help="Copy one output out of a filter folder's shards")
+    extract_parser.add_argument("filter_folder", help="e.g. output_serial/blur")
+    extract_parser.add_argument("name", help="Output file name, e.g. apple_pie_1005649.jpg")
+    extract_parser.add_argument("dest", nargs="?", default=None, help="Destination (default: ./<name>)")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        count, shard_count = pack(args.input_folder, args.shard_folder, args.images_per_shard, args.format)
+        print(f"✅ Packed {count} images into {shard_count} {args.format} shard(s) in {args.shard_folder}")
+        return
+    index = ShardIndex(args.filter_folder)
+    if args.name not in index.entries:
+        print(f"❌ Error: {args.name} is not in {args.filter_folder} ({len(index.entries)} outputs indexed)")
+        sys.exit(1)
+    dest = args.dest or args.name
+    with open(dest, 'wb') as f:
+        f.write(index.read(args.name))
+    print(f"✅ Extracted {args.name} to {dest}")
+
+
+if __name__ == "__main__":
+    main()
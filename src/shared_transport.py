@@ -0,0 +1,186 @@
+import os
+import collections
+import functools
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from PIL import Image
+from filters import resolve_filters, run_filter_graph, open_image
+from numpy_engine import run_batch_filters
+
+# IN-MEMORY MODE: ZERO-COPY SHARED-MEMORY PIXEL TRANSPORT
+# When the parent already holds decoded frames (e.g. from an upstream stage)
+# and wants filtered arrays back, pickling every frame to a worker and every
+# result back doubles the memory traffic. Instead:
+#   - the parent packs all input frames into one shared memory block
+#   - it preallocates one output block ("slab") per filter
+#   - a task only carries (offset, shape) for its input and outputs
+#   - the worker filters straight from the input view into the output slabs
+# The "pickle" transport sends the arrays through the pipe instead, for comparison.
+
+# Channels of each output (grayscale and edge are single-channel)
+OUTPUT_CHANNELS = {"grayscale": 1, "blur": 3, "edge": 1, "sharpen": 3, "brightness": 3}
+
+# One frame of work: name for reporting, where to read it and where to write each output
+FrameTask = collections.namedtuple("FrameTask", ["name", "input_spec", "output_specs"])
+
+
+def output_shape(shape, filter_name):
+    height, width = shape[:2]
+    return (height, width) if OUTPUT_CHANNELS[filter_name] == 1 else (height, width, 3)
+
+
+class FrameSlab:
+    """Frames of any size packed back to back in one shared memory block."""
+
+    def __init__(self, shapes):
+        self.shapes = list(shapes)
+        self.offsets = []
+        total = 0
+        for shape in self.shapes:
+            self.offsets.append(total)
+            total += int(np.prod(shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(total, 1))
+
+    def spec(self, index):
+        """What a worker needs to find frame `index`: (block name, offset, shape)."""
+        return (self.shm.name, self.offsets[index], self.shapes[index])
+
+    def view(self, index):
+        return _view(self.shm, self.offsets[index], self.shapes[index])
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # a caller still holds a view; the memory is released when it goes away
+        self.shm.unlink()
+
+
+def share_tracker_with_workers():
+    """
+    Starts the shared memory resource tracker before any pool exists, so the
+    workers inherit it. Otherwise a worker that attaches a block gets its own
+    tracker, which "cleans up" (and warns about) blocks the parent still owns.
+    """
+    resource_tracker.ensure_running()
+
+
+def _view(shm, offset, shape):
+    return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+
+# Shared memory blocks this worker has already attached (attach once, reuse for every task).
+# Only the most recent ones stay mapped, so blocks of finished jobs are released.
+MAX_ATTACHED = 16
+_attached = collections.OrderedDict()
+
+
+def _attached_view(spec):
+    name, offset, shape = spec
+    if name in _attached:
+        _attached.move_to_end(name)
+    else:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+        while len(_attached) > MAX_ATTACHED:
+            _, old = _attached.popitem(last=False)
+            try:
+                old.close()
+            except BufferError:
+                pass # still viewed somewhere; unmapped once that view goes away
+    return _view(_attached[name], offset, shape)
+
+
+def filter_frame(pixels, filters, engine="numpy"):
+    """Runs the filters on one (H, W, 3) frame. Returns filter name -> array."""
+    if engine == "numpy":
+        outputs = run_batch_filters(pixels[np.newaxis], filters)
+        return {name: stack[0] for name, stack in outputs.items()}
+    outputs = run_filter_graph(Image.fromarray(pixels), filters)
+    return {name: np.asarray(img) for name, img in outputs.items()}
+
+
+def filter_shared_frame(task, filters=None, engine="numpy"):
+    """
+    Worker side of the shared transport: reads the input frame in place and
+    writes every output into its preallocated slot. Only the small status
+    dictionary goes back through the pipe.
+    """
+    pixels = _attached_view(task.input_spec)
+    for name, array in filter_frame(pixels, resolve_filters(filters), engine).items():
+        np.copyto(_attached_view(task.output_specs[name]), array)
+    return {"status": "Success", "filename": task.name, "pid": os.getpid()}
+
+
+def filter_pickled_frame(item, filters=None, engine="numpy"):
+    """Worker side of the pickle transport: arrays travel both ways through the pipe."""
+    name, pixels = item
+    arrays = filter_frame(pixels, resolve_filters(filters), engine)
+    return {"status": "Success", "filename": name, "pid": os.getpid(), "arrays": arrays}
+
+
+def decode_frames(image_paths, max_side=None):
+    """The 'upstream stage': decoded frames held by the parent, name -> (H, W, 3) array."""
+    frames = {}
+    for img_path in image_paths:
+        category_name = os.path.basename(os.path.dirname(img_path))
+        frames[f"{category_name}_{os.path.basename(img_path)}"] = np.asarray(open_image(img_path, max_side))
+    return frames
+
+
+class InMemoryJob:
+    """
+    Filters frames already held by the parent through a worker pool.
+    Use worker_func/items with the dispatch functions, pass every result to
+    collect(), read outputs with outputs(name), then close().
+    """
+
+    def __init__(self, frames, transport="shared", filters=None, engine="numpy"):
+        self.transport = transport
+        self.filters = resolve_filters(filters)
+        self.names = list(frames)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.results = {}
+        self.slabs = {}
+        self.bytes_through_pipe = 0
+
+        if transport == "shared":
+            shapes = [frames[name].shape for name in self.names]
+            self.input_slab = FrameSlab(shapes)
+            for index, name in enumerate(self.names):
+                np.copyto(self.input_slab.view(index), frames[name])
+            for filter_name in self.filters:
+                self.slabs[filter_name] = FrameSlab([output_shape(shape, filter_name) for shape in shapes])
+            self.items = [
+                FrameTask(name, self.input_slab.spec(index),
+                          {f: slab.spec(index) for f, slab in self.slabs.items()})
+                for index, name in enumerate(self.names)
+            ]
+            self.worker_func = functools.partial(filter_shared_frame, filters=self.filters, engine=engine)
+        else:
+            self.input_slab = None
+            self.items = [(name, frames[name]) for name in self.names]
+            self.bytes_through_pipe = sum(frames[name].nbytes for name in self.names)
+            self.worker_func = functools.partial(filter_pickled_frame, filters=self.filters, engine=engine)
+
+    def collect(self, result):
+        """Keeps the arrays returned by the pickle transport (the shared one wrote them already)."""
+        arrays = result.pop("arrays", None)
+        if arrays is not None:
+            self.results[result["filename"]] = arrays
+            self.bytes_through_pipe += sum(array.nbytes for array in arrays.values())
+
+    def outputs(self, name):
+        """Filter name -> output array for one frame."""
+        if self.transport == "shared":
+            index = self.index[name]
+            return {f: slab.view(index) for f, slab in self.slabs.items()}
+        return self.results[name]
+
+    def close(self):
+        """Frees the shared memory blocks (copy anything you need out of outputs() first)."""
+        if self.input_slab is not None:
+            self.input_slab.close()
+        for slab in self.slabs.values():
+            slab.close()
+        self.slabs = {}
+        self.input_slab = None
@@ -0,0 +1,174 @@
+import io
+import os
+import csv
+import math
+import json
+import time
+import threading
+import contextlib
+from PIL import Image
+
+# PER-STAGE INSTRUMENTATION
+# With tracing enabled (--trace), process_image times every stage of an image:
+#   decode, cache (lookup), each filter graph node, encode, write
+#   (store = encode + write into the result cache, submit = waiting on the writer queue)
+# Each worker keeps its spans in a small buffer and returns them with the next
+# result, so they reach the parent through the normal result pipe. The parent
+# aggregates them into per-stage and per-worker percentiles and exports a
+# Chrome/Perfetto trace (chrome://tracing or ui.perfetto.dev) plus a CSV.
+# time.perf_counter is the system-wide monotonic clock on Linux, so spans from
+# different processes line up on one timeline.
+# Background writer spans recorded after a worker's last result are not reported.
+# Disabled, every instrumented block costs one shared nullcontext (no clock reads).
+
+_NULL = contextlib.nullcontext()
+
+# Spans recorded by this process and not yet handed back: (stage, start, seconds, tid, label)
+_events = []
+_events_lock = threading.Lock() # writer threads record encode/write spans too
+
+
+class _Span:
+    __slots__ = ("name", "label", "start")
+
+    def __init__(self, name, label):
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        with _events_lock:
+            _events.append((self.name, self.start, duration, threading.get_native_id(), self.label))
+        return False
+
+
+def stage(name, enabled, label=None):
+    """Context manager timing one stage, or a no-op when tracing is disabled."""
+    return _Span(name, label) if enabled else _NULL
+
+
+def drain():
+    """Takes every span recorded in this process so far (attached to a result)."""
+    global _events
+    with _events_lock:
+        events, _events = _events, []
+    return events
+
+
+def traced_save(img_obj, save_path, label):
+    """img_obj.save(save_path) split into separately timed encode and write stages."""
+    buffer = io.BytesIO()
+    with stage("encode", True, label):
+        ext = os.path.splitext(save_path)[1].lower()
+        img_obj.save(buffer, format=Image.registered_extensions().get(ext))
+    with stage("write", True, label):
+        with open(save_path, 'wb') as f:
+            f.write(buffer.getbuffer())
+
+
+def traced_save_func(save_func, label):
+    """Wraps a save_func(img, path) for the traced path (None = plain save)."""
+    if save_func is None:
+        return lambda img, path: traced_save(img, path, label)
+
+    def save(img, path):
+        with stage("store", True, label):
+            save_func(img, path)
+    return save
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+class StageRecorder:
+    """Parent side: collects the spans returned with every result of one run."""
+
+    def __init__(self):
+        self.events = [] # (pid, tid, stage, start, seconds, label)
+        self.start = time.perf_counter()
+        self.end = None
+
+    def add(self, result):
+        for name, start, seconds, tid, label in result.pop("stages", ()):
+            self.events.append((result.get("pid"), tid, name, start, seconds, label))
+
+    def finish(self):
+        self.end = time.perf_counter()
+        # Spans recorded in this process (serial and thread runs) that no result carried back
+        pid = os.getpid()
+        for name, start, seconds, tid, label in drain():
+            self.events.append((pid, tid, name, start, seconds, label))
+
+    def stage_summary(self):
+        """Stage -> (count, total s, p50 ms, p90 ms, p99 ms, max ms)"""
+        durations = {}
+        for _, _, name, _, seconds, _ in self.events:
+            durations.setdefault(name, []).append(seconds)
+        summary = {}
+        for name, values in durations.items():
+            values.sort()
+            summary[name] = (len(values), sum(values), percentile(values, 50) * 1000,
+                             percentile(values, 90) * 1000, percentile(values, 99) * 1000, values[-1] * 1000)
+        return summary
+
+    def worker_summary(self):
+        """(pid, tid) -> (busy s, idle s, {stage: p90 ms}); idle = run wall time - busy."""
+        wall = (self.end or time.perf_counter()) - self.start
+        per_worker = {}
+        for pid, tid, name, _, seconds, _ in self.events:
+            per_worker.setdefault((pid, tid), {}).setdefault(name, []).append(seconds)
+        summary = {}
+        for key, stages in per_worker.items():
+            # Spans never nest on one thread, so their sum is the thread's busy time
+            busy = sum(sum(values) for values in stages.values())
+            p90 = {name: percentile(sorted(values), 90) * 1000 for name, values in stages.items()}
+            summary[key] = (busy, max(wall - busy, 0.0), p90)
+        return summary
+
+    def print_report(self, indent="      "):
+        wall = (self.end or time.perf_counter()) - self.start
+        print(f"{indent}[Stages] {'Stage':<11} | {'Count':>6} | {'Total s':>8} | {'p50 ms':>7} | {'p90 ms':>7} | {'p99 ms':>7}")
+        for name, (count, total, p50, p90, p99, _) in sorted(self.stage_summary().items(),
+                                                               key=lambda item: -item[1][1]):
+            print(f"{indent}         {name:<11} | {count:>6} | {total:>8.3f} | {p50:>7.2f} | {p90:>7.2f} | {p99:>7.2f}")
+        print(f"{indent}[Workers] busy / idle over {wall:.3f}s wall time:")
+        for (pid, tid), (busy, idle, _) in sorted(self.worker_summary().items()):
+            print(f"{indent}         PID {pid} / TID {tid}: busy {busy:.3f}s | idle {idle:.3f}s "
+                  f"({idle / wall * 100 if wall else 0:.0f}%)")
+
+    def export(self, base_path):
+        """Writes <base_path>.trace.json (Chrome/Perfetto) and <base_path>.csv. Returns both paths."""
+        os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+        trace_events = []
+        for pid in sorted({event[0] for event in self.events if event[0]}):
+            trace_events.append({"name": "process_name", "ph": "M", "pid": pid,
+                                 "args": {"name": f"worker {pid}"}})
+        for pid, tid, name, start, seconds, label in self.events:
+            trace_events.append({"name": name, "cat": "stage", "ph": "X", "pid": pid, "tid": tid,
+                                 "ts": (start - self.start) * 1e6, "dur": seconds * 1e6,
+                                 "args": {"file": label}})
+        trace_path = base_path + ".trace.json"
+        with open(trace_path, 'w') as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+        csv_path = base_path + ".csv"
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["pid", "tid", "stage", "file", "start_s", "duration_ms"])
+            for pid, tid, name, start, seconds, label in sorted(self.events, key=lambda event: event[3]):
+                writer.writerow([pid, tid, name, label, f"{start - self.start:.6f}", f"{seconds * 1000:.3f}"])
+        return trace_path, csv_path
+
+
+def trace_base_path(trace_dir, run_label):
+    """<trace_dir>/<run label>_<timestamp> (extensions are added by export)."""
+    return os.path.join(trace_dir, f"{run_label}_{time.strftime('%Y%m%d_%H%M%S')}")
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import statistics
+import subprocess
+import multiprocessing
+from filters import prepare_output_folders
+from dispatch import make_work, ChunkSizer, stream_pool_results
+from worker_pool import worker_pool, warm_up, START_METHODS, close_persistent_pools
+from run_options import image_source_from_args
+
+# STARTUP BENCHMARK
+# For short interactive jobs on small folders the pool startup, not the
+# filtering, dominates the latency. This measures, per start method:
+#   - interpreter start and module import times (in fresh interpreters)
+#   - pool spin-up: creating a pool until every worker has answered a task
+#   - time to first result and total time of a small job on a fresh pool
+#   - the same job again on a persistent (already running) pool
+
+IMPORT_MODULES = ("PIL.Image", "numpy", "filters", "dispatch", "multiprocessing_image")
+
+
+def interpreter_seconds(code, repeats=3):
+    """Median wall time of running a fresh interpreter on code (from src/, like the scripts)."""
+    src = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=src, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_times():
+    """Module -> seconds its import adds to a bare interpreter start."""
+    bare = interpreter_seconds("pass")
+    return bare, {module: interpreter_seconds(f"import {module}") - bare for module in IMPORT_MODULES}
+
+
+def time_job(pool, worker_func, image_paths, num_workers, limit=None):
+    """(seconds to the first result, seconds for the whole job) on a running pool."""
+    start = time.perf_counter()
+    first = None
+    sizer = ChunkSizer(num_workers, total=len(image_paths))
+    for _ in stream_pool_results(pool, worker_func, image_paths, sizer, limit):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def measure_method(method, num_workers, worker_func, image_paths):
+    """Spin-up, fresh-pool job and persistent-pool job timings for one start method."""
+    start = time.perf_counter()
+    with worker_pool("pool", num_workers, method) as (pool, _):
+        pool.map(warm_up, range(num_workers), chunksize=1)
+        spin_up = time.perf_counter() - start
+    # A fresh pool per job, as the run scripts do: startup + job + shutdown
+    start = time.perf_counter()
+    with worker_pool("pool", num_workers, method) as (pool, _):
+        pool_ready = time.perf_counter() - start
+        first, _ = time_job(pool, worker_func, image_paths, num_workers)
+        first_fresh = pool_ready + first # counted from the moment the pool was requested
+    fresh_total = time.perf_counter() - start
+    # Persistent pool: the first job pays the startup, the next ones do not
+    with worker_pool("pool", num_workers, method, persistent=True) as (pool, limit):
+        time_job(pool, worker_func, image_paths, num_workers, limit)
+    with worker_pool("pool", num_workers, method, persistent=True) as (pool, limit):
+        first_reused, reused_total = time_job(pool, worker_func, image_paths, num_workers, limit)
+    close_persistent_pools()
+    return {"spin_up": spin_up, "first_fresh": first_fresh, "fresh_total": fresh_total,
+            "first_reused": first_reused, "reused_total": reused_total}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Worker startup benchmark: imports, pool spin-up, first result")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--images", type=int, default=8, help="Images in the small test job")
+    parser.add_argument("--methods", default=",".join(START_METHODS[1:]),
+                        help="Comma separated start methods to compare")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    methods = [m for m in args.methods.split(",") if m in multiprocessing.get_all_start_methods()]
+
+    print(f"\n{'='*60}")
+    print(f"Startup Benchmark: {args.workers} workers | {args.images} image job")
+    print(f"{'='*60}")
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = os.path.join(project_root, "input_images")
+    OUTPUT_FOLDER = os.path.join(project_root, "output_benchmark")
+
+    if not os.path.exists(INPUT_FOLDER):
+        print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
+        return
+    prepare_output_folders(OUTPUT_FOLDER)
+    image_source = image_source_from_args(argparse.Namespace(scan_threads=0, file_index=None),
+                                          INPUT_FOLDER, project_root)
+    image_paths = list(itertools.islice(image_source, args.images))
+    if not image_paths:
+        print(f"No images found. Please add images to 'input_images' folder.")
+        return
+    worker_func, _ = make_work("pillow", image_paths, OUTPUT_FOLDER)
+
+    bare, imports = import_times()
+    print(f"Interpreter start: {bare * 1000:.0f} ms")
+    for module, seconds in imports.items():
+        print(f"   import {module:<22} +{seconds * 1000:.0f} ms")
+    print(f"{'-'*60}")
+
+    print(f"{'Method':<11} | {'Spin-up':>8} | {'1st result':>10} | {'Job':>8} | {'Reused: 1st':>11} | {'Job':>8}")
+    print(f"{'-'*60}")
+    for method in methods:
+        row = measure_method(method, args.workers, worker_func, image_paths)
+        print(f"{method:<11} | {row['spin_up']:>7.3f}s | {row['first_fresh']:>9.3f}s | {row['fresh_total']:>7.3f}s | "
+              f"{row['first_reused']:>10.3f}s | {row['reused_total']:>7.3f}s")
+    print(f"{'='*60}")
+    print("Spin-up = pool created and every worker answered a task; Job = fresh pool, "
+          "work and shutdown; Reused = the same job on an already running persistent pool")
+
+
+if __name__ == "__main__":
+    main()
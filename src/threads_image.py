@@ -0,0 +1,258 @@
+import os
+import time
+import concurrent.futures
+from filters import prepare_output_folders
+from result_cache import print_cache_report, format_hit_rate
+from writer import close_writer, shared_error_count, count_errors_in
+from shards import begin_shard_run, write_shard_index
+from stage_trace import StageRecorder, trace_base_path
+from scheduling import apply_schedule, item_costs, ScheduleReport
+from dispatch import make_work, known_total, ChunkSizer, stream_executor_results
+from cpu_affinity import effective_cpu_count
+from run_options import (add_processing_arguments, add_dispatch_arguments,
+                         task_options_from_args, print_run_options, input_folder_from_args, image_source_from_args,
+                         trace_dir_from_args, baseline_options, baseline_mismatches, DEFAULT_BATCH_SIZE)
+import csv
+import argparse
+
+# THREAD POOL AND HYBRID (PROCESSES x THREADS) BACKENDS
+# Pillow releases the GIL for most decode, filter and encode work, so threads
+# can run image work in parallel without spawning processes or pickling tasks:
+#   - threads: one ThreadPoolExecutor in this process
+#   - hybrid:  P worker processes, each running its chunks on T threads
+# Both print the same success/fail and load-balancing breakdown as the
+# process pool scripts, broken down per PID and thread id (TID).
+
+# Serial Benchmark Values Loader
+def load_serial_baseline(options):
+    """Load the serial baseline from CSV file (it must be measured with the same result-changing options)."""
+    try:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        project_root = os.path.dirname(script_dir)
+        baseline_path = os.path.join(project_root, "serial_baseline_value.csv")
+
+        with open(baseline_path, 'r') as f:
+            rows = {row['metric']: row['value'] for row in csv.DictReader(f)}
+
+    except FileNotFoundError:
+        print("❌ Error: serial_baseline_value.csv not found!")
+        print("Please run serial_baseline.py first!")
+        exit(1)
+
+    if 'serial_baseline' not in rows:
+        print("❌ Error: serial baseline not found in CSV!")
+        exit(1)
+
+    # A baseline of other work (another engine, --max-side, --cache, ...) would give a meaningless speedup
+    mismatches = baseline_mismatches(rows, options)
+    if mismatches:
+        print("❌ Error: the serial baseline was measured with other options!")
+        for name, saved, value in mismatches:
+            print(f"   {name}: {saved} (baseline) vs {value} (this run)")
+        print("Please run serial_baseline.py with the same options first!")
+        exit(1)
+    return float(rows['serial_baseline'])
+
+
+# THREAD / HYBRID TEST FUNCTION
+# num_processes=None runs a plain thread pool in this process
+def run_test_with_threads(num_threads, image_paths, output_folder, task_options=None,
+                          engine="pillow", batch_size=DEFAULT_BATCH_SIZE,
+                          chunksize=None, max_in_flight=None, num_processes=None, trace_dir=None,
+                          costs=None):
+    if num_processes:
+        print(f"   Testing with {num_processes} process(es) x {num_threads} thread(s)...", end=" ", flush=True)
+    else:
+        print(f"   Testing with {num_threads} thread(s)...", end=" ", flush=True)
+
+    start_time = time.time()
+
+    success_count = 0
+    cache_hits = 0
+    cache_misses = 0
+    fail_count = 0
+    worker_stats = {} # (PID, TID) -> images processed
+    recorder = StageRecorder() if trace_dir else None # per-stage timings (--trace)
+
+    task_options = begin_shard_run(output_folder, task_options or {}) # fresh output shards per run (--shard-output)
+    if task_options.get("array_store"):
+        from array_store import begin_array_store # numpy is only loaded for the array store
+        task_options, image_paths = begin_array_store(output_folder, task_options, image_paths) # preallocated
+    worker_func, items = make_work(engine, image_paths, output_folder, task_options, batch_size)
+    costs = item_costs(items, costs) if costs else None # size-aware scheduling (--schedule lpt)
+    schedule_report = ScheduleReport((num_processes or 1) * num_threads)
+
+    if num_processes:
+        # Hybrid: each chunk needs at least one item per thread to keep them all busy
+        sizer = ChunkSizer(num_processes, total=known_total(items), chunksize=chunksize, min_size=num_threads,
+                           costs=costs)
+        # Hybrid worker processes flush their own writers when they exit: their failed writes come back here
+        worker_write_errors = shared_error_count() if task_options.get("async_write") else None
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_processes, initializer=count_errors_in if worker_write_errors is not None else None,
+            initargs=(worker_write_errors,) if worker_write_errors is not None else ())
+        threads = num_threads
+    else:
+        sizer = ChunkSizer(num_threads, total=known_total(items), chunksize=chunksize, costs=costs)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads)
+        threads = None
+        worker_write_errors = None
+
+    with executor:
+        for result in stream_executor_results(executor, worker_func, items, sizer, max_in_flight, threads):
+            if recorder:
+                recorder.add(result)
+            schedule_report.add(result, (result.get("pid"), result.get("tid")))
+            if result.get("status") == "Success":
+                success_count += 1
+            else:
+                fail_count += 1
+
+            # Result cache outputs reused vs computed
+            cache_hits += result.get("cache_hits", 0)
+            cache_misses += result.get("cache_misses", 0)
+
+            pid = result.get("pid")
+            if pid:
+                key = (pid, result.get("tid"))
+                worker_stats[key] = worker_stats.get(key, 0) + 1
+
+    # Thread workers share this process's writer: flush it inside the timed region
+    # (hybrid worker processes flush their own writers when they exit)
+    _, write_errors = close_writer()
+    fail_count += len(write_errors)
+    if worker_write_errors is not None:
+        fail_count += worker_write_errors.value
+    if task_options.get("shard_output"):
+        shard_outputs, shard_files = write_shard_index(output_folder) # per-filter index.json
+
+    end_time = time.time()
+    duration = end_time - start_time
+    if recorder:
+        recorder.finish() # also picks up the writer-thread spans of this process
+
+    print(f"Done! ({duration:.4f}s)")
+    print(f"      [Stats] Success: {success_count} | Failed: {fail_count}")
+    print(f"      [Dispatch] {sizer.describe()}")
+    schedule_report.print_report(duration)
+    if task_options.get("shard_output"):
+        print(f"      [Shards] {shard_outputs} outputs in {shard_files} shard file(s)")
+    if task_options.get("array_store"):
+        from array_store import describe_store
+        print(f"      [Array store] {describe_store(task_options['array_store'][0])}")
+    if task_options.get("cache_dir"):
+        print(f"      [Cache] {format_hit_rate(cache_hits, cache_misses)}")
+    if recorder:
+        recorder.print_report()
+        trace_path, csv_path = recorder.export(trace_base_path(trace_dir, f"threads_{num_processes or 1}x{num_threads}"))
+        print(f"      [Trace] {trace_path} | {csv_path}")
+
+    print(f"      [Load Balancing] Process / Thread Breakdown:")
+    for (pid, tid), count in sorted(worker_stats.items()):
+        print(f"         - PID {pid} / TID {tid}: Processed {count} images")
+    print("")
+
+    return duration
+
+
+def parse_hybrid(text):
+    """'2x4,4x2' -> [(2, 4), (4, 2)] (processes, threads per process)"""
+    configs = []
+    for part in text.split(","):
+        processes, threads = part.lower().split("x")
+        configs.append((int(processes), int(threads)))
+    return configs
+
+
+# Command line options (defaults reproduce the original benchmark)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Thread pool and hybrid process x thread image processing benchmark")
+    add_processing_arguments(parser)
+    add_dispatch_arguments(parser, in_memory=False)
+    parser.add_argument("--mode", choices=["threads", "hybrid", "both"], default="both",
+                        help="threads = ThreadPoolExecutor, hybrid = processes x threads")
+    parser.add_argument("--threads", default="2,4,8",
+                        help="Thread counts for the thread pool tests")
+    parser.add_argument("--hybrid", default="2x4,4x2,8x2",
+                        help="Process x thread configurations for the hybrid tests")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    print(f"\n{'='*60}")
+    print(f"Automated Performance Test: Threads and Hybrid Processes x Threads")
+    print(f"{'='*60}")
+
+    # Path setup
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = input_folder_from_args(args, project_root) # input_images, or --input-shards
+    OUTPUT_FOLDER = os.path.join(project_root, "output_threads")
+
+    task_options = task_options_from_args(args, project_root)
+    print_run_options(args, task_options)
+
+    if not os.path.exists(INPUT_FOLDER):
+        print(f"Error: Could not find input folder at: {INPUT_FOLDER}")
+        return
+
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    prepare_output_folders(OUTPUT_FOLDER, task_options["filters"]) # created once, shared by every thread
+
+    # Images are discovered lazily: the pools start on the first paths while
+    # the rest of the tree is still being walked
+    image_paths = image_source_from_args(args, INPUT_FOLDER, project_root)
+
+    if image_paths.is_empty():
+        print(f"No images found. Please add images to 'input_images' folder.")
+        return
+
+    print(f"Streaming images from {INPUT_FOLDER}\n")
+
+    # Size-aware scheduling reads every header up front (fifo keeps the lazy stream)
+    image_paths, costs = apply_schedule(args.schedule, image_paths, args.max_side)
+
+    serial_time = load_serial_baseline(baseline_options(args, task_options))
+    print(f"Using serial baseline: {serial_time:.4f}s")
+
+    # (label, processes or None, threads)
+    configs = []
+    if args.mode in ("threads", "both"):
+        configs += [(f"{t} threads", None, t) for t in (int(n) for n in args.threads.split(","))]
+    if args.mode in ("hybrid", "both"):
+        configs += [(f"{p}x{t} hybrid", p, t) for p, t in parse_hybrid(args.hybrid)]
+
+    print("Starting Parallel Tests...")
+    results = {}
+    for label, processes, threads in configs:
+        results[label] = run_test_with_threads(threads, image_paths, OUTPUT_FOLDER, task_options,
+                                               args.engine, args.batch_size,
+                                               args.chunksize, args.max_in_flight, processes,
+                                               trace_dir_from_args(args, project_root), costs)
+
+    # Efficiency = speedup / workers (processes x threads), as in benchmark.py and create_graphs.py.
+    # Per core divides by the cores the workers can actually use: 8x2 hybrid
+    # (16 threads) on 8 vCPUs still only has 8 cores to run on
+    cpu_count = effective_cpu_count()
+    print(f"{'-'*60}")
+    print(f"{'Config':<14} | {'Time (s)':<10} | {'Speedup (x)':<12} | {'Efficiency':<10} | {'Per core':<8}")
+    print(f"{'-'*60}")
+    for label, processes, threads in configs:
+        time_taken = results[label]
+        speedup = serial_time / time_taken
+        workers = (processes or 1) * threads
+        efficiency = f"{speedup / workers * 100:.0f}%"
+        per_core = f"{speedup / min(workers, cpu_count) * 100:.0f}%"
+        print(f"{label:<14} | {time_taken:<10.4f} | {speedup:<12.2f} | {efficiency:<10} | {per_core:<8}")
+
+    if costs is None:
+        print(f"Discovery: {image_paths.describe()}")
+    print(f"{'='*60}")
+    if task_options["cache_dir"]:
+        print_cache_report(task_options["cache_dir"], max_mb=args.cache_max_mb, max_age_days=args.cache_max_age_days)
+    print("Test Complete.")
+
+if __name__ == '__main__':
+    # On Windows, multiprocessing requires the main guard
+    main()
@@ -0,0 +1,149 @@
+import os
+import time
+import collections
+import functools
+import numpy as np
+from PIL import Image
+from filters import resolve_filters, prepare_output_folders, open_image, BLUR_RADIUS
+from numpy_engine import box_blur_radius
+from scheduling import read_dimensions
+from dispatch import ChunkSizer
+from shared_transport import FrameSlab, output_shape, filter_frame, _attached_view
+from run_options import DEFAULT_TILE_SIZE, DEFAULT_THRESHOLD_MP
+
+# TILED PROCESSING FOR VERY LARGE IMAGES (--tile)
+# A 50-200 MP scan processed whole needs several copies of the full frame in
+# one worker, and only that one worker does any work on it. In tiled mode:
+#   - the parent decodes the image once into shared memory and preallocates
+#     one shared output frame per filter
+#   - the frame is cut into tiles; each task filters one tile plus a halo
+#     (a border borrowed from its neighbours) wide enough for every filter's
+#     footprint, then writes only the tile itself into the output frames
+#   - the tiles are spread over the whole pool, so one image uses every core
+#     and a worker never holds more than one padded tile
+# At the real image edges there is no halo, so every filter sees exactly the
+# edge handling it has on the whole frame: the stitched result has no seams
+# and is identical to processing the image in one piece.
+
+# Pixels each filter reads beyond the pixel it writes
+HALO = {
+    "grayscale": 0,
+    "brightness": 0,
+    "edge": 1,    # 3x3 kernel on the luminance plane
+    "sharpen": 1, # 3x3 SMOOTH kernel blended with the original
+    # Pillow's Gaussian blur = 3 box blur passes, each reading int(r) + 1 pixels per side
+    "blur": 3 * (int(box_blur_radius(BLUR_RADIUS, 3)) + 1),
+}
+
+# One tile of work: where the full frames live, which part to write, how far to read around it
+TileTask = collections.namedtuple("TileTask", ["name", "input_spec", "output_specs", "box", "halo"])
+
+
+def halo_for(filters):
+    return max((HALO[name] for name in resolve_filters(filters)), default=0)
+
+
+def tile_boxes(width, height, tile_size=DEFAULT_TILE_SIZE):
+    """(left, top, right, bottom) of every tile, row by row."""
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in range(0, height, tile_size)
+            for x in range(0, width, tile_size)]
+
+
+def filter_tile(task, filters=None, engine="pillow"):
+    """Worker side: filters one padded tile and writes its inner part into the shared outputs."""
+    pixels = _attached_view(task.input_spec)
+    height, width = pixels.shape[:2]
+    left, top, right, bottom = task.box
+    # Padded region, clipped to the image (no halo at the real edges)
+    pad_left, pad_top = max(left - task.halo, 0), max(top - task.halo, 0)
+    pad_right, pad_bottom = min(right + task.halo, width), min(bottom + task.halo, height)
+
+    region = np.ascontiguousarray(pixels[pad_top:pad_bottom, pad_left:pad_right])
+    inner = (slice(top - pad_top, bottom - pad_top), slice(left - pad_left, right - pad_left))
+    for name, array in filter_frame(region, resolve_filters(filters), engine).items():
+        output = _attached_view(task.output_specs[name])
+        output[top:bottom, left:right] = array[inner]
+    return {"status": "Success", "filename": f"{task.name} tile {left},{top}", "pid": os.getpid()}
+
+
+class LargeImageSplitter:
+    """
+    Splits the input stream into images processed normally and images to tile
+    (read from the headers). A list input is split at once; a lazy stream is
+    split while it is consumed, and `large` is complete once it has been.
+    """
+
+    def __init__(self, image_paths, threshold_mp=DEFAULT_THRESHOLD_MP):
+        self.image_paths = image_paths
+        self.threshold = threshold_mp * 1000000
+        self.large = []
+        if isinstance(image_paths, list):
+            self.small = list(self._split())
+
+    def _split(self):
+        self.large = []
+        for path in self.image_paths:
+            size = read_dimensions(path)
+            if size and size[0] * size[1] > self.threshold:
+                self.large.append(path)
+            else:
+                yield path
+
+    def __iter__(self):
+        if isinstance(self.image_paths, list):
+            return iter(self.small)
+        return self._split()
+
+    def normal_images(self):
+        """What the regular per-image / batch dispatch should process."""
+        return self.small if isinstance(self.image_paths, list) else self
+
+
+def process_tiled(file_path, output_folder, stream, num_workers, filters=None, engine="pillow",
+                  tile_size=DEFAULT_TILE_SIZE, save_func=None):
+    """
+    Filters one large image across the pool.
+    stream(worker_func, items, sizer) is the backend's dispatch function, e.g.
+    functools.partial(stream_pool_results, pool). Returns a process_image style result.
+    save_func(img, path) replaces img.save(path) for the stitched outputs (see filters.output_save_func).
+    """
+    category_name = os.path.basename(os.path.dirname(file_path))
+    filename = f"{category_name}_{os.path.basename(file_path)}"
+    filters = resolve_filters(filters)
+    slabs = []
+    try:
+        folders = prepare_output_folders(output_folder, filters)
+        start = time.perf_counter()
+        frame = np.asarray(open_image(file_path))
+        input_slab = FrameSlab([frame.shape])
+        slabs.append(input_slab)
+        np.copyto(input_slab.view(0), frame)
+        del frame # the shared copy is the only one kept
+        outputs = {name: FrameSlab([output_shape(input_slab.shapes[0], name)]) for name in filters}
+        slabs.extend(outputs.values())
+
+        height, width = input_slab.shapes[0][:2]
+        halo = halo_for(filters)
+        items = [TileTask(filename, input_slab.spec(0), {name: slab.spec(0) for name, slab in outputs.items()},
+                          box, halo)
+                 for box in tile_boxes(width, height, tile_size)]
+        worker_func = functools.partial(filter_tile, filters=filters, engine=engine)
+        # One tile per task: tiles are already large, even units of work
+        sizer = ChunkSizer(num_workers, total=len(items), chunksize=1)
+        errors = [result.get("error") for result in stream(worker_func, items, sizer)
+                  if result.get("status") != "Success"]
+        if errors:
+            raise RuntimeError(f"{len(errors)} tile(s) failed: {errors[0]}")
+
+        # Encode the stitched outputs
+        save = save_func or (lambda img, path: img.save(path))
+        for name, slab in outputs.items():
+            save(Image.fromarray(slab.view(0)), os.path.join(folders[name], filename))
+        return {"status": "Success", "filename": filename, "pid": os.getpid(), "tiles": len(items),
+                "tile_seconds": time.perf_counter() - start}
+    except Exception as e:
+        return {"status": "Error", "filename": filename, "error": str(e), "pid": os.getpid()}
+    finally:
+        for slab in slabs:
+            slab.close()
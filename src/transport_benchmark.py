@@ -0,0 +1,98 @@
+import os
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from dispatch import ChunkSizer, stream_pool_results, stream_executor_results
+from shared_transport import InMemoryJob, decode_frames
+
+# TRANSPORT BENCHMARK
+# Filters the same decoded frames through a worker pool twice per backend:
+#   - pickle: frames and filtered arrays are pickled through the pipe
+#   - shared: only (offset, shape) specs travel, pixels stay in shared memory
+# and checks that both transports produce identical outputs.
+
+
+def run_job(backend, num_workers, frames, transport, engine, chunksize):
+    """Returns (seconds, MB of pixels through the pipe, job). Caller closes the job."""
+    job = InMemoryJob(frames, transport, engine=engine)
+    sizer = ChunkSizer(num_workers, total=len(job.items), chunksize=chunksize)
+    start = time.perf_counter()
+    if backend == "pool":
+        with multiprocessing.Pool(processes=num_workers) as pool:
+            for result in stream_pool_results(pool, job.worker_func, job.items, sizer):
+                job.collect(result)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            for result in stream_executor_results(executor, job.worker_func, job.items, sizer):
+                job.collect(result)
+    duration = time.perf_counter() - start
+    return duration, job.bytes_through_pipe / 1024 / 1024, job
+
+
+def outputs_match(job_a, job_b, names):
+    for name in names:
+        a = job_a.outputs(name)
+        b = job_b.outputs(name)
+        for filter_name in a:
+            if not np.array_equal(a[filter_name], b[filter_name]):
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared memory vs pickle pixel transport benchmark")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sample", type=int, default=200,
+                        help="Number of images to decode and filter")
+    parser.add_argument("--engine", choices=["pillow", "numpy"], default="numpy")
+    parser.add_argument("--chunksize", type=int, default=None)
+    parser.add_argument("--max-side", type=int, default=None)
+    args = parser.parse_args()
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    INPUT_FOLDER = os.path.join(project_root, "input_images")
+
+    image_paths = []
+    for root, dirs, files in os.walk(INPUT_FOLDER):
+        for file in files:
+            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                image_paths.append(os.path.join(root, file))
+    image_paths = sorted(image_paths)[:args.sample]
+
+    if not image_paths:
+        print(f"No images found in {INPUT_FOLDER}.")
+        return
+
+    frames = decode_frames(image_paths, args.max_side)
+    input_mb = sum(frame.nbytes for frame in frames.values()) / 1024 / 1024
+
+    print(f"\n{'='*60}")
+    print(f"Transport Benchmark: {len(frames)} frames ({input_mb:.1f} MB), "
+          f"{args.workers} workers, {args.engine} engine")
+    print(f"{'='*60}")
+    print(f"{'Backend':<10} | {'Transport':<10} | {'Time (s)':<10} | {'Pipe (MB)':<10} | {'Speedup':<8}")
+    print(f"{'-'*60}")
+
+    for backend in ("pool", "futures"):
+        pickle_time, pickle_mb, pickle_job = run_job(backend, args.workers, frames, "pickle",
+                                                     args.engine, args.chunksize)
+        shared_time, shared_mb, shared_job = run_job(backend, args.workers, frames, "shared",
+                                                     args.engine, args.chunksize)
+        same = outputs_match(pickle_job, shared_job, list(frames))
+        shared_job.close()
+        pickle_job.close()
+
+        print(f"{backend:<10} | {'pickle':<10} | {pickle_time:<10.4f} | {pickle_mb:<10.1f} | {1.0:<8.2f}")
+        print(f"{backend:<10} | {'shared':<10} | {shared_time:<10.4f} | {shared_mb:<10.1f} | "
+              f"{pickle_time / shared_time:<8.2f}")
+        if not same:
+            print(f"❌ Error: {backend} outputs differ between transports!")
+
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
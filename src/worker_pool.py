@@ -0,0 +1,139 @@
+import os
+import atexit
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+# FAST WORKER STARTUP (--start-method, --persistent-pool)
+# For short jobs on small folders, starting the pool costs more than the work:
+# every spawned worker starts a fresh interpreter and imports PIL again.
+#   - forkserver: one server process imports filters (and PIL) once; every
+#     worker is forked from it already warm, without copying the parent's
+#     state the way fork does
+#   - persistent pool: one pool is kept for the whole program and reused by
+#     every trial and job. A trial with fewer workers than the pool holds
+#     limits its chunks in flight to its worker count, so no more than that
+#     many workers are busy at once
+# Heavy modules are imported lazily where workers do not need them (numpy
+# is only loaded by numpy-engine workers), which also speeds up spawn.
+# With pin / worker_threads every worker is set up by cpu_affinity.WorkerSetup.
+
+START_METHODS = ("default", "fork", "spawn", "forkserver")
+
+# Imported once by the forkserver, inherited by every worker it forks
+PRELOAD = ["filters", "dispatch", "PIL.Image", "PIL.ImageFilter", "PIL.ImageEnhance", "PIL.JpegImagePlugin",
+           "PIL.PngImagePlugin"]
+
+# (kind, start method) -> (pool, number of workers); closed at exit
+_persistent = {}
+
+
+def get_context(start_method=None):
+    """Multiprocessing context for a start method (None / "default" = the platform default)."""
+    if not start_method or start_method == "default":
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        # Only takes effect before the forkserver process starts (the first pool)
+        context.set_forkserver_preload(PRELOAD)
+    return context
+
+
+class WorkerInit:
+    """Runs several (function, args) initializers in every worker (picklable for spawn / forkserver)."""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __call__(self):
+        for func, args in self.steps:
+            func(*args)
+
+
+def _create(kind, num_workers, context, pin=False, worker_threads=None, write_errors=None):
+    steps = []
+    if pin or worker_threads:
+        from cpu_affinity import WorkerSetup
+        steps.append((WorkerSetup(context, num_workers, pin, worker_threads), ()))
+    if write_errors is not None:
+        from writer import count_errors_in
+        steps.append((count_errors_in, (write_errors,)))
+    initializer = WorkerInit(steps) if steps else None
+    if kind == "pool":
+        return context.Pool(processes=num_workers, initializer=initializer)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                                                  initializer=initializer)
+
+
+def _shutdown(kind, pool):
+    if kind == "pool":
+        # close + join (instead of terminate) so background writers flush
+        pool.close()
+        pool.join()
+    else:
+        pool.shutdown(wait=True)
+
+
+@contextlib.contextmanager
+def worker_pool(kind, num_workers, start_method=None, persistent=False, reserve=None,
+                pin=False, worker_threads=None, write_errors=None):
+    """
+    Yields (pool, in-flight limit) for kind "pool" (multiprocessing.Pool) or
+    "executor" (ProcessPoolExecutor). A fresh pool is shut down on exit; a
+    persistent one is reused (and grown if num_workers is larger) until the
+    program ends. reserve = size to create a persistent pool with (the largest
+    trial), so later trials do not have to grow it.
+    pin / worker_threads: bind each worker to its own core set and cap its
+    library threads (see cpu_affinity).
+    write_errors: counter from writer.shared_error_count that the workers add their
+    failed background writes to when they exit (fresh pools only: --async-write
+    never runs on a persistent pool).
+    The limit is None unless the pool has more workers than asked for.
+    """
+    if not persistent:
+        pool = _create(kind, num_workers, get_context(start_method), pin, worker_threads, write_errors)
+        try:
+            yield pool, None
+        finally:
+            _shutdown(kind, pool)
+        return
+
+    key = (kind, start_method or "default", pin, worker_threads)
+    pool, size = _persistent.get(key, (None, 0))
+    if size < num_workers:
+        if pool is not None:
+            _shutdown(kind, pool)
+        size = max(num_workers, reserve or 0)
+        pool = _create(kind, size, get_context(start_method), pin, worker_threads)
+        _persistent[key] = (pool, size)
+    yield pool, (num_workers if size > num_workers else None)
+
+
+def in_flight_limit(max_in_flight, pool_limit):
+    """Chunks in flight for a trial that must not use more than pool_limit workers."""
+    if pool_limit is None:
+        return max_in_flight
+    return min(max_in_flight, pool_limit) if max_in_flight else pool_limit
+
+
+def close_persistent_pools():
+    for (kind, *_), (pool, _) in list(_persistent.items()):
+        _shutdown(kind, pool)
+    _persistent.clear()
+
+
+atexit.register(close_persistent_pools)
+
+
+def persistent_allowed(task_options):
+    """
+    Background writers only flush when their worker exits, so a pool that
+    outlives the run would report outputs that are not on disk yet.
+    """
+    return not (task_options or {}).get("async_write")
+
+
+def warm_up(_=None):
+    """Trivial task: imports what process_image needs and returns the worker's PID."""
+    import filters # noqa: F401 (already loaded when preloaded by the forkserver)
+    return os.getpid()
@@ -0,0 +1,117 @@
+import queue
+import multiprocessing
+import threading
+import multiprocessing.util
+
+# ASYNCHRONOUS ENCODE/WRITE STAGE
+# process_image hands finished images to a bounded queue instead of saving
+# them itself. A small pool of writer threads does the JPEG encoding and the
+# disk write, so the worker can start filtering the next image while the
+# previous one is still being written. Pillow releases the GIL while encoding,
+# so the writer threads really do run alongside the filters.
+
+DEFAULT_WRITER_THREADS = 2
+DEFAULT_MAX_PENDING = 16 # images waiting in the queue before submit() blocks
+
+
+class AsyncWriter:
+    """Bounded queue feeding a pool of writer threads."""
+
+    def __init__(self, num_threads=DEFAULT_WRITER_THREADS, max_pending=DEFAULT_MAX_PENDING):
+        # Bounded: when the disk is slower than the filters, submit() blocks
+        # (backpressure) instead of letting finished images pile up in memory
+        self.tasks = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.written = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        for _ in range(num_threads):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, img_obj, save_path, save_func=None):
+        """
+        Queue an image to be encoded and written to save_path.
+        save_func(img_obj, save_path) replaces the plain img_obj.save() if given.
+        """
+        self.tasks.put((img_obj, save_path, save_func))
+
+    def _run(self):
+        while True:
+            item = self.tasks.get()
+            if item is None: # shutdown signal
+                self.tasks.task_done()
+                return
+            img_obj, save_path, save_func = item
+            try:
+                if save_func:
+                    save_func(img_obj, save_path)
+                else:
+                    img_obj.save(save_path)
+                with self.lock:
+                    self.written += 1
+            except Exception as e:
+                with self.lock:
+                    self.errors.append((save_path, str(e)))
+                print(f"❌ Error: Could not write {save_path}: {e}")
+            finally:
+                self.tasks.task_done()
+
+    def flush(self):
+        """Block until every queued image has been written."""
+        self.tasks.join()
+
+    def close(self):
+        """Flush the queue and stop the writer threads."""
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+# One writer per process (created the first time a worker needs it)
+_writer = None
+_writer_lock = threading.Lock() # thread-pool workers share the process's writer
+
+# Pool workers flush their writer when they exit, after their last result was
+# sent, so failed writes are added to a counter shared with the parent instead
+_error_count = None
+
+
+def shared_error_count():
+    """Parent side: a counter the workers of one pool add their failed writes to (read it after shutdown)."""
+    return multiprocessing.Value("i", 0)
+
+
+def count_errors_in(counter):
+    """Pool initializer: failed writes of this worker are added to counter when its writer closes."""
+    global _error_count
+    _error_count = counter
+
+
+def get_writer(num_threads=DEFAULT_WRITER_THREADS):
+    """Returns this process's writer, starting it on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AsyncWriter(num_threads)
+            # Pool and ProcessPoolExecutor workers run multiprocessing finalizers when
+            # they shut down normally, so pending writes are flushed before the worker exits
+            multiprocessing.util.Finalize(None, close_writer, exitpriority=10)
+        return _writer
+
+
+def close_writer():
+    """Flushes and stops this process's writer. Returns (written, errors)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            return 0, []
+        writer, _writer = _writer, None
+    writer.close()
+    if _error_count is not None and writer.errors:
+        with _error_count.get_lock():
+            _error_count.value += len(writer.errors)
+    return writer.written, writer.errors
@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from dedup import group_hashes
+
+
+def test_chain_is_not_merged():
+    # A~B and B~C (4 bits each) but A and C are 8 bits apart
+    hashes = {"a": 0x0, "b": 0xF, "c": 0xFF}
+    assert group_hashes(hashes, 4) == [["a", "b"]]
+
+
+def test_member_joins_closest_representative():
+    # b is within reach of both representatives a and c, and closer to c
+    hashes = {"a": 0x0, "c": 0xFF, "b": 0xFE}
+    assert group_hashes(hashes, 4) == [["c", "b"]]
+
+
+def test_every_member_within_threshold_of_representative():
+    hashes = {f"img{i}": (1 << i) - 1 for i in range(20)} # each one bit further than the last
+    for group in group_hashes(hashes, 3):
+        for name in group[1:]:
+            assert bin(hashes[group[0]] ^ hashes[name]).count("1") <= 3